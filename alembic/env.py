@@ -13,7 +13,8 @@ target_metadata = metadata
 def include_object(object, name, type_, reflected, compare_to):
     print(f"Object: {name}, Type: {type_}, Reflected: {reflected}")  # Debug output
     if type_ == "table":
-        return name in ["user", "product", "inventory", "transaction"]
+        return name in ["user", "product", "inventory", "transaction", "idempotency_record", "product_purchase_daily",
+                        "outbox"]
     return True
 
 
@@ -0,0 +1,90 @@
+"""Partition transaction by month
+
+Revision ID: e4b8a2c6d1f7
+Revises: c7e2f9a1d3b8
+Create Date: 2026-10-18 17:05:42.118305
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4b8a2c6d1f7'
+down_revision: Union[str, None] = 'c7e2f9a1d3b8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Months created past the current one, matching the default of Settings.transaction_partitions_ahead
+PARTITIONS_AHEAD = 3
+
+
+def upgrade() -> None:
+    op.execute('ALTER TABLE "transaction" RENAME TO transaction_unpartitioned')
+    op.execute('ALTER TABLE transaction_unpartitioned RENAME CONSTRAINT transaction_pkey TO transaction_unpartitioned_pkey')
+    op.execute('DROP INDEX transaction_status_created_at_idx')
+
+    # The partition key has to be part of the primary key
+    op.execute(
+        """
+        CREATE TABLE "transaction" (
+            id integer NOT NULL DEFAULT nextval('transaction_id_seq'),
+            user_id integer NOT NULL REFERENCES "user" (id),
+            product_id integer NOT NULL REFERENCES product (id),
+            amount integer NOT NULL,
+            status status NOT NULL,
+            created_at timestamp without time zone NOT NULL,
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+        """
+    )
+    op.execute('ALTER SEQUENCE transaction_id_seq OWNED BY "transaction".id')
+    op.execute('CREATE TABLE transaction_default PARTITION OF "transaction" DEFAULT')
+    op.execute(
+        f"""
+        DO $$
+        DECLARE
+            month date := date_trunc('month', coalesce((SELECT min(created_at) FROM transaction_unpartitioned), localtimestamp));
+        BEGIN
+            WHILE month <= date_trunc('month', localtimestamp) + interval '{PARTITIONS_AHEAD} months' LOOP
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF "transaction" FOR VALUES FROM (%L) TO (%L)',
+                    'transaction_p' || to_char(month, 'YYYY_MM'), month, month + interval '1 month'
+                );
+                month := month + interval '1 month';
+            END LOOP;
+        END $$
+        """
+    )
+    op.execute('INSERT INTO "transaction" SELECT id, user_id, product_id, amount, status, created_at FROM transaction_unpartitioned')
+    op.execute('DROP TABLE transaction_unpartitioned')
+    op.execute(
+        """CREATE INDEX transaction_status_created_at_idx ON "transaction" (status, created_at) """
+        """WHERE status = 'COMPLETED'"""
+    )
+
+
+def downgrade() -> None:
+    op.execute('ALTER TABLE "transaction" RENAME TO transaction_partitioned')
+    op.execute('ALTER TABLE transaction_partitioned RENAME CONSTRAINT transaction_pkey TO transaction_partitioned_pkey')
+    op.execute('ALTER INDEX transaction_status_created_at_idx RENAME TO transaction_partitioned_status_created_at_idx')
+    op.execute(
+        """
+        CREATE TABLE "transaction" (
+            id integer NOT NULL DEFAULT nextval('transaction_id_seq') PRIMARY KEY,
+            user_id integer NOT NULL REFERENCES "user" (id),
+            product_id integer NOT NULL REFERENCES product (id),
+            amount integer NOT NULL,
+            status status NOT NULL,
+            created_at timestamp without time zone NOT NULL
+        )
+        """
+    )
+    op.execute('ALTER SEQUENCE transaction_id_seq OWNED BY "transaction".id')
+    op.execute('INSERT INTO "transaction" SELECT id, user_id, product_id, amount, status, created_at FROM transaction_partitioned')
+    op.execute('DROP TABLE transaction_partitioned')
+    op.execute(
+        """CREATE INDEX transaction_status_created_at_idx ON "transaction" (status, created_at) """
+        """WHERE status = 'COMPLETED'"""
+    )
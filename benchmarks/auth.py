@@ -0,0 +1,60 @@
+"""Authentication dependency path: decoding and hashing the token on every request against the verified-JWT cache,
+over 10k distinct tokens.
+
+    python -m benchmarks.auth
+"""
+import time
+import timeit
+
+import jwt
+from starlette.requests import Request
+
+from src.infrastructure.utils.helpers import generate_hash, generate_jwt
+from src.presentation.api.token_cache import VerifiedTokenCache
+
+SECRET_KEY = "benchmark-secret-key-of-32-bytes!"
+TOKENS = 10_000
+
+
+def request(token: str) -> Request:
+    return Request({"type": "http", "headers": [(b"authorization", f"Bearer {token}".encode())]})
+
+
+def uncached(requests: list[Request]) -> None:
+    """``get_authenticated_user_id`` and ``get_user_id_for_rate_limit`` before the cache"""
+    for req in requests:
+        token = req.headers["authorization"].split(" ")[1]
+        jwt.decode(token, SECRET_KEY, algorithms=["HS256"])["id"]
+        f"token:{generate_hash(token)}"
+
+
+def cached(cache: VerifiedTokenCache, requests: list[Request]) -> None:
+    for req in requests:
+        token = req.headers["authorization"].split(" ")[1]
+        cache.verify(token).payload["id"]
+        cache.rate_limit_key(token)
+
+
+def measure(fn, repeat: int = 5) -> float:
+    return min(timeit.repeat(fn, number=1, repeat=repeat)) / TOKENS * 1e6
+
+
+def main():
+    expires_at = int(time.time()) + 60 * 60
+    requests = [request(generate_jwt({"id": n, "exp": expires_at}, SECRET_KEY)) for n in range(TOKENS)]
+    warm = VerifiedTokenCache(SECRET_KEY, max_size=TOKENS)
+    cached(warm, requests)
+    results = {
+        "decode + hash": measure(lambda: uncached(requests)),
+        "cache (cold)": measure(lambda: cached(VerifiedTokenCache(SECRET_KEY, max_size=TOKENS), requests)),
+        "cache (warm)": measure(lambda: cached(warm, requests)),
+        # Every lookup misses: the LRU holds a tenth of the tokens cycling through it
+        "cache (thrashing)": measure(lambda: cached(VerifiedTokenCache(SECRET_KEY, max_size=TOKENS // 10), requests)),
+    }
+    print(f"{'path':<20} {'us/request':>12}")
+    for path, elapsed in results.items():
+        print(f"{path:<20} {elapsed:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Inventory response serialization: the previous decode -> pydantic -> encode path against hydrating the cached
+quantities from the product catalog and encoding them with orjson.
+
+    python -m benchmarks.serialization
+"""
+import asyncio
+import json
+import timeit
+from dataclasses import asdict
+from datetime import datetime
+from types import SimpleNamespace
+
+from fastapi.encoders import jsonable_encoder
+
+from src.application.catalog import ProductCatalog
+from src.application.inventory_cache import COMPLETE, inventory_field
+from src.application.models.inventory import Inventory
+from src.application.models.product import Product
+from src.application.models.user import User
+from src.application.use_cases.show_inventory import ShowInventory
+from src.infrastructure.cache import InMemoryCache
+from src.interfaces.domain_model import DomainModel, convert_value
+from src.presentation.api.schema.responses import InventoryItem, InventoryResponse
+from src.presentation.api.serialization import json_response
+
+SIZES = (10, 100, 1000)
+
+
+def legacy_asdict(model: DomainModel) -> dict:
+    """``DomainModel.asdict`` before converters were compiled per class"""
+    return {key: convert_value(value) for key, value in asdict(model).items()}
+
+
+def inventories(size: int) -> list[Inventory]:
+    user = User(id=1, username="user", email="user@example.com", balance=1000)
+    return [
+        Inventory(
+            id=n,
+            user=user,
+            product=Product(
+                id=n, name=f"Product {n}", description="", price=n, type=Product.Type.CONSUMABLE, is_active=True
+            ),
+            quantity=n % 7,
+            purchased_at=datetime.now(),
+        )
+        for n in range(size)
+    ]
+
+
+class Products:
+    def __init__(self, products: list[Product]):
+        self.products = products
+
+    async def list_products(self) -> list[Product]:
+        return self.products
+
+
+class CachedInventory:
+    def __init__(self, cached: dict[str, str]):
+        self.cached = cached
+
+    async def hgetall(self, key: str, load, options: dict = None) -> dict[str, str]:
+        return self.cached
+
+
+def cached_hash(items: list[Inventory]) -> dict[str, str]:
+    cached = {COMPLETE: "0"}
+    for inventory in items:
+        cached.update(inventory_field(inventory.product.id, inventory.quantity, inventory.purchased_at))
+    return cached
+
+
+def old_response(items: list[dict]) -> bytes:
+    items = [
+        InventoryItem(
+            product_id=item["product_id"],
+            name=item["name"],
+            type=item["type"],
+            price=item["price"],
+            quantity=item["quantity"],
+            purchased_at=item["purchased_at"],
+        )
+        for item in items
+    ]
+    # What FastAPI does with a returned model: validate against the response model, encode, json.dumps
+    response = InventoryResponse.model_validate(InventoryResponse(products=items).model_dump())
+    return json.dumps(jsonable_encoder(response), separators=(",", ":")).encode()
+
+
+def new_response(loop: asyncio.AbstractEventLoop, usecase: ShowInventory) -> bytes:
+    return json_response({"products": loop.run_until_complete(usecase(1)), "next_cursor": None}).body
+
+
+def measure(fn, number: int) -> float:
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e6
+
+
+def main():
+    print(f"{'items':>6} {'path':<28} {'us/op':>12}")
+    loop = asyncio.new_event_loop()
+    for size in SIZES:
+        items = inventories(size)
+        catalog = ProductCatalog(Products([item.product for item in items]), InMemoryCache())
+        loop.run_until_complete(catalog.load())
+        usecase = ShowInventory(SimpleNamespace(read_through=CachedInventory(cached_hash(items)), catalog=catalog))
+        decoded = loop.run_until_complete(usecase(1))
+        number = max(10, 10000 // size)
+        assert json.loads(old_response(decoded)) == json.loads(new_response(loop, usecase))
+        results = {
+            "asdict (dataclasses)": measure(lambda: [legacy_asdict(item) for item in items], number),
+            "asdict (compiled)": measure(lambda: [item.asdict() for item in items], number),
+            "response (pydantic)": measure(lambda: old_response(decoded), number),
+            "response (catalog, orjson)": measure(lambda: new_response(loop, usecase), number),
+        }
+        for path, elapsed in results.items():
+            print(f"{size:>6} {path:<28} {elapsed:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""Process-local snapshot of the product catalog.
+
+Products are kept in parallel arrays sorted by id. Whoever changes products calls ``publish_changes``, which appends
+the changed ids to the ``catalog:changes`` stream and bumps ``catalog:version``. Every snapshot polls the version at
+most once per ``check_interval`` and, when it moved, reloads only the products appended to the stream since its
+cursor. Until then readers may see a product as it was up to ``check_interval`` seconds ago.
+"""
+import time
+from array import array
+from bisect import bisect_left
+from typing import Iterable, NamedTuple
+
+from src.interfaces.cache import Cache, CacheOperation
+from .models.product import Product
+from .repositories.product import ProductRepository
+from .single_flight import SingleFlight
+
+CATALOG_VERSION_KEY = "catalog:version"
+CATALOG_CHANGES_STREAM = "catalog:changes"
+CATALOG_CHANGES_MAXLEN = 10_000
+
+_TYPES = list(Product.Type)
+
+
+class CatalogEntry(NamedTuple):
+    id: int
+    name: str
+    description: str
+    price: int
+    type: Product.Type
+    is_active: bool = True
+
+
+class ProductCatalog:
+    def __init__(
+        self,
+        repository: ProductRepository,
+        cache: Cache,
+        single_flight: SingleFlight = None,
+        check_interval: float = 1.0,
+    ):
+        self.repository = repository
+        self.cache = cache
+        self.single_flight = single_flight or SingleFlight()
+        self.check_interval = check_interval
+        self._ids = array("q")
+        self._prices = array("q")
+        self._types = array("B")
+        self._names: list[str] = []
+        self._descriptions: list[str] = []
+        self._loaded = False
+        self._version: str | None = None
+        self._cursor = "0-0"
+        self._checked_at = float("-inf")
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    async def load(self) -> None:
+        """Loads every active product, replacing the snapshot"""
+        # Read before the products, so that changes made while they load are picked up by the next refresh
+        version = await self.cache.get(CATALOG_VERSION_KEY)
+        latest = await self.cache.xrange(CATALOG_CHANGES_STREAM, options={"reverse": True, "count": 1})
+        products = await self.repository.list_products()
+        self._replace({product.id: _entry(product) for product in products})
+        self._version = version
+        self._cursor = latest[0][0] if latest else "0-0"
+        self._loaded = True
+        self._checked_at = time.monotonic()
+
+    async def get(self, product_id: int) -> CatalogEntry | None:
+        return (await self.get_many([product_id])).get(product_id)
+
+    async def get_many(self, product_ids: Iterable[int]) -> dict[int, CatalogEntry]:
+        """Entries of the given products, reading the ids missing from the snapshot from the database"""
+        await self._ensure_fresh()
+        found, missing = {}, []
+        for product_id in product_ids:
+            entry = self._lookup(product_id)
+            if entry is None:
+                missing.append(product_id)
+            else:
+                found[product_id] = entry
+        if missing:
+            products = await self.repository.find_products(missing)
+            found.update((product.id, _entry(product)) for product in products)
+            if any(product.is_active for product in products):
+                self._merge(products)
+        return found
+
+    async def find_product(self, product_id: int) -> Product | None:
+        entry = await self.get(product_id)
+        if entry is None:
+            return None
+        return Product(
+            id=entry.id,
+            name=entry.name,
+            description=entry.description,
+            price=entry.price,
+            type=entry.type,
+            is_active=entry.is_active,
+        )
+
+    async def publish_changes(self, product_ids: Iterable[int]) -> None:
+        """Makes every snapshot reload the given products on its next version check"""
+        operations = [
+            CacheOperation(
+                CacheOperation.Kind.XADD,
+                CATALOG_CHANGES_STREAM,
+                ({"product_id": str(product_id)},),
+                {"maxlen": CATALOG_CHANGES_MAXLEN},
+            )
+            for product_id in product_ids
+        ]
+        # The version is bumped after the ids are appended, so a reader seeing it also sees them
+        await self.cache.apply(operations + [CacheOperation(CacheOperation.Kind.INCR, CATALOG_VERSION_KEY, (1,))])
+
+    async def _ensure_fresh(self) -> None:
+        if time.monotonic() - self._checked_at < self.check_interval:
+            return
+        await self.single_flight.do(CATALOG_VERSION_KEY, self._refresh)
+
+    async def _refresh(self) -> None:
+        version = await self.cache.get(CATALOG_VERSION_KEY)
+        if not self._loaded or int(version or 0) < int(self._version or 0):
+            # The version only goes back if Redis lost it, and the stream of changes with it
+            await self.load()
+            return
+        if version != self._version:
+            changes = await self.cache.xrange(CATALOG_CHANGES_STREAM, f"({self._cursor}")
+            if changes:
+                product_ids = {int(fields["product_id"]) for _, fields in changes}
+                products = await self.repository.find_products(list(product_ids))
+                self._merge(products, product_ids)
+                self._cursor = changes[-1][0]
+            self._version = version
+        self._checked_at = time.monotonic()
+
+    def _lookup(self, product_id: int) -> CatalogEntry | None:
+        index = bisect_left(self._ids, product_id)
+        if index == len(self._ids) or self._ids[index] != product_id:
+            return None
+        return CatalogEntry(
+            product_id, self._names[index], self._descriptions[index], self._prices[index], _TYPES[self._types[index]]
+        )
+
+    def _merge(self, products: list[Product], changed_ids: Iterable[int] = ()) -> None:
+        """Upserts the active products and drops the inactive or deleted ``changed_ids``"""
+        entries = {entry.id: entry for entry in map(self._lookup, self._ids)}
+        for product_id in changed_ids:
+            entries.pop(product_id, None)
+        entries.update((product.id, _entry(product)) for product in products if product.is_active)
+        self._replace(entries)
+
+    def _replace(self, entries: dict[int, CatalogEntry]) -> None:
+        ordered = [entries[product_id] for product_id in sorted(entries)]
+        self._ids = array("q", (entry.id for entry in ordered))
+        self._prices = array("q", (entry.price for entry in ordered))
+        self._types = array("B", (_TYPES.index(entry.type) for entry in ordered))
+        self._names = [entry.name for entry in ordered]
+        self._descriptions = [entry.description for entry in ordered]
+
+
+def _entry(product: Product) -> CatalogEntry:
+    return CatalogEntry(product.id, product.name, product.description, product.price, product.type, product.is_active)
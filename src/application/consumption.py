@@ -0,0 +1,29 @@
+"""Redis layout of write-behind consumption, see ``src/infrastructure/consumption.py``.
+
+Each user's remaining quantities are a hash ``consumption:counts:{user_id}`` by product id. Consumes not yet in the
+database are summed in ``consumption:pending`` by ``{user_id}:{product_id}``, until a flusher renames them into a
+batch ``consumption:batch:{id}`` listed in ``consumption:batches``.
+"""
+CONSUMPTION_PENDING_KEY = "consumption:pending"
+CONSUMPTION_BATCHES_KEY = "consumption:batches"
+# Bumped whenever a batch is claimed or finished
+CONSUMPTION_EPOCH_KEY = "consumption:epoch"
+# Also bounds how long a purchase missed by a concurrent load stays invisible to consumes
+CONSUMPTION_COUNTS_TTL = 60 * 10
+
+
+def consumption_counts_key(user_id: int) -> str:
+    return f"consumption:counts:{user_id}"
+
+
+def consumption_batch_key(batch_id: str) -> str:
+    return f"consumption:batch:{batch_id}"
+
+
+def consumption_ledger_key(batch_id: str) -> str:
+    """The batch's key in ``idempotency_record``"""
+    return f"consumption:{batch_id}"
+
+
+def pending_field(user_id: int, product_id: int) -> str:
+    return f"{user_id}:{product_id}"
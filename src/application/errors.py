@@ -8,3 +8,7 @@ class NotFound(Exception):
 
 class AccessError(Exception):
     pass
+
+
+class Conflict(Exception):
+    pass
@@ -0,0 +1,19 @@
+"""Compact events of completed transactions for other services.
+
+They are appended to the ``EVENTS_STREAM`` Redis stream through the outbox after commit, so a consumer may see an
+event twice (after a relay re-applies it) but never one of a rolled back transaction; ``id`` is unique per request.
+"""
+import time
+
+EVENTS_STREAM = "events:transactions"
+EVENTS_MAXLEN = 100_000
+
+
+def event(type_: str, id_: str, user_id: int, **fields) -> dict[str, str]:
+    return {
+        "type": type_,
+        "id": id_,
+        "user_id": str(user_id),
+        **{name: str(value) for name, value in fields.items() if value is not None},
+        "ts": str(int(time.time() * 1000)),
+    }
@@ -0,0 +1,86 @@
+"""Layout of the per-user inventory cache: a hash ``inventory:v{generation}:{user_id}`` with one JSON field per product
+id, holding the quantity and purchase time. Product details are joined from the ``ProductCatalog`` when the hash is
+read.
+
+The generation is the global ``inventory:generation`` counter, suffixed with ``.{n}`` once the user's own
+``inventory:generation:{user_id}`` has been set. Bumping either moves readers and writers to a new, empty hash, and
+the old ones expire on their own. The per-user generation is drawn from a shared sequence and outlives the hashes,
+so a hash is never reused once invalidated.
+
+Writes patch single fields after commit. A patch may land on an expired (absent) hash, so only a hash carrying
+the ``COMPLETE`` marker, written by a full rebuild, is served to readers. The marker holds the snapshot's soft
+expiry, after which readers still get it while it is rebuilt in the background. Every patch also bumps the user's
+``inventory:version:{user_id}``, and a rebuild that sees it move while loading doesn't store its snapshot over the
+patch.
+"""
+from datetime import datetime
+import orjson
+
+from src.interfaces.cache import Cache
+from .models.product import Product
+
+INVENTORY_CACHE_TTL = 60 * 5
+# Patches keep extending the hash's TTL, so a full rebuild is scheduled once it is older than this
+INVENTORY_CACHE_SOFT_TTL = 60 * 4
+COMPLETE = "_complete"
+INVENTORY_GENERATION_KEY = "inventory:generation"
+INVENTORY_INVALIDATIONS_KEY = "inventory:invalidations"
+INVENTORY_USER_GENERATION_TTL = 2 * INVENTORY_CACHE_TTL
+
+
+def inventory_key(generation: str, user_id: int) -> str:
+    return f"inventory:v{generation}:{user_id}"
+
+
+def inventory_version_key(user_id: int) -> str:
+    return f"inventory:version:{user_id}"
+
+
+def inventory_generation_key(user_id: int) -> str:
+    return f"{INVENTORY_GENERATION_KEY}:{user_id}"
+
+
+async def current_inventory_key(cache: Cache, user_id: int) -> str:
+    generation, user_generation = await cache.mget([INVENTORY_GENERATION_KEY, inventory_generation_key(user_id)])
+    generation = generation or "0"
+    if user_generation is not None:
+        generation = f"{generation}.{user_generation}"
+    return inventory_key(generation, user_id)
+
+
+async def invalidate_inventory(cache: Cache, user_id: int) -> None:
+    """Moves the user to a new inventory hash"""
+    generation = await cache.incr(INVENTORY_INVALIDATIONS_KEY)
+    await cache.set(inventory_generation_key(user_id), str(generation), {"ttl": INVENTORY_USER_GENERATION_TTL})
+
+
+async def invalidate_inventories(cache: Cache) -> int:
+    """Moves every user to a new inventory hash. Returns the new generation"""
+    return await cache.incr(INVENTORY_GENERATION_KEY)
+
+
+def inventory_field(product_id: int, quantity: int, purchased_at: datetime) -> dict[str, str]:
+    """Only the user's part of the item is cached, the product's is hydrated from the catalog on read"""
+    return {str(product_id): orjson.dumps({"quantity": quantity, "purchased_at": purchased_at.isoformat()}).decode()}
+
+
+def inventory_item(
+    product_id: int, name: str, type_: Product.Type, price: int, quantity: int, purchased_at: datetime | str
+) -> dict:
+    return {
+        "product_id": product_id,
+        "name": name,
+        "type": type_.value,
+        "price": price,
+        "quantity": quantity,
+        "purchased_at": purchased_at if isinstance(purchased_at, str) else purchased_at.isoformat(),
+    }
+
+
+def inventory_entries(cached: dict[str, str]) -> list[tuple[int, dict]] | None:
+    """Decodes a cached inventory hash into ``(product_id, entry)`` pairs ordered by quantity, or returns None if it
+    isn't a complete snapshot"""
+    if COMPLETE not in cached:
+        return None
+    entries = [(int(field), orjson.loads(value)) for field, value in cached.items() if field != COMPLETE]
+    return sorted(entries, key=lambda entry: entry[1]["quantity"], reverse=True)
@@ -0,0 +1,11 @@
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from src.interfaces.domain_model import DomainModel
+
+
+@dataclass(kw_only=True)
+class IdempotencyRecord(DomainModel):
+    key: str
+    response: str
+    created_at: datetime = field(default_factory=datetime.now)
@@ -0,0 +1,35 @@
+"""Real-time popularity counters: one sorted set ``popular:{day}`` per day, scored by purchased amount.
+
+Purchases ``ZINCRBY`` today's set after commit. Readers union the days they need into a short-lived set and
+hydrate the ranked product ids from the ``ProductCatalog``.
+"""
+from datetime import date, timedelta
+
+POPULAR_PRODUCTS_TOP_N = 100
+POPULAR_PRODUCTS_SOFT_TTL = 60 * 60
+POPULAR_PRODUCTS_TTL = 2 * POPULAR_PRODUCTS_SOFT_TTL
+POPULAR_PRODUCTS_WINDOW_DAYS = 7
+POPULAR_COUNTERS_RETENTION_DAYS = 31
+POPULAR_UNION_TTL = 10
+
+
+def popular_products_key(start_date: date) -> str:
+    """Top ``POPULAR_PRODUCTS_TOP_N`` products since ``start_date``, sliced by readers for any smaller limit"""
+    return f"popular_products:{start_date.isoformat()}"
+
+
+def popular_key(day: date) -> str:
+    return f"popular:{day.isoformat()}"
+
+
+def popular_union_key(start_date: date) -> str:
+    return f"popular:union:{start_date.isoformat()}"
+
+
+def popular_counters_ttl(day: date) -> int:
+    """Seconds until ``day`` falls out of the counters' retention window"""
+    return ((day + timedelta(days=POPULAR_COUNTERS_RETENTION_DAYS)) - date.today()).days * 60 * 60 * 24
+
+
+def counters_cover(start_date: date) -> bool:
+    return start_date >= date.today() - timedelta(days=POPULAR_COUNTERS_RETENTION_DAYS - 1)
@@ -0,0 +1,15 @@
+from datetime import datetime
+
+from src.interfaces.repository import Repository
+from ..models.idempotency_record import IdempotencyRecord
+
+
+class IdempotencyRepository(Repository):
+    async def find_record(self, key: str) -> IdempotencyRecord:
+        query = self.db.queries["find_idempotency_record"]
+        return await self.db.find_one(query, {"key": key})
+
+    async def delete_expired(self, created_before: datetime, batch_size: int) -> int:
+        query = self.db.queries["delete_expired_idempotency_records"]
+        deleted = await self.db.execute(query, {"created_before": created_before, "batch_size": batch_size})
+        return len(deleted)
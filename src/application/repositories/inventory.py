@@ -1,17 +1,63 @@
+from src.interfaces.db_adapter import DbAdapter
 from src.interfaces.repository import Repository
+from ..catalog import ProductCatalog
 from ..models.inventory import Inventory
 from ..models.product import Product
 
 
 class InventoryRepository(Repository):
+    def __init__(self, db: DbAdapter, catalog: ProductCatalog = None):
+        super().__init__(db)
+        self.catalog = catalog
+
     async def find_inventory(self, product_id: int, user_id: int) -> Inventory:
         query = self.db.queries["find_inventory"]
         return await self.db.find_one(query, {"product_id": product_id, "user_id": user_id})
 
     async def find_product(self, product_id: int) -> Product:
+        if self.catalog is not None:
+            return await self.catalog.find_product(product_id)
         query = self.db.queries["find_product_by_id"]
         return await self.db.find_one(query, {"product_id": product_id})
 
-    async def list(self, user_id: int) -> list[Inventory]:
-        query = self.db.queries["find_inventories_by_user"]
-        return await self.db.find_many(query, {"user_id": user_id})
+    async def list_items(self, user_id: int, cursor: int = None, limit: int = None) -> list[tuple]:
+        """Inventory item rows ordered by product id: all of them, or a page of ``limit`` after the ``cursor`` id"""
+        if limit is None:
+            return await self.db.fetch_rows(self.db.queries["list_inventory_items"], {"user_id": user_id})
+        query = self.db.queries["list_inventory_items_page"]
+        return await self.db.fetch_rows(query, {"user_id": user_id, "cursor": cursor or 0, "limit": limit})
+
+    async def add_purchase(self, user_id: int, product: Product, quantity: int) -> dict | None:
+        """Debits ``product.price`` and adds ``quantity`` to the user's inventory in one guarded statement.
+
+        Returns ``None`` if the balance check failed, and a ``None`` quantity if the inventory guard failed.
+        """
+        query = self.db.queries["purchase_product"]
+        params = {
+            "user_id": user_id,
+            "product_id": product.id,
+            "quantity": quantity,
+            "price": product.price,
+            "consumable": product.type == Product.Type.CONSUMABLE,
+        }
+        result = await self.db.execute(query, params)
+        return result[0] if result else None
+
+    async def find_consumable(self, user_id: int, product_id: int, batch_keys: list[str]) -> dict | None:
+        """The item's quantity in the database, with which of the consumption ``batch_keys`` it already includes"""
+        query = self.db.queries["find_consumable_quantity"]
+        rows = await self.db.execute(query, {"user_id": user_id, "product_id": product_id, "batch_keys": batch_keys})
+        return rows[0] if rows else None
+
+    async def record_consumption_batch(self, key: str, response: str) -> bool:
+        """Records a consumption batch in the idempotency ledger. Returns False if it was already applied"""
+        query = self.db.queries["record_consumption_batch"]
+        return bool(await self.db.execute(query, {"key": key, "response": response}))
+
+    async def apply_consumption(self, deltas: list[tuple[int, int, int]]) -> None:
+        """Subtracts the ``(user_id, product_id, delta)`` consumptions from the inventories"""
+        user_ids, product_ids, amounts = zip(*deltas)
+        query = self.db.queries["apply_consumption_deltas"]
+        await self.db.execute(
+            query, {"user_ids": list(user_ids), "product_ids": list(product_ids), "deltas": list(amounts)}
+        )
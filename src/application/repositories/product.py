@@ -1,8 +1,49 @@
+from datetime import date
+
 from src.interfaces.repository import Repository
+from ..models.product import Product
 
 
 class ProductRepository(Repository):
     async def find_popular_products(self, start_date, limit=5):
-        query = self.db.queries["find_popular_products_by_purchases"]
+        """Top products by purchased amount. On sharded databases the shards' top ``limit`` lists are merged, so a
+        product that misses every shard's list may be missing although its total ranks it in"""
+        query = self.db.queries["find_popular_products_by_rollup"]
         result = await self.db.execute(query, {"start_date": start_date, "limit": limit})
-        return result
+        return _merge_counts(result, ("product_id",))[:limit]
+
+    async def list_products(self) -> list[Product]:
+        query = self.db.queries["find_active_products"]
+        return await self.db.find_many(query)
+
+    async def find_products(self, product_ids: list[int]) -> list[Product]:
+        query = self.db.queries["find_products_by_ids"]
+        return await self.db.find_many(query, {"product_ids": product_ids})
+
+    async def find_daily_purchases(self, start_date: date, end_date: date) -> list[dict]:
+        query = self.db.queries["find_daily_purchases"]
+        result = await self.db.execute(query, {"start_date": start_date, "end_date": end_date})
+        return _merge_counts(result, ("day", "product_id"))
+
+    async def rebuild_purchase_rollup(self, start_date: date, end_date: date) -> int:
+        params = {"start_date": start_date, "end_date": end_date}
+        await self.db.execute(self.db.queries["prune_product_purchase_daily"], params)
+        rebuilt = await self.db.execute(self.db.queries["backfill_product_purchase_daily"], params)
+        return len(rebuilt)
+
+    async def find_purchase_rollup_mismatches(self, start_date: date, end_date: date) -> list[dict]:
+        query = self.db.queries["find_product_purchase_daily_mismatches"]
+        return await self.db.execute(query, {"start_date": start_date, "end_date": end_date})
+
+
+def _merge_counts(rows: list[dict], key: tuple[str, ...]) -> list[dict]:
+    """Sums the ``purchase_count`` of rows sharing ``key``, as returned by several shards, ranked by it"""
+    merged = {}
+    for row in rows:
+        row_key = tuple(row[column] for column in key)
+        if row_key in merged:
+            total = merged[row_key]["purchase_count"] + row["purchase_count"]
+            merged[row_key] = {**merged[row_key], "purchase_count": total}
+        else:
+            merged[row_key] = row
+    return sorted(merged.values(), key=lambda row: row["purchase_count"], reverse=True)
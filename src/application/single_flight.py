@@ -0,0 +1,27 @@
+import asyncio
+from typing import Awaitable, Callable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """Coalesces concurrent calls sharing a key into one in-flight execution whose outcome every caller receives"""
+
+    def __init__(self):
+        self._calls: dict[str, asyncio.Task] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        call = self._calls.get(key)
+        if call is None:
+            # Its own task, so a cancelled caller only stops waiting and the others still get the outcome
+            call = asyncio.create_task(fn())
+            self._calls[key] = call
+            call.add_done_callback(lambda done: self._finish(key, done))
+        return await asyncio.shield(call)
+
+    def _finish(self, key: str, call: asyncio.Task) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        if not call.cancelled():
+            # Marks the exception as retrieved when every caller was cancelled
+            call.exception()
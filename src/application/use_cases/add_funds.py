@@ -1,29 +1,35 @@
 import json
 
 from src.application.errors import NotFound
+from src.application.events import EVENTS_MAXLEN, EVENTS_STREAM, event
+from src.application.models.idempotency_record import IdempotencyRecord
+from src.interfaces.idempotency import idempotent
+from src.interfaces.keyed_lock import serialized
 from src.interfaces.usecase import UseCase
 
 
 class AddFunds(UseCase):
+    @idempotent
+    @serialized("user_id")
     async def __call__(self, user_id: int, amount: int, idempotency_hash: str):
         async with self.ctx.uow as uow:
-            cached = await self.ctx.cache.get(idempotency_hash)
-            if cached:
-                return json.loads(cached)
-
             user = await self.ctx.user_repo.find_user(user_id)
             if user is None:
                 raise NotFound(f"User with id {user_id} doesn't exist")
             prev_balance = user.balance
             user.add_funds(amount, self.ctx.maximum_allowed)
             cur_balance = user.balance
+            uow.cache_xadd(
+                EVENTS_STREAM,
+                event("funds_added", idempotency_hash, user.id, amount=amount, balance=cur_balance),
+                options={"maxlen": EVENTS_MAXLEN},
+            )
 
-            await uow.persist([user])
             message = {
                 "message": "Funds added",
                 "user_id": user.id,
                 "previous_balance": prev_balance,
                 "current_balance": cur_balance,
             }
-            uow.cache_set(idempotency_hash, json.dumps(message), {"ttl": 60 * 5})
+            await uow.persist([user, IdempotencyRecord(key=idempotency_hash, response=json.dumps(message))])
             return message
@@ -1,49 +1,79 @@
 import json
+from datetime import date
 
+from src.interfaces.idempotency import idempotent
+from src.interfaces.keyed_lock import serialized
 from src.interfaces.usecase import UseCase
-from ..errors import NotFound
-from ..models.inventory import Inventory
-from ..models.transaction import Transaction
+from ..consumption import consumption_counts_key
+from ..errors import NotFound, ValidationError
+from ..events import EVENTS_MAXLEN, EVENTS_STREAM, event
+from ..inventory_cache import INVENTORY_CACHE_TTL, current_inventory_key, inventory_field, inventory_version_key
+from ..models.idempotency_record import IdempotencyRecord
+from ..models.product import Product
+from ..popularity import POPULAR_COUNTERS_RETENTION_DAYS, popular_key
 
 
 class AddPurchase(UseCase):
+    @idempotent
+    @serialized("user_id")
     async def __call__(self, product_id: int, user_id: int, idempotency_hash: str, quantity: int = 1) -> dict:
+        # Resolved up front, so the transaction's locks aren't held over a Redis round-trip
+        inventory_key = await current_inventory_key(self.ctx.cache, user_id)
         async with self.ctx.uow as uow:
-            cached = await self.ctx.cache.get(idempotency_hash)
-            if cached:
-                return json.loads(cached)
             product = await self.ctx.inventory_repo.find_product(product_id)
             if product is None:
                 raise NotFound(f"Product with id {product_id} doesn't exist")
 
-            user = await self.ctx.user_repo.find_user(user_id)
-            inventory = await self.ctx.inventory_repo.find_inventory(product_id, user_id)
-            if inventory:
-                inventory.update_quantity(quantity)
-            else:
-                inventory = Inventory(user=user, product=product, quantity=quantity)
-
-            user.remove_funds(product.price)
             # In a real scenario, we would return a pending transaction here, and then handle the payments in separate
             # usecase
-            transaction = Transaction(
-                user_id=user.id, product_id=product_id, amount=quantity, status=Transaction.Status.COMPLETED
-            )
-            await uow.persist([user, inventory, transaction])
+            purchase = await self.ctx.inventory_repo.add_purchase(user_id, product, quantity)
+            if purchase is None or purchase["quantity"] is None:
+                await self._reject(product, user_id, quantity)
 
-            async with self.ctx.uow as nested_uow:
-                full_inventory = await self.ctx.inventory_repo.list(user_id)
-                nested_uow.cache_set(
-                    f"inventory:{user_id}",
-                    json.dumps([inv.asdict() for inv in full_inventory], default=str),
-                    options={"ttl": 60 * 5},
-                )
-                message = {
-                    "message": "Product purchased",
-                    "product_id": product_id,
-                    "price": product.price,
-                    "balance": user.balance,
-                }
-                nested_uow.cache_set(idempotency_hash, json.dumps(message), options={"ttl": 60 * 5})
+            uow.cache_hset(
+                inventory_key,
+                inventory_field(product.id, purchase["quantity"], purchase["purchased_at"]),
+                options={"ttl": INVENTORY_CACHE_TTL},
+            )
+            uow.cache_incr(inventory_version_key(user_id), options={"ttl": INVENTORY_CACHE_TTL})
+            if self.ctx.consumption is not None:
+                # Loaded again from the new quantity on the next consume
+                uow.cache_hdel(consumption_counts_key(user_id), [str(product_id)])
+            uow.cache_zincrby(
+                popular_key(date.today()),
+                str(product_id),
+                quantity,
+                options={"ttl": POPULAR_COUNTERS_RETENTION_DAYS * 60 * 60 * 24},
+            )
+            uow.cache_xadd(
+                EVENTS_STREAM,
+                event(
+                    "product_purchased",
+                    idempotency_hash,
+                    user_id,
+                    product_id=product_id,
+                    quantity=quantity,
+                    amount=product.price,
+                    balance=purchase["balance"],
+                ),
+                options={"maxlen": EVENTS_MAXLEN},
+            )
+            message = {
+                "message": "Product purchased",
+                "product_id": product_id,
+                "price": product.price,
+                "balance": purchase["balance"],
+            }
+            await uow.persist([IdempotencyRecord(key=idempotency_hash, response=json.dumps(message))])
+            return message
 
-                return message
+    async def _reject(self, product: Product, user_id: int, quantity: int):
+        """Replays the domain checks to explain why the guarded purchase statement affected no rows"""
+        user = await self.ctx.user_repo.find_user(user_id)
+        if user is None:
+            raise NotFound(f"User with id {user_id} doesn't exist")
+        inventory = await self.ctx.inventory_repo.find_inventory(product.id, user_id)
+        if inventory:
+            inventory.update_quantity(quantity)
+        user.remove_funds(product.price)
+        raise ValidationError("Insufficient balance")
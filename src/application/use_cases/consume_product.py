@@ -1,15 +1,23 @@
 import json
 
+from src.interfaces.idempotency import idempotent
+from src.interfaces.keyed_lock import serialized
 from src.interfaces.usecase import UseCase
-from ..errors import NotFound
+from ..errors import NotFound, ValidationError
+from ..events import EVENTS_MAXLEN, EVENTS_STREAM, event
+from ..inventory_cache import INVENTORY_CACHE_TTL, current_inventory_key, inventory_field, inventory_version_key
+from ..models.idempotency_record import IdempotencyRecord
 
 
 class ConsumeProduct(UseCase):
+    @idempotent
+    @serialized("user_id")
     async def __call__(self, product_id: int, user_id: int, idempotency_hash: str, quantity: int = 1) -> dict:
+        if self.ctx.consumption is not None:
+            return await self._consume_behind(product_id, user_id, idempotency_hash, quantity)
+        # Resolved up front, so the transaction's locks aren't held over a Redis round-trip
+        inventory_key = await current_inventory_key(self.ctx.cache, user_id)
         async with self.ctx.uow as uow:
-            cached = await self.ctx.cache.get(idempotency_hash)
-            if cached:
-                return json.loads(cached)
             inventory = await self.ctx.inventory_repo.find_inventory(product_id, user_id)
             if not inventory:
                 raise NotFound(f"Inventory with product id {product_id} doesn't exist")
@@ -27,11 +35,46 @@ class ConsumeProduct(UseCase):
                 "previous_quantity": prev_quantity,
                 "current_quantity": current_quantity,
             }
-            full_inventory = await self.ctx.inventory_repo.list(user_id)
-            uow.cache_set(
-                f"inventory:{user_id}",
-                json.dumps([inv.asdict() for inv in full_inventory], default=str),
-                options={"ttl": 60 * 5},
+            uow.cache_hset(
+                inventory_key,
+                inventory_field(inventory.product.id, current_quantity, inventory.purchased_at),
+                options={"ttl": INVENTORY_CACHE_TTL},
             )
-            uow.cache_set(idempotency_hash, json.dumps(message), options={"ttl": 60 * 5})
+            uow.cache_incr(inventory_version_key(user_id), options={"ttl": INVENTORY_CACHE_TTL})
+            uow.cache_xadd(
+                EVENTS_STREAM,
+                event(
+                    "product_consumed",
+                    idempotency_hash,
+                    user_id,
+                    product_id=product_id,
+                    quantity=quantity,
+                    remaining=current_quantity,
+                ),
+                options={"maxlen": EVENTS_MAXLEN},
+            )
+            await uow.persist([IdempotencyRecord(key=idempotency_hash, response=json.dumps(message))])
             return message
+
+    async def _consume_behind(self, product_id: int, user_id: int, idempotency_hash: str, quantity: int) -> dict:
+        """Checks and counts the consume in Redis, the flusher subtracts it from the inventory later"""
+        product = await self.ctx.inventory_repo.find_product(product_id)
+        previous_quantity = None
+        if product is not None:
+            previous_quantity = await self.ctx.consumption.consume(
+                user_id,
+                product_id,
+                quantity,
+                event("product_consumed", idempotency_hash, user_id, product_id=product_id, quantity=quantity),
+            )
+        if previous_quantity is None:
+            raise NotFound(f"Inventory with product id {product_id} doesn't exist")
+        if previous_quantity < quantity:
+            raise ValidationError("Insufficient quantity")
+        return {
+            "message": "Product consumed",
+            "product_id": product_id,
+            "product_name": product.name,
+            "previous_quantity": previous_quantity,
+            "current_quantity": previous_quantity - quantity,
+        }
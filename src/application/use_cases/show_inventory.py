@@ -1,18 +1,48 @@
-import json
-
 from src.interfaces.usecase import UseCase
+from ..inventory_cache import (
+    COMPLETE,
+    INVENTORY_CACHE_SOFT_TTL,
+    INVENTORY_CACHE_TTL,
+    current_inventory_key,
+    inventory_entries,
+    inventory_field,
+    inventory_item,
+    inventory_version_key,
+)
 
 
 class ShowInventory(UseCase):
     async def __call__(self, user_id: int) -> list[dict]:
-        cached = await self.ctx.cache.get(f"inventory:{user_id}")
-        if cached:
-            return json.loads(cached)
-        else:
-            inventory = await self.ctx.inventory_repo.list(user_id)
-            inventory_serialized = [inv.asdict() for inv in inventory]
-            await self.ctx.cache.set(
-                f"inventory:{user_id}", json.dumps(inventory_serialized, default=str), {"ttl": 60 * 5}
+        cached = await self.ctx.read_through.hgetall(
+            await current_inventory_key(self.ctx.cache, user_id),
+            lambda: self._load(user_id),
+            {
+                "marker": COMPLETE,
+                "ttl": INVENTORY_CACHE_TTL,
+                "soft_ttl": INVENTORY_CACHE_SOFT_TTL,
+                "version_key": inventory_version_key(user_id),
+            },
+        )
+        entries = inventory_entries(cached)
+        products = await self.ctx.catalog.get_many([product_id for product_id, _ in entries])
+        return [
+            inventory_item(
+                product_id, product.name, product.type, product.price, entry["quantity"], entry["purchased_at"]
             )
+            for product_id, entry in entries
+            if (product := products.get(product_id)) is not None
+        ]
+
+    async def page(self, user_id: int, cursor: int = None, limit: int = 100) -> tuple[list[dict], int | None]:
+        """A page of items ordered by product id, read from the database, and the cursor of the next page"""
+        rows = await self.ctx.inventory_repo.list_items(user_id, cursor, limit + 1)
+        items = [inventory_item(*row) for row in rows[:limit]]
+        next_cursor = items[-1]["product_id"] if len(rows) > limit else None
+        return items, next_cursor
 
-            return inventory_serialized
+    async def _load(self, user_id: int) -> dict[str, str]:
+        rows = await self.ctx.snapshot_inventory_repo.list_items(user_id)
+        cached = {}
+        for row in rows:
+            cached.update(inventory_field(row.product_id, row.quantity, row.purchased_at))
+        return cached
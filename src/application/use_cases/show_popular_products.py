@@ -1,16 +1,70 @@
-import json
 from datetime import timedelta, date
+
+import orjson
+
 from src.interfaces.usecase import UseCase
+from ..popularity import (
+    POPULAR_PRODUCTS_SOFT_TTL,
+    POPULAR_PRODUCTS_TOP_N,
+    POPULAR_PRODUCTS_TTL,
+    POPULAR_PRODUCTS_WINDOW_DAYS,
+    POPULAR_UNION_TTL,
+    counters_cover,
+    popular_key,
+    popular_products_key,
+    popular_union_key,
+)
 
 
 class ShowPopularProducts(UseCase):
     async def __call__(self, limit: int = 5, start_date=None) -> list[dict]:
-        start_date = start_date or date.today() - timedelta(days=7)
-        cached = await self.ctx.cache.get(f"popular_products:{str(start_date)}:{limit}")
-        if cached:
-            return json.loads(cached)
-        result = await self.ctx.product_repo.find_popular_products(start_date, limit)
-        await self.ctx.cache.set(
-            f"popular_products:{str(start_date)}:{limit}", json.dumps(result, default=str), {"ttl": 3600}
+        start_date = start_date or date.today() - timedelta(days=POPULAR_PRODUCTS_WINDOW_DAYS)
+        if self.ctx.popular_products_backend == "counters" and counters_cover(start_date):
+            return await self._from_counters(start_date, limit)
+        payload = await self.ctx.read_through.get(
+            popular_products_key(start_date),
+            lambda: self._load(start_date),
+            {"ttl": POPULAR_PRODUCTS_TTL, "soft_ttl": POPULAR_PRODUCTS_SOFT_TTL},
+        )
+        return orjson.loads(payload)[:limit]
+
+    async def refresh(self, start_date: date) -> list[dict]:
+        """Recomputes and caches the top products since ``start_date``"""
+        payload = await self.ctx.read_through.get(
+            popular_products_key(start_date),
+            lambda: self._load(start_date),
+            {"ttl": POPULAR_PRODUCTS_TTL, "soft_ttl": POPULAR_PRODUCTS_SOFT_TTL, "refresh": True},
         )
+        return orjson.loads(payload)
+
+    async def _load(self, start_date: date) -> str:
+        result = await self.ctx.product_repo.find_popular_products(start_date, POPULAR_PRODUCTS_TOP_N)
+        return orjson.dumps(result, default=str).decode()
+
+    async def _from_counters(self, start_date: date, limit: int) -> list[dict]:
+        today = date.today()
+        if start_date > today:
+            return []
+        union_key = popular_union_key(start_date)
+        ranked = await self.ctx.cache.zrange(union_key, 0, limit - 1, {"desc": True})
+        if not ranked:
+            days = [start_date + timedelta(days=n) for n in range((today - start_date).days + 1)]
+            await self.ctx.cache.zunionstore(union_key, [popular_key(day) for day in days], {"ttl": POPULAR_UNION_TTL})
+            ranked = await self.ctx.cache.zrange(union_key, 0, limit - 1, {"desc": True})
+
+        products = await self.ctx.catalog.get_many([int(product_id) for product_id, _ in ranked])
+        result = []
+        for product_id, purchase_count in ranked:
+            product = products.get(int(product_id))
+            if product is None:
+                continue
+            result.append(
+                {
+                    "product_id": product.id,
+                    "name": product.name,
+                    "price": product.price,
+                    "type": product.type.value,
+                    "purchase_count": int(purchase_count),
+                }
+            )
         return result
@@ -1,8 +1,18 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from fnmatch import fnmatchcase
 from typing import AsyncIterator
+from uuid import uuid4
 
 from redis.asyncio import Redis, from_url
+from redis.exceptions import WatchError
 
-from src.interfaces.cache import Cache
+from src.interfaces.cache import Cache, CacheOperation
+from .metrics import Metrics, metrics as default_metrics
+
+_logger = logging.getLogger(__name__)
 
 
 class RedisCache(Cache):
@@ -18,8 +28,19 @@ class RedisCache(Cache):
         ttl = options.get("ttl", None)
         await self._redis.set(key, value, ex=ttl)
 
+    async def mget(self, keys: list[str], options: dict = None) -> list[str | None]:
+        if not keys:
+            return []
+        return await self._redis.mget(keys)
+
+    async def add(self, key: str, value: str, options: dict = None) -> bool:
+        options = options or {}
+        ttl = options.get("ttl", None)
+        return bool(await self._redis.set(key, value, ex=ttl, nx=True))
+
     async def delete(self, key, options: dict = None) -> None:
-        await self._redis.delete(key)
+        # UNLINK frees the value in the background, so dropping a large hash doesn't block Redis
+        await self._redis.unlink(key)
 
     async def iter(self, pattern: str, options: dict = None):
         options = options or {}
@@ -27,39 +48,494 @@ class RedisCache(Cache):
         async for key in self._redis.scan_iter(match=pattern, count=count):
             yield key
 
+    async def hgetall(self, key: str, options: dict = None) -> dict[str, str]:
+        return await self._redis.hgetall(key)
+
+    async def hset(self, key: str, mapping: dict[str, str], options: dict = None) -> None:
+        options = options or {}
+        ttl = options.get("ttl", None)
+        async with self._redis.pipeline(transaction=True) as pipe:
+            if (if_unchanged := options.get("if_unchanged")) is not None:
+                guard, expected = if_unchanged
+                await pipe.watch(guard)
+                if await pipe.get(guard) != expected:
+                    return
+                pipe.multi()
+            if options.get("replace", False):
+                pipe.delete(key)
+            pipe.hset(key, mapping=mapping)
+            if ttl is not None:
+                pipe.expire(key, ttl)
+            try:
+                await pipe.execute()
+            except WatchError:
+                pass
+
+    async def hdel(self, key: str, fields: list[str], options: dict = None) -> None:
+        await self._redis.hdel(key, *fields)
+
+    async def zincrby(self, key: str, member: str, amount: float, options: dict = None) -> None:
+        options = options or {}
+        ttl = options.get("ttl", None)
+        async with self._redis.pipeline(transaction=False) as pipe:
+            pipe.zincrby(key, amount, member)
+            if ttl is not None:
+                pipe.expire(key, ttl)
+            await pipe.execute()
+
+    async def zadd(self, key: str, mapping: dict[str, float], options: dict = None) -> None:
+        options = options or {}
+        ttl = options.get("ttl", None)
+        async with self._redis.pipeline(transaction=True) as pipe:
+            if options.get("replace", False):
+                pipe.delete(key)
+            if mapping:
+                pipe.zadd(key, mapping)
+            if ttl is not None:
+                pipe.expire(key, ttl)
+            await pipe.execute()
+
+    async def zunionstore(self, destination: str, keys: list[str], options: dict = None) -> None:
+        options = options or {}
+        ttl = options.get("ttl", None)
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.zunionstore(destination, keys)
+            if ttl is not None:
+                pipe.expire(destination, ttl)
+            await pipe.execute()
+
+    async def zrange(self, key: str, start: int, end: int, options: dict = None) -> list[tuple[str, float]]:
+        options = options or {}
+        return await self._redis.zrange(key, start, end, desc=options.get("desc", False), withscores=True)
+
+    async def incr(self, key: str, amount: int = 1, options: dict = None) -> int:
+        options = options or {}
+        ttl = options.get("ttl", None)
+        async with self._redis.pipeline(transaction=False) as pipe:
+            pipe.incrby(key, amount)
+            if ttl is not None:
+                pipe.expire(key, ttl)
+            value, *_ = await pipe.execute()
+        return value
+
+    async def publish(self, channel: str, message: str, options: dict = None) -> None:
+        await self._redis.publish(channel, message)
+
+    async def xadd(self, stream: str, fields: dict[str, str], options: dict = None) -> str:
+        options = options or {}
+        return await self._redis.xadd(stream, fields, maxlen=options.get("maxlen", None), approximate=True)
+
+    async def xrange(
+        self, stream: str, start: str = "-", end: str = "+", options: dict = None
+    ) -> list[tuple[str, dict[str, str]]]:
+        options = options or {}
+        if options.get("reverse", False):
+            return await self._redis.xrevrange(stream, end, start, count=options.get("count", None))
+        return await self._redis.xrange(stream, start, end, count=options.get("count", None))
+
+    async def apply(self, operations: list[CacheOperation], options: dict = None) -> None:
+        """Sends all operations in one pipeline, i.e. a single round-trip. With the ``transaction`` option the pipeline
+        is wrapped in MULTI/EXEC, so that other clients see either all of the operations or none"""
+        if not operations:
+            return
+        options = options or {}
+        async with self._redis.pipeline(transaction=options.get("transaction", False)) as pipe:
+            for operation in operations:
+                _queue(pipe, operation)
+            await pipe.execute()
+
+
+def _queue(pipe, operation: CacheOperation) -> None:
+    options = operation.options or {}
+    ttl = options.get("ttl", None)
+    key = operation.key
+    match operation.kind:
+        case CacheOperation.Kind.SET:
+            (value,) = operation.args
+            pipe.set(key, value, ex=ttl)
+        case CacheOperation.Kind.DELETE:
+            pipe.unlink(key)
+        case CacheOperation.Kind.HSET:
+            (mapping,) = operation.args
+            if options.get("replace", False):
+                pipe.delete(key)
+            pipe.hset(key, mapping=mapping)
+        case CacheOperation.Kind.HDEL:
+            (fields,) = operation.args
+            pipe.hdel(key, *fields)
+        case CacheOperation.Kind.ZINCRBY:
+            member, amount = operation.args
+            pipe.zincrby(key, amount, member)
+        case CacheOperation.Kind.INCR:
+            (amount,) = operation.args
+            pipe.incrby(key, amount)
+        case CacheOperation.Kind.PUBLISH:
+            (message,) = operation.args
+            pipe.publish(key, message)
+        case CacheOperation.Kind.XADD:
+            (fields,) = operation.args
+            pipe.xadd(key, fields, maxlen=options.get("maxlen", None), approximate=True)
+    if ttl is not None and operation.kind in _EXPIRING_KINDS:
+        pipe.expire(key, ttl)
+
+
+def _in_range(entry_id: str, start: str, end: str) -> bool:
+    """Whether ``entry_id`` lies between the stream id bounds, ``-`` and ``+`` being the smallest and largest ids"""
+    entry = _stream_id(entry_id)
+    lower, upper = _stream_id(start.lstrip("(")), _stream_id(end.lstrip("("))
+    above = entry > lower if start.startswith("(") else entry >= lower
+    below = entry < upper if end.startswith("(") else entry <= upper
+    return above and below
+
+
+def _stream_id(value: str) -> tuple[float, float]:
+    if value in ("-", "+"):
+        return (float("-inf"),) * 2 if value == "-" else (float("inf"),) * 2
+    milliseconds, _, sequence = value.partition("-")
+    return int(milliseconds), int(sequence or 0)
+
+
+_EXPIRING_KINDS = {CacheOperation.Kind.HSET, CacheOperation.Kind.ZINCRBY, CacheOperation.Kind.INCR}
+
 
 class InMemoryCache(Cache):
-    def __init__(self, *args, **kwargs):
+    """Process-local cache with Redis-like expiry semantics, bounded to ``max_size`` keys by evicting the least
+    recently used one"""
+
+    def __init__(self, max_size: int = None, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self._cache = {}
+        self.max_size = max_size
+        self._cache: OrderedDict[str, object] = OrderedDict()
+        self._expires: dict[str, float] = {}
 
     async def get(self, key: str, options: dict = None) -> str | None:
-        return self._cache.get(key)
+        return self._lookup(key)
 
     async def set(self, key: str, value: str, options: dict = None) -> None:
-        self._cache[key] = value
+        options = options or {}
+        self._store(key, value, options.get("ttl", None))
+
+    async def mget(self, keys: list[str], options: dict = None) -> list[str | None]:
+        return [self._lookup(key) for key in keys]
+
+    async def add(self, key: str, value: str, options: dict = None) -> bool:
+        if self._lookup(key) is not None:
+            return False
+        options = options or {}
+        self._store(key, value, options.get("ttl", None))
+        return True
 
     async def delete(self, key: str, options: dict = None) -> None:
-        try:
-            del self._cache[key]
-        except KeyError:
-            pass
+        self._evict(key)
 
     async def iter(self, pattern: str, options: dict = None):
         options = options or {}
         count = options.get("count", None)
-        for key in self._cache.keys():
+        for key in list(self._cache.keys()):
             if count is not None and count <= 0:
                 break
-            if pattern in key:
+            if fnmatchcase(key, pattern) and not self._expired(key):
                 yield key
                 if count is not None:
                     count -= 1
 
+    def clear(self) -> None:
+        self._cache.clear()
+        self._expires.clear()
+
+    async def hgetall(self, key: str, options: dict = None) -> dict[str, str]:
+        return dict(self._lookup(key) or {})
+
+    async def hset(self, key: str, mapping: dict[str, str], options: dict = None) -> None:
+        options = options or {}
+        if (if_unchanged := options.get("if_unchanged")) is not None:
+            guard, expected = if_unchanged
+            if self._lookup(guard) != expected:
+                return
+        self._update(key, mapping, options)
+
+    async def hdel(self, key: str, fields: list[str], options: dict = None) -> None:
+        hash_ = self._lookup(key)
+        if hash_ is None:
+            return
+        for field in fields:
+            hash_.pop(field, None)
+        if not hash_:
+            self._evict(key)
+
+    async def zincrby(self, key: str, member: str, amount: float, options: dict = None) -> None:
+        options = options or {}
+        zset = self._lookup(key)
+        score = (zset or {}).get(member, 0) + amount
+        self._update(key, {member: score}, options)
+
+    async def zadd(self, key: str, mapping: dict[str, float], options: dict = None) -> None:
+        options = options or {}
+        if options.get("replace", False):
+            self._evict(key)
+        if mapping:
+            self._update(key, mapping, options)
+
+    async def zunionstore(self, destination: str, keys: list[str], options: dict = None) -> None:
+        options = options or {}
+        union = {}
+        for key in keys:
+            for member, score in (self._lookup(key) or {}).items():
+                union[member] = union.get(member, 0) + score
+        self._evict(destination)
+        if union:
+            self._store(destination, union, options.get("ttl", None))
+
+    async def zrange(self, key: str, start: int, end: int, options: dict = None) -> list[tuple[str, float]]:
+        options = options or {}
+        zset = self._lookup(key) or {}
+        ranked = sorted(zset.items(), key=lambda item: item[1], reverse=options.get("desc", False))
+        return ranked[start:] if end == -1 else ranked[start : end + 1]
+
+    async def incr(self, key: str, amount: int = 1, options: dict = None) -> int:
+        options = options or {}
+        value = int(self._lookup(key) or 0) + amount
+        ttl = options.get("ttl", None)
+        if ttl is None and key in self._expires:
+            ttl = self._expires[key] - time.monotonic()
+        self._store(key, str(value), ttl)
+        return value
+
+    async def publish(self, channel: str, message: str, options: dict = None) -> None:
+        pass
+
+    async def xadd(self, stream: str, fields: dict[str, str], options: dict = None) -> str:
+        options = options or {}
+        entries = self._lookup(stream)
+        if entries is None:
+            entries = []
+            self._store(stream, entries, None)
+        sequence = int(entries[-1][0].rsplit("-", 1)[1]) + 1 if entries else 0
+        entry_id = f"{int(time.time() * 1000)}-{sequence}"
+        entries.append((entry_id, dict(fields)))
+        maxlen = options.get("maxlen", None)
+        if maxlen is not None:
+            del entries[:-maxlen]
+        return entry_id
+
+    async def xrange(
+        self, stream: str, start: str = "-", end: str = "+", options: dict = None
+    ) -> list[tuple[str, dict[str, str]]]:
+        options = options or {}
+        entries = [
+            (entry_id, dict(fields))
+            for entry_id, fields in self._lookup(stream) or []
+            if _in_range(entry_id, start, end)
+        ]
+        if options.get("reverse", False):
+            entries.reverse()
+        return entries[: options.get("count", None)]
+
+    def _expired(self, key: str) -> bool:
+        expires = self._expires.get(key)
+        return expires is not None and expires <= time.monotonic()
+
+    def _lookup(self, key: str):
+        if key not in self._cache:
+            return None
+        if self._expired(key):
+            self._evict(key)
+            return None
+        self._cache.move_to_end(key)
+        return self._cache[key]
+
+    def _store(self, key: str, value, ttl: int | None) -> None:
+        """Replaces the key like ``SET``: a missing ``ttl`` clears its expiry"""
+        self._cache[key] = value
+        self._cache.move_to_end(key)
+        self._expires.pop(key, None)
+        if ttl is not None:
+            self._expires[key] = time.monotonic() + ttl
+        if self.max_size is not None:
+            while len(self._cache) > self.max_size:
+                evicted, _ = self._cache.popitem(last=False)
+                self._expires.pop(evicted, None)
+
+    def _update(self, key: str, mapping: dict, options: dict) -> None:
+        """Merges ``mapping`` into a hash or sorted set, keeping its expiry unless ``ttl`` is given"""
+        current = None if options.get("replace", False) else self._lookup(key)
+        if current is None:
+            self._store(key, dict(mapping), options.get("ttl", None))
+            return
+        current.update(mapping)
+        if options.get("ttl", None) is not None:
+            self._expires[key] = time.monotonic() + options["ttl"]
+
+    def _evict(self, key: str) -> None:
+        self._cache.pop(key, None)
+        self._expires.pop(key, None)
+
+
+_L1_KINDS = {
+    CacheOperation.Kind.SET,
+    CacheOperation.Kind.DELETE,
+    CacheOperation.Kind.HSET,
+    CacheOperation.Kind.HDEL,
+    CacheOperation.Kind.INCR,
+}
+
+
+class TwoTierCache(Cache):
+    """Keeps recently read strings and hashes in a small process-local ``InMemoryCache`` (L1) in front of Redis.
+
+    L1 entries live for at most ``l1_ttl`` seconds. Every write evicts the key locally and publishes it on
+    ``channel``, so the other workers evict their copies too; missing a message (e.g. while reconnecting) can
+    only leave a copy stale for ``l1_ttl``. Other data structures and reservations (``add``) always go to Redis.
+    """
+
+    def __init__(
+        self,
+        redis: Redis,
+        l1: InMemoryCache = None,
+        l1_ttl: int = 5,
+        channel: str = "cache:invalidate",
+        metrics: Metrics = None,
+        *args,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self._redis = redis
+        self.l2 = RedisCache(redis)
+        self.l1 = l1 or InMemoryCache(max_size=10000)
+        self.l1_ttl = l1_ttl
+        self.channel = channel
+        self.metrics = metrics or default_metrics
+        self._origin = uuid4().hex
+
+    async def get(self, key: str, options: dict = None) -> str | None:
+        value = await self.l1.get(key)
+        if value is not None:
+            self.metrics.inc("cache_l1_hits_total")
+            return value
+        self.metrics.inc("cache_l1_misses_total")
+        value = await self.l2.get(key, options)
+        if value is not None:
+            await self.l1.set(key, value, {"ttl": self.l1_ttl})
+        return value
+
+    async def set(self, key: str, value: str, options: dict = None) -> None:
+        await self.l2.set(key, value, options)
+        await self._invalidate(key)
+
+    async def mget(self, keys: list[str], options: dict = None) -> list[str | None]:
+        return await self.l2.mget(keys, options)
+
+    async def add(self, key: str, value: str, options: dict = None) -> bool:
+        return await self.l2.add(key, value, options)
+
+    async def delete(self, key: str, options: dict = None) -> None:
+        await self.l2.delete(key, options)
+        await self._invalidate(key)
+
+    async def iter(self, pattern: str, options: dict = None):
+        async for key in self.l2.iter(pattern, options):
+            yield key
+
+    async def hgetall(self, key: str, options: dict = None) -> dict[str, str]:
+        mapping = await self.l1.hgetall(key)
+        if mapping:
+            self.metrics.inc("cache_l1_hits_total")
+            return mapping
+        self.metrics.inc("cache_l1_misses_total")
+        mapping = await self.l2.hgetall(key, options)
+        if mapping:
+            await self.l1.hset(key, mapping, {"ttl": self.l1_ttl, "replace": True})
+        return mapping
+
+    async def hset(self, key: str, mapping: dict[str, str], options: dict = None) -> None:
+        await self.l2.hset(key, mapping, options)
+        await self._invalidate(key)
+
+    async def hdel(self, key: str, fields: list[str], options: dict = None) -> None:
+        await self.l2.hdel(key, fields, options)
+        await self._invalidate(key)
+
+    async def zincrby(self, key: str, member: str, amount: float, options: dict = None) -> None:
+        await self.l2.zincrby(key, member, amount, options)
+
+    async def zadd(self, key: str, mapping: dict[str, float], options: dict = None) -> None:
+        await self.l2.zadd(key, mapping, options)
+
+    async def zunionstore(self, destination: str, keys: list[str], options: dict = None) -> None:
+        await self.l2.zunionstore(destination, keys, options)
+
+    async def zrange(self, key: str, start: int, end: int, options: dict = None) -> list[tuple[str, float]]:
+        return await self.l2.zrange(key, start, end, options)
+
+    async def incr(self, key: str, amount: int = 1, options: dict = None) -> int:
+        value = await self.l2.incr(key, amount, options)
+        await self._invalidate(key)
+        return value
+
+    async def publish(self, channel: str, message: str, options: dict = None) -> None:
+        await self.l2.publish(channel, message, options)
+
+    async def xadd(self, stream: str, fields: dict[str, str], options: dict = None) -> str:
+        return await self.l2.xadd(stream, fields, options)
+
+    async def xrange(
+        self, stream: str, start: str = "-", end: str = "+", options: dict = None
+    ) -> list[tuple[str, dict[str, str]]]:
+        return await self.l2.xrange(stream, start, end, options)
+
+    async def apply(self, operations: list[CacheOperation], options: dict = None) -> None:
+        """Applies the operations and the resulting invalidations in the same pipeline"""
+        invalidated = {operation.key for operation in operations if operation.kind in _L1_KINDS}
+        await self.l2.apply(
+            operations
+            + [
+                CacheOperation(CacheOperation.Kind.PUBLISH, self.channel, (f"{self._origin}|{key}",))
+                for key in invalidated
+            ],
+            options,
+        )
+        for key in invalidated:
+            await self.l1.delete(key)
+
+    async def listen(self) -> None:
+        """Evicts keys written by other workers until cancelled, resubscribing after connection errors"""
+        while True:
+            try:
+                async with self._redis.pubsub() as pubsub:
+                    await pubsub.subscribe(self.channel)
+                    # Invalidations published while we were not subscribed are lost
+                    self.l1.clear()
+                    async for message in pubsub.listen():
+                        if message["type"] != "message":
+                            continue
+                        origin, _, key = message["data"].partition("|")
+                        if origin != self._origin:
+                            await self.l1.delete(key)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                _logger.warning(f"Cache invalidation listener failed: {e}")
+                self.l1.clear()
+                await asyncio.sleep(1)
+
+    async def _invalidate(self, key: str) -> None:
+        await self.l1.delete(key)
+        await self._redis.publish(self.channel, f"{self._origin}|{key}")
+
 
 async def init_redis_pool(host: str, port: str, password: str) -> AsyncIterator[Redis]:
     url = f"redis://{host}:{port}/0"
     session = from_url(url, password=password, encoding="utf-8", decode_responses=True)
     yield session
-    session.close()
-    await session.wait_closed()
+    await session.aclose()
+
+
+async def init_two_tier_cache(redis: Redis, l1_max_size: int, l1_ttl: int) -> AsyncIterator[TwoTierCache]:
+    cache = TwoTierCache(redis, l1=InMemoryCache(max_size=l1_max_size), l1_ttl=l1_ttl)
+    listener = asyncio.create_task(cache.listen())
+    yield cache
+    listener.cancel()
+    try:
+        await listener
+    except asyncio.CancelledError:
+        pass
@@ -0,0 +1,32 @@
+"""Publishes product changes to the workers' catalog snapshots, e.g. after editing products in the database.
+
+    python -m src.infrastructure.catalog --product-id 1 2
+"""
+import argparse
+import asyncio
+
+
+async def _publish(product_ids: list[int]):
+    from .config import Settings
+    from .container import Container
+
+    container = Container()
+    container.config.from_pydantic(Settings())
+    try:
+        catalog = await container.product_catalog()
+        await catalog.publish_changes(product_ids)
+    finally:
+        await container.shutdown_resources()
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Make the product catalog snapshots reload changed products")
+    parser.add_argument("--product-id", type=int, nargs="+", required=True, dest="product_ids")
+    args = parser.parse_args(argv)
+    asyncio.run(_publish(args.product_ids))
+    print(f"Published changes of {len(args.product_ids)} products")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
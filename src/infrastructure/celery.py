@@ -1,11 +1,10 @@
-import asyncio
-import threading
-
 from celery import Celery
+from celery.signals import worker_process_shutdown, worker_shutdown
 
 from . import tasks
 from .config import Settings
 from .container import Container
+from .task_runner import AsyncioRunner
 
 
 def create_celery_app():
@@ -30,14 +29,14 @@ def create_celery_app():
     )
     app.autodiscover_tasks()
     app.container = container
-
-    app.loop = asyncio.get_event_loop()
-    app.loop_runner = threading.Thread(
-        target=app.loop.run_forever,
-        daemon=True,
-    )
-    app.loop_runner.start()
+    app.runner = AsyncioRunner(concurrency=settings.worker_concurrency, on_shutdown=container.shutdown_resources)
     return app
 
 
 app = create_celery_app()
+
+
+@worker_shutdown.connect
+@worker_process_shutdown.connect
+def shutdown_runner(**kwargs):
+    app.runner.shutdown()
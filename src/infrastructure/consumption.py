@@ -0,0 +1,317 @@
+"""Write-behind consumption of products.
+
+With ``CONSUMPTION_MODE=write_behind`` a consume is one script call in Redis instead of a transaction (see
+``src/application/consumption.py`` for the keys). The script loads the user's count of the product from the database
+on first use and refuses a consume that would make it negative. Otherwise it decrements the count, adds the quantity
+to the pending deltas and appends the ``product_consumed`` event.
+
+Every flush interval the flusher renames the pending deltas into a batch and subtracts them from ``inventory`` in one
+transaction that also stores the batch id in ``idempotency_record``. Only then is the batch deleted. A flusher
+dying in between leaves the batch listed; once it is older than the recovery grace period another flusher re-applies
+it, and the ledger skips it if the first one had committed. With sharded databases the batch is committed per
+shard, each shard with its own ledger row.
+
+A count loaded while batches are in flight subtracts those the database doesn't include yet. Loads retry when a
+batch was claimed or finished meanwhile. Purchases drop the user's count, so it is
+loaded again with the new quantity. A purchase committing while the count loads may still be missed until the
+count expires, unless ``USER_LOCK_BACKEND`` orders the user's writes.
+
+Consumes are only as durable as Redis: deltas not flushed yet are lost with it, and replays of a consume are only
+recognized while Redis keeps its idempotency key, which in this mode it does for ``IDEMPOTENCY_RETENTION_HOURS``.
+Inventory reads catch up with every flush.
+
+    python -m src.infrastructure.consumption --once
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+import uuid
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from redis.asyncio import Redis
+from sqlalchemy.ext.asyncio import async_scoped_session
+
+from src.application.consumption import (
+    CONSUMPTION_BATCHES_KEY,
+    CONSUMPTION_COUNTS_TTL,
+    CONSUMPTION_EPOCH_KEY,
+    CONSUMPTION_PENDING_KEY,
+    consumption_batch_key,
+    consumption_counts_key,
+    consumption_ledger_key,
+    pending_field,
+)
+from src.application.inventory_cache import invalidate_inventory
+from src.application.repositories.inventory import InventoryRepository
+from src.interfaces.cache import Cache
+from src.interfaces.consumption import ConsumptionCounter
+from src.interfaces.uow import UnitOfWork
+from .db.db_adapter import session_scope
+from .db.shards import ShardRouter, pin_shard
+from .metrics import metrics
+
+_logger = logging.getLogger(__name__)
+
+LOAD_ATTEMPTS = 5
+
+# KEYS: counts, pending, events stream. ARGV: product id, quantity, pending field, stream maxlen, event
+_CONSUME_SCRIPT = """
+local remaining = redis.call("HGET", KEYS[1], ARGV[1])
+if not remaining then
+    return -1
+end
+remaining = tonumber(remaining)
+local quantity = tonumber(ARGV[2])
+if remaining < quantity then
+    return remaining
+end
+redis.call("HINCRBY", KEYS[1], ARGV[1], -quantity)
+redis.call("HINCRBY", KEYS[2], ARGV[3], quantity)
+local event = {}
+for i = 5, #ARGV do
+    event[#event + 1] = ARGV[i]
+end
+event[#event + 1] = "remaining"
+event[#event + 1] = tostring(remaining - quantity)
+redis.call("XADD", KEYS[3], "MAXLEN", "~", ARGV[4], "*", unpack(event))
+return remaining
+"""
+
+# KEYS: counts, pending, batches, epoch. ARGV: product id, pending field, database quantity, epoch seen, counts TTL,
+# batch key prefix, then the listed batches the database quantity already includes. Batch hashes are read by name,
+# so Redis Cluster would need them in one slot. Only the first load sets the TTL and consumes never touch it, so the
+# counts are reloaded from the database every TTL however steadily they are used
+_LOAD_SCRIPT = """
+local loaded = redis.call("HEXISTS", KEYS[1], ARGV[1])
+if loaded == 1 then
+    return 1
+end
+local epoch = redis.call("GET", KEYS[4]) or "0"
+if epoch ~= ARGV[4] then
+    return 0
+end
+local applied = {}
+for i = 7, #ARGV do
+    applied[ARGV[i]] = true
+end
+local remaining = tonumber(ARGV[3]) - tonumber(redis.call("HGET", KEYS[2], ARGV[2]) or "0")
+for _, batch in ipairs(redis.call("ZRANGE", KEYS[3], 0, -1)) do
+    if not applied[batch] then
+        remaining = remaining - tonumber(redis.call("HGET", ARGV[6] .. batch, ARGV[2]) or "0")
+    end
+end
+redis.call("HSET", KEYS[1], ARGV[1], remaining)
+redis.call("EXPIRE", KEYS[1], ARGV[5], "NX")
+return 1
+"""
+
+# KEYS: pending, batch, batches, epoch. ARGV: batch id, claim time in ms
+_CLAIM_SCRIPT = """
+local pending = redis.call("EXISTS", KEYS[1])
+if pending == 0 then
+    return 0
+end
+redis.call("RENAME", KEYS[1], KEYS[2])
+redis.call("ZADD", KEYS[3], ARGV[2], ARGV[1])
+redis.call("INCR", KEYS[4])
+return 1
+"""
+
+# KEYS: batch, batches, epoch. ARGV: batch id
+_FINISH_SCRIPT = """
+local deleted = redis.call("DEL", KEYS[1])
+redis.call("ZREM", KEYS[2], ARGV[1])
+redis.call("INCR", KEYS[3])
+return deleted
+"""
+
+
+class RedisConsumptionCounter(ConsumptionCounter):
+    def __init__(
+        self,
+        redis: Redis,
+        inventory_repo: InventoryRepository,
+        events_stream: str,
+        events_maxlen: int,
+        counts_ttl: int = CONSUMPTION_COUNTS_TTL,
+    ):
+        self.redis = redis
+        self.inventory_repo = inventory_repo
+        self.events_stream = events_stream
+        self.events_maxlen = events_maxlen
+        self.counts_ttl = counts_ttl
+        self._consume_script = redis.register_script(_CONSUME_SCRIPT)
+        self._load_script = redis.register_script(_LOAD_SCRIPT)
+
+    async def consume(self, user_id: int, product_id: int, quantity: int, event: dict[str, str]) -> int | None:
+        counts_key = consumption_counts_key(user_id)
+        field = pending_field(user_id, product_id)
+        args = [product_id, quantity, field, self.events_maxlen]
+        for name, value in event.items():
+            args.extend((name, value))
+        keys = [counts_key, CONSUMPTION_PENDING_KEY, self.events_stream]
+        previous = await self._consume_script(keys=keys, args=args)
+        if previous == -1:
+            if not await self._load(user_id, product_id):
+                return None
+            previous = await self._consume_script(keys=keys, args=args)
+        return int(previous)
+
+    async def _load(self, user_id: int, product_id: int) -> bool:
+        """Loads the item's count unless it is loaded already. Returns False if the user doesn't own the item"""
+        keys = [consumption_counts_key(user_id), CONSUMPTION_PENDING_KEY, CONSUMPTION_BATCHES_KEY, CONSUMPTION_EPOCH_KEY]
+        for _ in range(LOAD_ATTEMPTS):
+            # Read before the batches: a batch claimed or finished in between moves the epoch, and the load retries
+            async with self.redis.pipeline(transaction=False) as pipe:
+                epoch, batches = await pipe.get(CONSUMPTION_EPOCH_KEY).zrange(CONSUMPTION_BATCHES_KEY, 0, -1).execute()
+            found = await self.inventory_repo.find_consumable(
+                user_id, product_id, [consumption_ledger_key(batch) for batch in batches]
+            )
+            if found is None:
+                return False
+            applied_keys = set(found["applied_batch_keys"] or [])
+            applied = [batch for batch in batches if consumption_ledger_key(batch) in applied_keys]
+            args = [
+                product_id,
+                pending_field(user_id, product_id),
+                found["quantity"],
+                epoch or "0",
+                self.counts_ttl,
+                consumption_batch_key(""),
+                *applied,
+            ]
+            if await self._load_script(keys=keys, args=args):
+                return True
+            metrics.inc("consumption_load_retries_total")
+        raise RuntimeError(f"Batches kept moving while loading the count of product {product_id} of user {user_id}")
+
+
+class ConsumptionFlusher:
+    def __init__(
+        self,
+        redis: Redis,
+        session: async_scoped_session,
+        uow: UnitOfWork,
+        cache: Cache,
+        inventory_repo: InventoryRepository,
+        batch_size: int = 1000,
+        recovery_grace: int = 30,
+        router: ShardRouter = None,
+    ):
+        self.redis = redis
+        self.session = session
+        self.uow = uow
+        self.cache = cache
+        self.inventory_repo = inventory_repo
+        self.batch_size = batch_size
+        self.recovery_grace = recovery_grace
+        self.router = router
+        self._claim_script = redis.register_script(_CLAIM_SCRIPT)
+        self._finish_script = redis.register_script(_FINISH_SCRIPT)
+
+    async def flush(self) -> int:
+        """Applies the batches abandoned by dead flushers, then the pending deltas. Returns the number of deltas"""
+        flushed = 0
+        stale_before = int((time.time() - self.recovery_grace) * 1000)
+        for batch_id in await self.redis.zrangebyscore(CONSUMPTION_BATCHES_KEY, "-inf", stale_before):
+            _logger.warning(f"Recovering consumption batch {batch_id}")
+            flushed += await self._apply(batch_id)
+        batch_id = uuid.uuid4().hex
+        claimed = await self._claim_script(
+            keys=[CONSUMPTION_PENDING_KEY, consumption_batch_key(batch_id), CONSUMPTION_BATCHES_KEY, CONSUMPTION_EPOCH_KEY],
+            args=[batch_id, int(time.time() * 1000)],
+        )
+        if claimed:
+            flushed += await self._apply(batch_id)
+        return flushed
+
+    async def run(self, interval: float) -> None:
+        while True:
+            started = time.perf_counter()
+            try:
+                flushed = await self.flush()
+                if flushed:
+                    metrics.inc("consumption_flushed_total", amount=flushed)
+                    metrics.observe("consumption_flush_seconds", time.perf_counter() - started)
+            except Exception as e:
+                _logger.warning(f"Failed to flush consumption: {e}")
+            await asyncio.sleep(interval)
+
+    async def _apply(self, batch_id: str) -> int:
+        fields = await self.redis.hgetall(consumption_batch_key(batch_id))
+        by_shard = defaultdict(list)
+        for field, delta in fields.items():
+            user_id, product_id = map(int, field.split(":"))
+            shard_id = self.router.shard_for(user_id) if self.router is not None else None
+            by_shard[shard_id].append((user_id, product_id, int(delta)))
+        for shard_id, deltas in by_shard.items():
+            await self._apply_shard(batch_id, shard_id, sorted(deltas))
+        # Inventory reads were served the quantities from before the batch
+        user_ids = {user_id for deltas in by_shard.values() for user_id, _, _ in deltas}
+        await asyncio.gather(*[invalidate_inventory(self.cache, user_id) for user_id in user_ids])
+        await self._finish_script(
+            keys=[consumption_batch_key(batch_id), CONSUMPTION_BATCHES_KEY, CONSUMPTION_EPOCH_KEY], args=[batch_id]
+        )
+        return len(fields)
+
+    async def _apply_shard(self, batch_id: str, shard_id: str | None, deltas: list[tuple[int, int, int]]) -> None:
+        async with session_scope(self.session):
+            if shard_id is not None:
+                pin_shard(self.session, shard_id)
+            async with self.uow:
+                response = json.dumps({"deltas": len(deltas)})
+                if not await self.inventory_repo.record_consumption_batch(consumption_ledger_key(batch_id), response):
+                    return
+                for start in range(0, len(deltas), self.batch_size):
+                    await self.inventory_repo.apply_consumption(deltas[start:start + self.batch_size])
+
+
+@asynccontextmanager
+async def flushing(flusher: ConsumptionFlusher, interval_ms: int) -> AsyncIterator[None]:
+    """Flushes in the background of the enclosed block, and once more when it exits"""
+    task = asyncio.create_task(flusher.run(interval_ms / 1000))
+    yield
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    try:
+        await flusher.flush()
+    except Exception as e:
+        _logger.warning(f"Failed the last consumption flush, the next flusher recovers it: {e}")
+
+
+async def _run(args: argparse.Namespace):
+    from .config import Settings
+    from .container import Container
+
+    container = Container()
+    container.config.from_pydantic(Settings())
+    try:
+        flusher = await container.consumption_flusher()
+        if args.once:
+            print(f"Flushed {await flusher.flush()} consumption deltas")
+            return
+        await flusher.run(container.config.consumption_flush_interval_ms() / 1000)
+    finally:
+        if container.shard_router() is not None:
+            await container.shard_router().dispose()
+        await container.engine().dispose()
+        await container.shutdown_resources()
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Flush write-behind consumption to the database")
+    parser.add_argument("--once", action="store_true", help="Flush once, e.g. before switching write-behind off")
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_run(parser.parse_args(argv)))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -4,14 +4,26 @@ from contextlib import contextmanager
 from dependency_injector import containers, providers
 from sqlalchemy.ext.asyncio import create_async_engine
 
+from src.application.catalog import ProductCatalog
+from src.application.events import EVENTS_MAXLEN, EVENTS_STREAM
+from src.application.repositories.idempotency import IdempotencyRepository
 from src.application.repositories.inventory import InventoryRepository
 from src.application.repositories.product import ProductRepository
 from src.application.repositories.user import UserRepository
+from src.application.single_flight import SingleFlight
 from src.interfaces.context import WriteContext, ReadContext
-from .cache import init_redis_pool, RedisCache
-from .db.db_adapter import sqlalchemy_session_factory, SqlAlchemyDbAdapter
+from .cache import init_redis_pool, init_two_tier_cache, RedisCache
+from .consumption import ConsumptionFlusher, RedisConsumptionCounter
+from .db.db_adapter import sqlalchemy_session_factory, ReplicaDbAdapter, SqlAlchemyDbAdapter
+from .db.replicas import ReplicaPool, init_replica_engines
+from .db.shards import init_shard_router
 from .db.queries import get_queries
 from .db.uow import SqlAlchemyUnitOfWork
+from .idempotency import CacheIdempotency
+from .keyed_lock import LocalKeyedLock, RedisKeyedLock
+from .outbox import OutboxRelay
+from .rate_limiter import RedisRateLimiter
+from .read_through import CacheReadThrough
 
 
 @contextmanager
@@ -31,38 +43,160 @@ class Container(containers.DeclarativeContainer):
         password=config.redis_password,
     )
     engine = providers.Resource(
-        create_async_engine, config.database_url, pool_size=10, max_overflow=20, pool_pre_ping=True
+        create_async_engine,
+        config.database_url,
+        pool_size=config.db_pool_size,
+        max_overflow=config.db_max_overflow,
+        pool_pre_ping=True,
+    )
+    shard_router = providers.Resource(
+        init_shard_router,
+        urls=config.shard_database_urls,
+        buckets=config.shard_buckets,
+        bucket_map=config.shard_bucket_map,
+        pool_size=config.db_pool_size,
+        max_overflow=config.db_max_overflow,
+    )
+    session_factory = providers.Resource(sqlalchemy_session_factory, engine=engine, router=shard_router)
+    replica_engines = providers.Resource(
+        init_replica_engines,
+        urls=config.replica_database_urls,
+        pool_size=config.db_pool_size,
+        max_overflow=config.db_max_overflow,
+    )
+    replicas = providers.Singleton(
+        ReplicaPool,
+        engines=replica_engines,
+        max_lag=config.replica_max_lag,
+        check_interval=config.replica_check_interval,
     )
-    session_factory = providers.Resource(sqlalchemy_session_factory, engine=engine)
 
     thread_pool = providers.Resource(
         init_thread_pool,
         max_workers=1,
     )
 
-    cache = providers.Singleton(RedisCache, redis=redis_pool)
+    redis_cache = providers.Singleton(RedisCache, redis=redis_pool)
+    cache = providers.Resource(
+        init_two_tier_cache, redis=redis_pool, l1_max_size=config.l1_cache_max_size, l1_ttl=config.l1_cache_ttl
+    )
+
+    rate_limiter = providers.Singleton(RedisRateLimiter, redis=redis_pool)
 
     queries = providers.Singleton(get_queries)
 
-    db = providers.Factory(SqlAlchemyDbAdapter, session=session_factory, queries=queries)
+    db = providers.Factory(SqlAlchemyDbAdapter, session=session_factory, queries=queries, router=shard_router)
+    read_db = providers.Factory(
+        ReplicaDbAdapter, session=session_factory, queries=queries, replicas=replicas, router=shard_router
+    )
     uow = providers.Factory(
-        SqlAlchemyUnitOfWork, session=session_factory, cache=cache, active_test=config.active_test
+        SqlAlchemyUnitOfWork,
+        session=session_factory,
+        cache=cache,
+        active_test=config.active_test,
+        track_lsn=providers.Callable(bool, config.replica_database_urls),
     )
 
-    inventory_repository = providers.Factory(InventoryRepository, db=db)
+    single_flight = providers.Singleton(SingleFlight)
+
     product_repository = providers.Factory(ProductRepository, db=db)
+    # Reads the version straight from Redis: an L1 copy would add its own TTL to the catalog's staleness
+    product_catalog = providers.Singleton(
+        ProductCatalog,
+        repository=product_repository,
+        cache=redis_cache,
+        single_flight=single_flight,
+        check_interval=config.catalog_check_interval,
+    )
+    inventory_repository = providers.Factory(InventoryRepository, db=db, catalog=product_catalog)
+    read_product_repository = providers.Factory(ProductRepository, db=read_db)
+    read_inventory_repository = providers.Factory(InventoryRepository, db=read_db, catalog=product_catalog)
     user_repository = providers.Factory(UserRepository, db=db)
+    idempotency_repository = providers.Factory(IdempotencyRepository, db=db)
+
+    # Write-behind consumes write no ledger record, so Redis keeps their results for as long as the ledger would
+    idempotency_ttl = providers.Selector(
+        config.consumption_mode,
+        transactional=config.idempotency_ttl,
+        write_behind=providers.Callable(lambda hours: hours * 60 * 60, config.idempotency_retention_hours),
+    )
+    idempotency = providers.Factory(
+        CacheIdempotency, cache=redis_cache, ledger=idempotency_repository, ttl=idempotency_ttl
+    )
+
+    user_lock = providers.Selector(
+        config.user_lock_backend,
+        none=providers.Object(None),
+        local=providers.Singleton(LocalKeyedLock),
+        redis=providers.Singleton(
+            RedisKeyedLock,
+            redis=redis_pool,
+            lease_ttl=config.user_lock_lease_ttl,
+            wait_timeout=config.user_lock_wait_timeout,
+        ),
+    )
+
+    consumption = providers.Selector(
+        config.consumption_mode,
+        transactional=providers.Object(None),
+        # One counter, so its scripts are registered once. The repository queries the request's scoped session
+        write_behind=providers.Singleton(
+            RedisConsumptionCounter,
+            redis=redis_pool,
+            inventory_repo=inventory_repository,
+            events_stream=EVENTS_STREAM,
+            events_maxlen=EVENTS_MAXLEN,
+        ),
+    )
 
     write_context = providers.Factory(
         WriteContext,
         db=db,
         uow=uow,
         cache=cache,
+        idempotency=idempotency,
         inventory_repo=inventory_repository,
         user_repo=user_repository,
         maximum_allowed=config.max_balance_update_amount,
+        user_lock=user_lock,
+        consumption=consumption,
+    )
+
+    read_through = providers.Singleton(
+        CacheReadThrough, cache=cache, single_flight=single_flight, session=session_factory
+    )
+
+    outbox_relay = providers.Factory(
+        OutboxRelay,
+        session=session_factory,
+        db=db,
+        uow=uow,
+        cache=cache,
+        batch_size=config.outbox_batch_size,
+        grace_period=config.outbox_grace_period,
+        router=shard_router,
+    )
+
+    consumption_flusher = providers.Factory(
+        ConsumptionFlusher,
+        redis=redis_pool,
+        session=session_factory,
+        uow=uow,
+        cache=cache,
+        inventory_repo=inventory_repository,
+        batch_size=config.consumption_flush_batch_size,
+        recovery_grace=config.consumption_recovery_grace,
+        router=shard_router,
     )
 
     read_context = providers.Factory(
-        ReadContext, db=db, cache=cache, product_repo=product_repository, inventory_repo=inventory_repository
+        ReadContext,
+        db=read_db,
+        cache=cache,
+        product_repo=read_product_repository,
+        inventory_repo=read_inventory_repository,
+        snapshot_inventory_repo=inventory_repository,
+        read_through=read_through,
+        catalog=product_catalog,
+        popular_products_backend=config.popular_products_backend,
     )
@@ -1,31 +1,98 @@
-from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import sessionmaker
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_scoped_session, async_sessionmaker
 
 from src.interfaces.db_adapter import DbAdapter, Query
+from .replicas import ReplicaPool, consistency_token
+from .shards import ShardRouter, UserShardedSession
 from ..utils.helpers import cast_dict_types
 
+_session_scope: ContextVar[object | None] = ContextVar("session_scope", default=None)
+
 
 class SqlAlchemyDbAdapter(DbAdapter):
-    def __init__(self, queries: dict, session: AsyncSession, *args, **kwargs):
+    def __init__(self, queries: dict, session: async_scoped_session, router: ShardRouter = None, *args, **kwargs):
         super().__init__(queries, *args, **kwargs)
         self.session = session
+        self.router = router
 
     async def find_one(self, query: Query, *args, **kwargs):
-        result = await self.session.execute(query.value, *args, **kwargs)
-        return result.unique().scalars().one_or_none()
+        async with self._session(*args) as session:
+            result = await session.execute(query.value, *args, **kwargs)
+            return result.unique().scalars().one_or_none()
 
     async def find_many(self, query: Query, *args, **kwargs):
-        result = await self.session.execute(query.value, *args, **kwargs)
-        return result.unique().scalars().all()
+        async with self._session(*args) as session:
+            result = await session.execute(query.value, *args, **kwargs)
+            return result.unique().scalars().all()
 
     async def execute(self, query: Query, *args, **kwargs):
-        result = await self.session.execute(query.value, *args, **kwargs)
-        rows = result.fetchall()
+        async with self._session(*args) as session:
+            result = await session.execute(query.value, *args, **kwargs)
+            rows = result.fetchall()
         return cast_dict_types([row._asdict() for row in rows])
 
+    async def fetch_rows(self, query: Query, *args, **kwargs):
+        # Executed on the session's connection, so the ORM neither compiles entity loading nor tracks identities
+        async with self._session(*args) as session:
+            connection = await session.connection()
+            result = await connection.execute(query.value, *args, **kwargs)
+            return result.all()
+
+    @asynccontextmanager
+    async def _session(self, params: dict = None, *args):
+        # Statements about a user pin the session, and so the rest of the unit of work, to the user's shard
+        if self.router is not None and isinstance(params, dict) and "user_id" in params:
+            self.router.pin_user(self.session, params["user_id"])
+        yield self.session
+
+
+class ReplicaDbAdapter(SqlAlchemyDbAdapter):
+    """Runs every statement in a short session on a replica that has replayed the request's consistency token, or
+    falls back to the primary's scoped session. Only for reads."""
+
+    def __init__(self, queries: dict, session: async_scoped_session, replicas: ReplicaPool, *args, **kwargs):
+        super().__init__(queries, session, *args, **kwargs)
+        self.replicas = replicas
+
+    @asynccontextmanager
+    async def _session(self, *args):
+        token = consistency_token()
+        engine = await self.replicas.choose(token.min_lsn if token else None)
+        if engine is None:
+            async with super()._session(*args) as session:
+                yield session
+            return
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            yield session
+
+
+def current_session_scope():
+    """Scope key for the session registry: the active ``session_scope``. Every request, task and CLI opens one, so
+    that its session is closed when it ends"""
+    scope = _session_scope.get()
+    if scope is None:
+        raise RuntimeError("The database session is used outside of session_scope")
+    return scope
+
+
+def sqlalchemy_session_factory(engine, router: ShardRouter = None):
+    if router is None:
+        session_maker = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    else:
+        session_maker = async_sessionmaker(
+            class_=AsyncSession, sync_session_class=UserShardedSession, router=router, expire_on_commit=False
+        )
+    yield async_scoped_session(session_maker, scopefunc=current_session_scope)
 
-async def sqlalchemy_session_factory(engine):
-    async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
-    async with async_session() as session:
-        yield session
+@asynccontextmanager
+async def session_scope(session: async_scoped_session):
+    """Binds a fresh ``AsyncSession`` to the enclosed block (one request or task) and closes it on exit"""
+    token = _session_scope.set(object())
+    try:
+        yield
+    finally:
+        await session.remove()
+        _session_scope.reset(token)
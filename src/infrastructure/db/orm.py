@@ -1,11 +1,12 @@
 from sqlalchemy import Table, Column, Integer, String, Boolean, DateTime, ForeignKey, Enum, Index, text, \
-    UniqueConstraint
+    UniqueConstraint, Text, PrimaryKeyConstraint, Date, BigInteger, Identity, func, DDL, event
 from sqlalchemy.orm import registry, relationship
 
 from src.application.models.user import User
 from src.application.models.product import Product
 from src.application.models.inventory import Inventory
 from src.application.models.transaction import Transaction
+from src.application.models.idempotency_record import IdempotencyRecord
 
 mapper_registry = registry()
 metadata = mapper_registry.metadata
@@ -43,20 +44,56 @@ inventory_table = Table(
     UniqueConstraint("user_id", "product_id", name="unique_user_product")
 )
 
+# Range partitioned by month, see src/infrastructure/partitions.py. The partition key has to be part of the primary key
 transaction_table = Table(
     "transaction",
     metadata,
-    Column("id", Integer, primary_key=True),
+    Column("id", Integer, primary_key=True, autoincrement=True),
     Column("user_id", Integer, ForeignKey("user.id"), nullable=False),
     Column("product_id", Integer, ForeignKey("product.id"), nullable=False),
     Column("amount", Integer, nullable=False),
     Column("status", Enum(Transaction.Status), nullable=False),
-    Column("created_at", DateTime, nullable=False),
+    Column("created_at", DateTime, primary_key=True),
     Index(
         "transaction_status_created_at_idx",
         "status", "created_at",
         postgresql_where=text("status = 'COMPLETED'"),
-    )
+    ),
+    postgresql_partition_by="RANGE (created_at)",
+)
+# Rows outside of the monthly partitions; also makes a table created from the metadata writable right away
+event.listen(
+    transaction_table, "after_create", DDL('CREATE TABLE transaction_default PARTITION OF "transaction" DEFAULT')
+)
+
+idempotency_record_table = Table(
+    "idempotency_record",
+    metadata,
+    Column("key", String(64), nullable=False),
+    Column("response", Text, nullable=False),
+    Column("created_at", DateTime, nullable=False),
+    # Covering the response lets replays of a key be answered with an index-only scan
+    PrimaryKeyConstraint("key", postgresql_include=["response"]),
+    Index("idempotency_record_created_at_idx", "created_at"),
+)
+
+# Completed purchase amounts per product and day, maintained by the purchase statement
+product_purchase_daily_table = Table(
+    "product_purchase_daily",
+    metadata,
+    Column("day", Date, nullable=False),
+    Column("product_id", Integer, ForeignKey("product.id"), nullable=False),
+    Column("purchase_count", Integer, nullable=False),
+    PrimaryKeyConstraint("day", "product_id"),
+)
+
+# Cache operations and events of committed units of work, written in the same transaction and drained by the relay
+outbox_table = Table(
+    "outbox",
+    metadata,
+    Column("id", BigInteger, Identity(), primary_key=True),
+    Column("operations", Text, nullable=False),
+    Column("created_at", DateTime, nullable=False, server_default=func.now()),
 )
 
 _mappers_initialized = False
@@ -73,6 +110,7 @@ def init_mappers():
         Inventory, inventory_table, properties={"user": relationship(User), "product": relationship(Product)}
     )
     mapper_registry.map_imperatively(Transaction, transaction_table)
+    mapper_registry.map_imperatively(IdempotencyRecord, idempotency_record_table)
     _mappers_initialized = True
 
 
@@ -1,6 +1,9 @@
-from sqlalchemy import select, bindparam, func, desc
+from sqlalchemy import select, bindparam, func, desc, update, insert, delete, literal, or_, and_, true, exists, \
+    Boolean, Integer, Date, DateTime
+from sqlalchemy.dialects.postgresql import ARRAY, insert as pg_insert
 from sqlalchemy.orm import joinedload
-from .orm import init_mappers
+from .orm import init_mappers, user_table, inventory_table, transaction_table, idempotency_record_table, \
+    product_purchase_daily_table, outbox_table, product_table
 from ...application.models.user import User
 
 _queries = None
@@ -11,6 +14,7 @@ def get_queries():
     if _queries is None:
         init_mappers()
 
+        from src.application.models.idempotency_record import IdempotencyRecord
         from src.application.models.inventory import Inventory
         from src.application.models.product import Product
         from src.application.models.transaction import Transaction
@@ -27,33 +31,280 @@ def get_queries():
                 )
                 .options(joinedload(Inventory.product), joinedload(Inventory.user))
             ),
-            "find_inventories_by_user": Query(
-                select(Inventory)
-                .where(Inventory.user_id == bindparam("user_id"))
-                .options(joinedload(Inventory.product), joinedload(Inventory.user))
-                .order_by(Inventory.quantity.desc())
+            "list_inventory_items": Query(_inventory_items_query().order_by(inventory_table.c.product_id)),
+            "list_inventory_items_page": Query(
+                _inventory_items_query()
+                .where(inventory_table.c.product_id > bindparam("cursor"))
+                .order_by(inventory_table.c.product_id)
+                .limit(bindparam("limit"))
             ),
             "find_user_by_id": Query(select(User).where(User.id == bindparam("user_id"))),
             "find_product_by_id": Query(select(Product).where(Product.id == bindparam("product_id"))),
-            "find_popular_products_by_purchases": Query(
+            "find_active_products": Query(select(Product).where(Product.is_active == True)),  # noqa: E712
+            "find_products_by_ids": Query(
+                select(Product).where(Product.id.in_(bindparam("product_ids", expanding=True)))
+            ),
+            "purchase_product": Query(_purchase_product_query(Transaction)),
+            "find_idempotency_record": Query(
+                select(IdempotencyRecord).where(IdempotencyRecord.key == bindparam("key"))
+            ),
+            "delete_expired_idempotency_records": Query(
+                delete(idempotency_record_table)
+                .where(
+                    idempotency_record_table.c.key.in_(
+                        select(idempotency_record_table.c.key)
+                        .where(idempotency_record_table.c.created_at < bindparam("created_before"))
+                        .order_by(idempotency_record_table.c.created_at)
+                        .limit(bindparam("batch_size"))
+                    )
+                )
+                .returning(idempotency_record_table.c.key)
+            ),
+            # Rows locked by another relay are skipped, so relays can run side by side without applying a row twice
+            "claim_outbox_messages": Query(
+                delete(outbox_table)
+                .where(
+                    outbox_table.c.id.in_(
+                        select(outbox_table.c.id)
+                        .where(
+                            outbox_table.c.created_at
+                            < func.now() - func.make_interval(0, 0, 0, 0, 0, 0, bindparam("grace_period", type_=Integer))
+                        )
+                        .order_by(outbox_table.c.id)
+                        .limit(bindparam("batch_size"))
+                        .with_for_update(skip_locked=True)
+                    )
+                )
+                .returning(outbox_table.c.id, outbox_table.c.operations)
+            ),
+            "find_popular_products_by_rollup": Query(
                 select(
                     Product.id.label("product_id"),
                     Product.name,
                     Product.price,
                     Product.type,
-                    func.sum(Transaction.amount).label("purchase_count"),
-                )
-                .join(Transaction, Product.id == Transaction.product_id)
-                .where(
-                    Transaction.status == Transaction.Status.COMPLETED,
-                    Transaction.created_at >= bindparam("start_date"),
+                    func.sum(product_purchase_daily_table.c.purchase_count).label("purchase_count"),
                 )
+                .join(product_purchase_daily_table, Product.id == product_purchase_daily_table.c.product_id)
+                .where(product_purchase_daily_table.c.day >= bindparam("start_date"))
                 .group_by(Product.id, Product.name, Product.price, Product.type)
                 .order_by(desc("purchase_count"))
                 .limit(bindparam("limit"))
             ),
+            **{name: Query(query) for name, query in _purchase_rollup_queries(Transaction).items()},
+            **{name: Query(query) for name, query in _consumption_queries().items()},
         }
     return _queries
 
 
+def _inventory_items_query():
+    """Only the columns an inventory item is made of, read as plain rows instead of ``Inventory`` entities"""
+    return (
+        select(
+            inventory_table.c.product_id,
+            product_table.c.name,
+            product_table.c.type,
+            product_table.c.price,
+            inventory_table.c.quantity,
+            inventory_table.c.purchased_at,
+        )
+        .join(product_table, product_table.c.id == inventory_table.c.product_id)
+        .where(inventory_table.c.user_id == bindparam("user_id"))
+    )
+
+
+def _purchase_product_query(transaction_model):
+    """Debits the user, upserts the inventory line and records the transaction in a single statement.
+
+    Every step only runs if the previous one affected a row: no row means the balance was insufficient,
+    a NULL quantity means the inventory guard (a permanent product already owned) rejected the upsert.
+    """
+    user_id = bindparam("user_id", type_=Integer)
+    product_id = bindparam("product_id", type_=Integer)
+    quantity = bindparam("quantity", type_=Integer)
+    price = bindparam("price", type_=Integer)
+
+    debited = (
+        update(user_table)
+        .where(user_table.c.id == user_id, user_table.c.balance >= price)
+        .values(balance=user_table.c.balance - price)
+        .returning(user_table.c.id, user_table.c.balance)
+        .cte("debited")
+    )
+    upsert = pg_insert(inventory_table).from_select(
+        ["user_id", "product_id", "quantity", "purchased_at"],
+        select(debited.c.id, product_id, quantity, func.now()),
+    )
+    upserted = (
+        upsert.on_conflict_do_update(
+            index_elements=[inventory_table.c.user_id, inventory_table.c.product_id],
+            set_={"quantity": inventory_table.c.quantity + upsert.excluded.quantity},
+            where=or_(bindparam("consumable", type_=Boolean), inventory_table.c.quantity < 1),
+        )
+        .returning(inventory_table.c.quantity, inventory_table.c.purchased_at)
+        .cte("upserted")
+    )
+    recorded = (
+        insert(transaction_table)
+        .from_select(
+            ["user_id", "product_id", "amount", "status", "created_at"],
+            select(
+                user_id,
+                product_id,
+                quantity,
+                literal(transaction_model.Status.COMPLETED, transaction_table.c.status.type),
+                func.now(),
+            ).select_from(upserted),
+        )
+        .returning(transaction_table.c.id)
+        .cte("recorded")
+    )
+    rollup = pg_insert(product_purchase_daily_table).from_select(
+        ["day", "product_id", "purchase_count"],
+        select(func.current_date(), product_id, quantity).select_from(upserted),
+    )
+    rolled_up = (
+        rollup.on_conflict_do_update(
+            index_elements=[product_purchase_daily_table.c.day, product_purchase_daily_table.c.product_id],
+            set_={"purchase_count": product_purchase_daily_table.c.purchase_count + rollup.excluded.purchase_count},
+        )
+        .returning(product_purchase_daily_table.c.day)
+        .cte("rolled_up")
+    )
+    return (
+        select(debited.c.balance, upserted.c.quantity, upserted.c.purchased_at)
+        .select_from(debited)
+        .outerjoin(upserted, true())
+        .add_cte(recorded, rolled_up)
+    )
+
+
+def _purchase_rollup_queries(transaction_model) -> dict:
+    """Maintenance of ``product_purchase_daily`` over ``[start_date, end_date)``: rebuild from and compare against
+    the raw ``transaction`` table"""
+    start_date = bindparam("start_date", type_=Date)
+    end_date = bindparam("end_date", type_=Date)
+    # The same values typed like the partition key, so scans of ``transaction`` only plan the partitions in range
+    start_at = bindparam("start_date", type_=DateTime)
+    end_at = bindparam("end_date", type_=DateTime)
+    rollup = product_purchase_daily_table
+
+    purchases = (
+        select(
+            func.date(transaction_table.c.created_at).label("day"),
+            transaction_table.c.product_id,
+            func.sum(transaction_table.c.amount).label("purchase_count"),
+        )
+        .where(
+            transaction_table.c.status == transaction_model.Status.COMPLETED,
+            transaction_table.c.created_at >= start_at,
+            transaction_table.c.created_at < end_at,
+        )
+        .group_by(func.date(transaction_table.c.created_at), transaction_table.c.product_id)
+    )
+    backfill = pg_insert(rollup).from_select(["day", "product_id", "purchase_count"], purchases)
+    backfill = backfill.on_conflict_do_update(
+        index_elements=[rollup.c.day, rollup.c.product_id],
+        set_={"purchase_count": backfill.excluded.purchase_count},
+    ).returning(rollup.c.day)
+
+    prune = (
+        delete(rollup)
+        .where(
+            rollup.c.day >= start_date,
+            rollup.c.day < end_date,
+            ~exists().where(
+                transaction_table.c.product_id == rollup.c.product_id,
+                transaction_table.c.status == transaction_model.Status.COMPLETED,
+                transaction_table.c.created_at >= start_at,
+                transaction_table.c.created_at < end_at,
+                transaction_table.c.created_at >= rollup.c.day,
+                transaction_table.c.created_at < rollup.c.day + 1,
+            ),
+        )
+        .returning(rollup.c.day)
+    )
+
+    expected = purchases.subquery("expected")
+    actual = (
+        select(rollup.c.day, rollup.c.product_id, rollup.c.purchase_count)
+        .where(rollup.c.day >= start_date, rollup.c.day < end_date)
+        .subquery("actual")
+    )
+    expected_count = func.coalesce(expected.c.purchase_count, 0)
+    actual_count = func.coalesce(actual.c.purchase_count, 0)
+    mismatches = (
+        select(
+            func.coalesce(expected.c.day, actual.c.day).label("day"),
+            func.coalesce(expected.c.product_id, actual.c.product_id).label("product_id"),
+            expected_count.label("expected"),
+            actual_count.label("actual"),
+        )
+        .select_from(
+            expected.join(
+                actual,
+                and_(expected.c.day == actual.c.day, expected.c.product_id == actual.c.product_id),
+                full=True,
+            )
+        )
+        .where(expected_count != actual_count)
+        .order_by("day", "product_id")
+    )
+
+    return {
+        "find_daily_purchases": purchases,
+        "backfill_product_purchase_daily": backfill,
+        "prune_product_purchase_daily": prune,
+        "find_product_purchase_daily_mismatches": mismatches,
+    }
+
+
+def _consumption_queries() -> dict:
+    """Write-behind consumption, see ``src/infrastructure/consumption.py``"""
+    # Read in one statement, so the quantity and the applied batches come from the same snapshot
+    applied_batches = (
+        select(func.array_agg(idempotency_record_table.c.key))
+        .where(idempotency_record_table.c.key.in_(bindparam("batch_keys", expanding=True)))
+        .scalar_subquery()
+    )
+    find_consumable = select(
+        inventory_table.c.quantity,
+        applied_batches.label("applied_batch_keys"),
+    ).where(
+        inventory_table.c.user_id == bindparam("user_id"),
+        inventory_table.c.product_id == bindparam("product_id"),
+    )
+
+    # Blocks while another flusher holds the batch's transaction, and returns no row once the batch was committed
+    record_batch = (
+        pg_insert(idempotency_record_table)
+        .values(key=bindparam("key"), response=bindparam("response"), created_at=func.now())
+        .on_conflict_do_nothing(index_elements=[idempotency_record_table.c.key])
+        .returning(idempotency_record_table.c.key)
+    )
+
+    # Arrays instead of a VALUES list keep the statement text, and so its prepared statement, the same for every batch
+    deltas = (
+        func.unnest(
+            bindparam("user_ids", type_=ARRAY(Integer)),
+            bindparam("product_ids", type_=ARRAY(Integer)),
+            bindparam("deltas", type_=ARRAY(Integer)),
+        )
+        .table_valued("user_id", "product_id", "delta")
+        .render_derived(name="deltas")
+    )
+    apply_deltas = (
+        update(inventory_table)
+        .where(inventory_table.c.user_id == deltas.c.user_id, inventory_table.c.product_id == deltas.c.product_id)
+        .values(quantity=inventory_table.c.quantity - deltas.c.delta)
+        .returning(inventory_table.c.user_id)
+    )
+    return {
+        "find_consumable_quantity": find_consumable,
+        "record_consumption_batch": record_batch,
+        "apply_consumption_deltas": apply_deltas,
+    }
+
+
 queries = get_queries()
+
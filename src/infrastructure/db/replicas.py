@@ -0,0 +1,135 @@
+"""Read replicas and read-your-writes consistency tokens.
+
+A unit of work that committed records the primary's WAL position (LSN) in the request's ``ConsistencyToken``, which
+is handed to the client. Reads presenting a token go to a replica only once it has replayed that position, and to
+the primary otherwise.
+"""
+import itertools
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+from src.application.single_flight import SingleFlight
+
+_logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ConsistencyToken:
+    # Position the request's reads must observe, and the position of the request's own last commit
+    min_lsn: int | None = None
+    written_lsn: int | None = None
+
+
+_consistency_token: ContextVar[ConsistencyToken | None] = ContextVar("consistency_token", default=None)
+
+
+def consistency_token() -> ConsistencyToken | None:
+    return _consistency_token.get()
+
+
+@contextmanager
+def consistency_scope(token: ConsistencyToken):
+    """Binds ``token`` to the enclosed block, e.g. one request"""
+    reset = _consistency_token.set(token)
+    try:
+        yield token
+    finally:
+        _consistency_token.reset(reset)
+
+
+def parse_lsn(lsn: str) -> int:
+    """``"16/B374D848"`` to a comparable integer"""
+    high, low = lsn.split("/")
+    return int(high, 16) << 32 | int(low, 16)
+
+
+def format_lsn(lsn: int) -> str:
+    return f"{lsn >> 32:X}/{lsn & 0xFFFFFFFF:X}"
+
+
+@dataclass
+class _ReplicaState:
+    # None means the server isn't replaying WAL (a stand-alone Postgres standing in for a replica), so it is current
+    replayed_lsn: int | None = None
+    lag: float = 0.0
+    healthy: bool = False
+    checked_at: float = float("-inf")
+
+
+class ReplicaPool:
+    """Round-robin over the replicas whose replication lag is within ``max_lag`` seconds. Reads that find a replica's
+    state out of date share one in-flight lag check of it"""
+
+    def __init__(self, engines: list[AsyncEngine], max_lag: float = 5.0, check_interval: float = 1.0):
+        self.engines = engines
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._states = [_ReplicaState() for _ in engines]
+        self._next = itertools.count()
+        self._checks = SingleFlight()
+
+    async def choose(self, min_lsn: int | None = None) -> AsyncEngine | None:
+        """A replica that has replayed ``min_lsn``, or None if the read has to go to the primary"""
+        if not self.engines:
+            return None
+        start = next(self._next)
+        for offset in range(len(self.engines)):
+            index = (start + offset) % len(self.engines)
+            state = self._states[index]
+            if time.monotonic() - state.checked_at >= self.check_interval:
+                await self._check(index)
+            elif min_lsn is not None and not self._replayed(state, min_lsn):
+                # The cached position may just be old
+                await self._check(index)
+            if state.healthy and (min_lsn is None or self._replayed(state, min_lsn)):
+                return self.engines[index]
+        return None
+
+    async def _check(self, index: int) -> None:
+        await self._checks.do(str(index), lambda: self._probe_state(index))
+
+    async def _probe_state(self, index: int) -> None:
+        state = self._states[index]
+        try:
+            state.replayed_lsn, state.lag = await self._probe(self.engines[index])
+            state.healthy = state.lag <= self.max_lag
+        except Exception as e:
+            _logger.warning(f"Replica {index} failed its lag check: {e}")
+            state.healthy = False
+        state.checked_at = time.monotonic()
+
+    async def _probe(self, engine: AsyncEngine) -> tuple[int | None, float]:
+        async with engine.connect() as connection:
+            row = (
+                await connection.execute(
+                    text(
+                        "SELECT pg_is_in_recovery(), pg_last_wal_replay_lsn()::text, "
+                        "CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                        "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+                    )
+                )
+            ).one()
+        in_recovery, replayed, lag = row
+        if not in_recovery:
+            return None, 0.0
+        return parse_lsn(replayed), float(lag or 0)
+
+    @staticmethod
+    def _replayed(state: _ReplicaState, lsn: int) -> bool:
+        return state.replayed_lsn is None or state.replayed_lsn >= lsn
+
+
+async def init_replica_engines(urls: list[str], pool_size: int, max_overflow: int):
+    engines = [
+        create_async_engine(url, pool_size=pool_size, max_overflow=max_overflow, pool_pre_ping=True)
+        for url in urls or []
+    ]
+    yield engines
+    for engine in engines:
+        await engine.dispose()
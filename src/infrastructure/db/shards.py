@@ -0,0 +1,126 @@
+"""User-sharded databases.
+
+Users are hashed into a fixed number of buckets and every bucket lives on one shard: ``bucket % len(shards)``
+unless ``bucket_map`` moved it elsewhere. Rows belonging to a user (``user``, ``inventory``, ``transaction``, the
+purchase rollup, idempotency records and outbox messages written by their units of work) live on the user's shard;
+``product`` is replicated to every shard.
+
+``SqlAlchemyDbAdapter`` pins the session to the user's shard whenever a statement has a ``user_id`` parameter, and
+the rest of the unit of work follows the pin. Statements of an unpinned session that only read replicated tables go
+to a single shard, every other one is scattered to all shards and their results are concatenated.
+"""
+from functools import lru_cache
+
+from sqlalchemy.ext import horizontal_shard
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.orm import ORMExecuteState
+from sqlalchemy.sql.util import find_tables
+
+SHARD_BUCKETS = 256
+# Copied to every shard, so a read of only these tables can go to any one of them
+REPLICATED_TABLES = frozenset({"product"})
+
+_SHARD_ID = "shard_id"
+
+
+class ShardingError(Exception):
+    pass
+
+
+class ShardRouter:
+    def __init__(self, engines: list[AsyncEngine], buckets: int = SHARD_BUCKETS, bucket_map: dict[int, int] = None):
+        self.engines = engines
+        self.buckets = buckets
+        self.bucket_map = bucket_map or {}
+        self.shard_ids = [str(index) for index in range(len(engines))]
+
+    def bucket_for(self, user_id: int) -> int:
+        return int(user_id) % self.buckets
+
+    def shard_for(self, user_id: int) -> str:
+        return self.shard_for_bucket(self.bucket_for(user_id))
+
+    def shard_for_bucket(self, bucket: int) -> str:
+        return str(self.bucket_map.get(bucket, bucket % len(self.engines)))
+
+    def engine(self, shard_id: str) -> AsyncEngine:
+        return self.engines[int(shard_id)]
+
+    def pin_user(self, session, user_id: int) -> None:
+        pin_shard(session, self.shard_for(user_id))
+
+    async def dispose(self) -> None:
+        for engine in self.engines:
+            await engine.dispose()
+
+
+def pin_shard(session, shard_id: str | None) -> None:
+    """Sends the session's statements that don't name a user to ``shard_id``, or scatters them again for None"""
+    session.info[_SHARD_ID] = shard_id
+
+
+def pinned_shard(session) -> str | None:
+    return session.info.get(_SHARD_ID)
+
+
+class UserShardedSession(horizontal_shard.ShardedSession):
+    """``ShardedSession`` choosing shards from the session's pin, see ``pin_shard``"""
+
+    def __init__(self, router: ShardRouter, **kwargs):
+        self.router = router
+        super().__init__(
+            shard_chooser=self._choose_shard,
+            identity_chooser=self._choose_identity,
+            execute_chooser=self._choose_execution,
+            shards={shard_id: router.engine(shard_id).sync_engine for shard_id in router.shard_ids},
+            **kwargs,
+        )
+
+    def get_bind(self, mapper=None, *, shard_id=None, instance=None, clause=None, **kw):
+        # A plain ``connection()`` names neither a shard nor an entity to choose one from
+        if shard_id is None and mapper is None and instance is None:
+            shard_id = pinned_shard(self)
+            if shard_id is None:
+                raise ShardingError("The session isn't pinned to a shard")
+        return super().get_bind(mapper, shard_id=shard_id, instance=instance, clause=clause, **kw)
+
+    def _choose_shard(self, mapper, instance, clause=None, **kw) -> str:
+        shard_id = pinned_shard(self)
+        if shard_id is not None:
+            return shard_id
+        user_id = getattr(instance, "user_id", None)
+        if user_id is None and mapper is not None and mapper.local_table.name == "user":
+            user_id = getattr(instance, "id", None)
+        if user_id is None:
+            raise ShardingError(f"Can't choose a shard for {mapper} outside of a user's unit of work")
+        return self.router.shard_for(user_id)
+
+    def _choose_identity(self, mapper, primary_key, **kw) -> list[str]:
+        shard_id = pinned_shard(self)
+        return [shard_id] if shard_id is not None else self.router.shard_ids
+
+    def _choose_execution(self, context: ORMExecuteState) -> list[str]:
+        shard_id = pinned_shard(self)
+        if _replicated_only(context.statement):
+            return [shard_id or self.router.shard_ids[0]]
+        if shard_id is not None:
+            return [shard_id]
+        return self.router.shard_ids
+
+
+@lru_cache(maxsize=1024)
+def _replicated_only(statement) -> bool:
+    tables = {table.name for table in find_tables(statement, include_crud=True)}
+    return bool(tables) and tables <= REPLICATED_TABLES
+
+
+def init_shard_router(
+    urls: list[str], buckets: int, bucket_map: dict[int, int], pool_size: int, max_overflow: int
+) -> ShardRouter | None:
+    """The router over ``urls``, or None if the database isn't sharded"""
+    if not urls:
+        return None
+    engines = [
+        create_async_engine(url, pool_size=pool_size, max_overflow=max_overflow, pool_pre_ping=True) for url in urls
+    ]
+    return ShardRouter(engines, buckets, bucket_map)
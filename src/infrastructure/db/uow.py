@@ -1,42 +1,83 @@
-from typing import Callable
-from sqlalchemy.ext.asyncio import AsyncSession
+import asyncio
+import logging
+import time
+
+from sqlalchemy import insert, text
+from sqlalchemy.ext.asyncio import async_scoped_session
 
 from src.interfaces.uow import UnitOfWork
 from src.interfaces.domain_model import DomainModel
-from src.interfaces.cache import Cache
+from src.interfaces.cache import Cache, CacheOperation
+from .orm import outbox_table
+from ..metrics import metrics
+from .replicas import consistency_token, parse_lsn
+from .shards import pinned_shard
+from ..outbox import OUTBOX_APPLIED_TTL, outbox_marker, serialize_operations
+
+_logger = logging.getLogger(__name__)
 
 
 class SqlAlchemyUnitOfWork(UnitOfWork):
-    def __init__(self, session: AsyncSession, cache: Cache, active_test: bool = False):
+    def __init__(
+        self,
+        session: async_scoped_session,
+        cache: Cache,
+        active_test: bool = False,
+        flush_attempts: int = 3,
+        flush_retry_delay: float = 0.05,
+        track_lsn: bool = False,
+    ):
         super().__init__(cache)
         self.session = session
-        self._cache_operations: list[Callable] = []
         self._nested_transaction = None
         self.active_test = active_test
-
-    async def __aenter__(self):
-        if self._depth == 1:
-            await self.session.__aenter__()
-        return await super().__aenter__()
+        self.flush_attempts = flush_attempts
+        self.flush_retry_delay = flush_retry_delay
+        self.track_lsn = track_lsn
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         await super().__aexit__(exc_type, exc_val, exc_tb)
         if self._depth == 0:
-            if exc_type is None and not self.active_test:
-                await self.session.commit()
-                for operation in self._cache_operations:
-                    await operation()
-            else:
-                await self.session.rollback()
-
-            self._cache_operations.clear()
-            await self.session.__aexit__(exc_type, exc_val, exc_tb)
+            try:
+                if exc_type is None and not self.active_test:
+                    await self.commit()
+                else:
+                    await self.session.rollback()
+            finally:
+                self._cache_operations.clear()
 
     async def commit(self):
-        await self.session.commit()
-        for operation in self._cache_operations:
-            await operation()
-        self._cache_operations.clear()
+        operations, self._cache_operations = self._cache_operations, []
+        try:
+            if operations:
+                message_id = await self.session.scalar(
+                    insert(outbox_table)
+                    .values(operations=serialize_operations(operations))
+                    .returning(outbox_table.c.id)
+                )
+                marker = CacheOperation(
+                    CacheOperation.Kind.SET,
+                    outbox_marker(message_id, pinned_shard(self.session)),
+                    ("1",),
+                    {"ttl": OUTBOX_APPLIED_TTL},
+                )
+                operations.append(marker)
+            await self.session.commit()
+        except Exception:
+            await self.rollback()
+            raise
+        await self._flush_cache_operations(operations)
+        if self.track_lsn:
+            await self._record_lsn()
+
+    async def _record_lsn(self):
+        """Makes the request's later reads, and the client's next ones, wait for replicas to replay this commit"""
+        token = consistency_token()
+        if token is None:
+            return
+        lsn = parse_lsn(await self.session.scalar(text("SELECT pg_current_wal_lsn()::text")))
+        token.written_lsn = max(token.written_lsn or 0, lsn)
+        token.min_lsn = max(token.min_lsn or 0, lsn)
 
     async def rollback(self):
         await self.session.rollback()
@@ -49,11 +90,27 @@ class SqlAlchemyUnitOfWork(UnitOfWork):
         for obj in objs:
             await self.session.delete(obj)
 
-    def cache_set(self, key: str, value: str, options: dict = None):
-        self._cache_operations.append(lambda: self.cache.set(key, value, options))
+    async def _flush_cache_operations(self, operations: list[CacheOperation]):
+        """Applies the queued cache writes in one round-trip.
 
-    def cache_delete(self, key: str, options: dict = None):
-        self._cache_operations.append(lambda: self.cache.delete(key, options))
+        The transaction is already committed, so a cache failure is retried and then only logged: without the
+        applied marker the outbox relay applies the operations again once the grace period is over.
+        """
+        if not operations:
+            return
+        started = time.perf_counter()
+        for attempt in range(self.flush_attempts):
+            try:
+                # Atomic, so the relay never finds the marker without the operations it stands for
+                await self.cache.apply(operations, {"transaction": True})
+                break
+            except Exception as e:
+                if attempt == self.flush_attempts - 1:
+                    metrics.inc("uow_cache_flush_failures_total")
+                    _logger.warning(f"Failed to apply {len(operations)} cache operations after commit: {e}")
+                    break
+                await asyncio.sleep(self.flush_retry_delay * 2**attempt)
+        metrics.observe("uow_cache_flush_seconds", time.perf_counter() - started)
 
     async def _create_savepoint(self):
         self._nested_transaction = await self.session.begin_nested()
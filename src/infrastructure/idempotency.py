@@ -0,0 +1,78 @@
+import asyncio
+import json
+from typing import Awaitable, Callable
+
+from src.application.errors import Conflict
+from src.application.repositories.idempotency import IdempotencyRepository
+from src.interfaces.cache import Cache
+from src.interfaces.idempotency import Idempotency
+
+PENDING = "__pending__"
+
+
+class CacheIdempotency(Idempotency):
+    """Reserves the key with a pending marker (SET NX) before running the operation.
+
+    Duplicates that find the marker poll with exponential backoff until the first request stores its result,
+    instead of running the transaction again. A failed operation releases the key so the client can retry.
+
+    Redis is only a cache in front of the ``idempotency_record`` ledger, which use cases write in the same
+    transaction as their change. If Redis lost the key, the ledger's primary key rejects the repeated commit and
+    the stored response is returned (and re-cached) instead.
+    """
+
+    def __init__(
+        self,
+        cache: Cache,
+        ledger: IdempotencyRepository = None,
+        ttl: int = 60 * 5,
+        pending_ttl: int = 30,
+        wait_timeout: float = 10.0,
+        poll_interval: float = 0.01,
+        max_poll_interval: float = 0.5,
+    ):
+        self.cache = cache
+        self.ledger = ledger
+        self.ttl = ttl
+        self.pending_ttl = pending_ttl
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+
+    async def execute(self, key: str, operation: Callable[[], Awaitable[dict]]) -> dict:
+        cached = await self._reserve(key)
+        if cached is not None:
+            return json.loads(cached)
+        try:
+            result = await operation()
+        except BaseException as e:
+            recorded = await self._find_recorded(key) if isinstance(e, Exception) else None
+            if recorded is None:
+                await self.cache.delete(key)
+                raise
+            await self.cache.set(key, recorded, {"ttl": self.ttl})
+            return json.loads(recorded)
+        await self.cache.set(key, json.dumps(result), {"ttl": self.ttl})
+        return result
+
+    async def _find_recorded(self, key: str) -> str | None:
+        if self.ledger is None:
+            return None
+        record = await self.ledger.find_record(key)
+        return record.response if record else None
+
+    async def _reserve(self, key: str) -> str | None:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.wait_timeout
+        delay = self.poll_interval
+        while True:
+            if await self.cache.add(key, PENDING, {"ttl": self.pending_ttl}):
+                return None
+            cached = await self.cache.get(key)
+            # None: the key was released in between, so it is reserved again after the backoff
+            if cached is not None and cached != PENDING:
+                return cached
+            if loop.time() >= deadline:
+                raise Conflict("Request with this idempotency key is still being processed")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_poll_interval)
@@ -0,0 +1,126 @@
+"""Per-user ordering of writes.
+
+Concurrent purchases, consumes and top-ups of one user all take the same ``user`` and ``inventory`` row locks, and
+every one of them holds a database connection while it waits for them. Serialized here, they wait before their unit
+of work begins instead.
+"""
+import asyncio
+import logging
+import time
+import uuid
+from contextlib import asynccontextmanager
+
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from src.interfaces.keyed_lock import KeyedLock
+from .metrics import metrics
+
+_logger = logging.getLogger(__name__)
+
+# Deletes the lease only if it is still the caller's, not one taken by another worker after it expired
+_RELEASE_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+
+
+def user_lock_key(key: str) -> str:
+    return f"user_lock:{key}"
+
+
+class _Entry:
+    __slots__ = ("lock", "users")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0
+
+
+class LocalKeyedLock(KeyedLock):
+    """An ``asyncio.Lock`` per key, dropped as soon as no one holds or waits for it"""
+
+    def __init__(self):
+        self._entries: dict[str, _Entry] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @asynccontextmanager
+    async def hold(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = _Entry()
+        entry.users += 1
+        started = time.perf_counter()
+        try:
+            async with entry.lock:
+                metrics.observe("user_lock_wait_seconds", time.perf_counter() - started, {"lock": "local"})
+                yield
+        finally:
+            entry.users -= 1
+            if entry.users == 0:
+                del self._entries[key]
+
+
+class RedisKeyedLock(KeyedLock):
+    """A lease in Redis shared by every worker, taken behind a ``LocalKeyedLock`` so that a worker's own waiters
+    queue in memory and only one of them polls Redis.
+
+    The lease expires after ``lease_ttl`` seconds in case its holder died. A caller that waited ``wait_timeout``
+    seconds, or couldn't reach Redis, runs without the lease: the database still serializes the rows.
+    """
+
+    def __init__(
+        self,
+        redis: Redis,
+        local: LocalKeyedLock = None,
+        lease_ttl: float = 5.0,
+        wait_timeout: float = 5.0,
+        poll_interval: float = 0.005,
+        max_poll_interval: float = 0.1,
+    ):
+        self.redis = redis
+        self.local = local or LocalKeyedLock()
+        self.lease_ttl = lease_ttl
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self._release_script = redis.register_script(_RELEASE_SCRIPT)
+
+    @asynccontextmanager
+    async def hold(self, key: str):
+        async with self.local.hold(key):
+            name = user_lock_key(key)
+            started = time.perf_counter()
+            token = await self._acquire(name)
+            metrics.observe("user_lock_wait_seconds", time.perf_counter() - started, {"lock": "redis"})
+            try:
+                yield
+            finally:
+                if token is not None:
+                    await self._release(name, token)
+
+    async def _acquire(self, name: str) -> str | None:
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.wait_timeout
+        delay = self.poll_interval
+        try:
+            while not await self.redis.set(name, token, nx=True, px=int(self.lease_ttl * 1000)):
+                if time.monotonic() >= deadline:
+                    metrics.inc("user_lock_timeouts_total")
+                    return None
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_poll_interval)
+        except RedisError as e:
+            _logger.warning(f"Failed to take the lease {name}: {e}")
+            return None
+        return token
+
+    async def _release(self, name: str, token: str) -> None:
+        try:
+            await self._release_script(keys=[name], args=[token])
+        except RedisError as e:
+            _logger.warning(f"Failed to release the lease {name}, it expires on its own: {e}")
@@ -0,0 +1,42 @@
+from collections import defaultdict
+
+
+class Metrics:
+    """Process-local counters and summaries, rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self._counters: dict[tuple, float] = defaultdict(float)
+        self._summaries: dict[tuple, list[float]] = defaultdict(lambda: [0, 0.0])
+
+    def inc(self, name: str, labels: dict = None, amount: float = 1) -> None:
+        self._counters[(name, _labels(labels))] += amount
+
+    def observe(self, name: str, value: float, labels: dict = None) -> None:
+        summary = self._summaries[(name, _labels(labels))]
+        summary[0] += 1
+        summary[1] += value
+
+    def value(self, name: str, labels: dict = None) -> float:
+        return self._counters.get((name, _labels(labels)), 0)
+
+    def render(self) -> str:
+        lines = []
+        for (name, labels), value in sorted(self._counters.items()):
+            lines.append(f"{name}{_render_labels(labels)} {value}")
+        for (name, labels), (count, total) in sorted(self._summaries.items()):
+            lines.append(f"{name}_count{_render_labels(labels)} {count}")
+            lines.append(f"{name}_sum{_render_labels(labels)} {total}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels: dict | None) -> tuple:
+    return tuple(sorted((labels or {}).items()))
+
+
+def _render_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+metrics = Metrics()
@@ -0,0 +1,164 @@
+"""Transactional outbox for cache operations and events.
+
+Every unit of work that queued cache operations stores them in the ``outbox`` table within its transaction. After
+the commit it applies them right away together with an ``outbox:applied:{id}`` marker, in one MULTI/EXEC. The relay
+deletes rows older than the grace period in batches (``FOR UPDATE SKIP LOCKED``) and re-applies those that were
+never marked, i.e. whose worker died between the commit and the cache flush, marking them in the same way. Writes
+of absolute state are not replayed that late: their keys are dropped instead, see ``_recovered``. With sharded
+databases every shard has its own outbox, so the markers of the shards' messages are kept apart and the relay
+drains one shard after the other.
+
+    python -m src.infrastructure.outbox --interval 5
+"""
+import argparse
+import asyncio
+import json
+import logging
+
+from sqlalchemy.ext.asyncio import async_scoped_session
+
+from src.interfaces.cache import Cache, CacheOperation
+from src.interfaces.db_adapter import DbAdapter
+from src.interfaces.uow import UnitOfWork
+from .db.db_adapter import session_scope
+from .db.shards import ShardRouter, pin_shard
+
+_logger = logging.getLogger(__name__)
+
+# Must outlive the grace period plus the relay interval, or applied rows would be applied again
+OUTBOX_APPLIED_TTL = 60 * 60
+
+
+def outbox_marker(message_id: int, shard_id: str = None) -> str:
+    if shard_id is None:
+        return f"outbox:applied:{message_id}"
+    return f"outbox:applied:{shard_id}:{message_id}"
+
+
+def serialize_operations(operations: list[CacheOperation]) -> str:
+    return json.dumps(
+        [
+            {"kind": operation.kind.value, "key": operation.key, "args": list(operation.args), "options": operation.options}
+            for operation in operations
+        ]
+    )
+
+
+def deserialize_operations(payload: str) -> list[CacheOperation]:
+    return [
+        CacheOperation(CacheOperation.Kind(item["kind"]), item["key"], tuple(item["args"]), item["options"])
+        for item in json.loads(payload)
+    ]
+
+
+class OutboxRelay:
+    def __init__(
+        self,
+        session: async_scoped_session,
+        db: DbAdapter,
+        uow: UnitOfWork,
+        cache: Cache,
+        batch_size: int = 500,
+        grace_period: int = 30,
+        router: ShardRouter = None,
+    ):
+        self.session = session
+        self.db = db
+        self.uow = uow
+        self.cache = cache
+        self.batch_size = batch_size
+        self.grace_period = grace_period
+        self.router = router
+
+    async def drain(self) -> int:
+        """Relays every row past the grace period. Returns the number of rows that had to be applied"""
+        relayed = 0
+        for shard_id in self.router.shard_ids if self.router is not None else [None]:
+            relayed += await self._drain(shard_id)
+        return relayed
+
+    async def _drain(self, shard_id: str | None) -> int:
+        relayed = 0
+        async with session_scope(self.session):
+            if shard_id is not None:
+                pin_shard(self.session, shard_id)
+            while True:
+                # A failed apply rolls the claim back, so the rows are retried by the next run
+                async with self.uow:
+                    claimed = await self.db.execute(
+                        self.db.queries["claim_outbox_messages"],
+                        {"grace_period": self.grace_period, "batch_size": self.batch_size},
+                    )
+                    relayed += await self.apply(claimed, shard_id)
+                if len(claimed) < self.batch_size:
+                    return relayed
+
+    async def apply(self, messages: list[dict], shard_id: str = None) -> int:
+        messages = sorted(messages, key=lambda message: message["id"])
+        markers = await self.cache.mget([outbox_marker(message["id"], shard_id) for message in messages])
+        pending = [message for message, marker in zip(messages, markers) if marker is None]
+        operations = []
+        for message in pending:
+            operations.extend(map(_recovered, deserialize_operations(message["operations"])))
+            # Marked like a unit of work does, so a claim rolled back after this apply isn't applied again
+            operations.append(
+                CacheOperation(
+                    CacheOperation.Kind.SET,
+                    outbox_marker(message["id"], shard_id),
+                    ("1",),
+                    {"ttl": OUTBOX_APPLIED_TTL},
+                )
+            )
+        await self.cache.apply(operations, {"transaction": True})
+        return len(pending)
+
+
+def _recovered(operation: CacheOperation) -> CacheOperation:
+    """The operation to replay at least a grace period after its commit. Counters, sorted set increments and stream
+    entries don't depend on order, but a write of absolute state such as an inventory patch may be older than a later
+    write to the same key by now, so the key is dropped instead and rebuilt by its next reader"""
+    if operation.kind in _STATE_KINDS:
+        return CacheOperation(CacheOperation.Kind.DELETE, operation.key, (), None)
+    return operation
+
+
+_STATE_KINDS = {CacheOperation.Kind.SET, CacheOperation.Kind.HSET}
+
+
+async def _run(args: argparse.Namespace):
+    from .config import Settings
+    from .container import Container
+
+    container = Container()
+    container.config.from_pydantic(Settings())
+    await container.init_resources()
+    try:
+        relay = await container.outbox_relay()
+        while True:
+            try:
+                relayed = await relay.drain()
+                if relayed:
+                    _logger.info(f"Relayed {relayed} outbox messages")
+            except Exception as e:
+                _logger.warning(f"Failed to relay outbox messages: {e}")
+            if args.once:
+                return
+            await asyncio.sleep(args.interval)
+    finally:
+        if container.shard_router() is not None:
+            await container.shard_router().dispose()
+        await container.engine().dispose()
+        await container.shutdown_resources()
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Relay outbox messages to the cache")
+    parser.add_argument("--interval", type=float, default=5, help="Seconds between drains")
+    parser.add_argument("--once", action="store_true", help="Drain once and exit")
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_run(parser.parse_args(argv)))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
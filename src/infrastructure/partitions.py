@@ -0,0 +1,166 @@
+"""Monthly partitions of the ``transaction`` table.
+
+Partitions ``transaction_pYYYY_MM`` are created a few months ahead, and rows missing one end up in
+``transaction_default`` until their month's partition is created and they are moved into it. Partitions older than
+the retention are copied to ``transaction_pYYYY_MM.csv.gz`` in the archive directory, then detached and dropped. The
+purchase rollup keeps their totals, so don't backfill it over archived months.
+
+    python -m src.infrastructure.partitions create
+    python -m src.infrastructure.partitions archive
+"""
+import argparse
+import asyncio
+import gzip
+import logging
+import os
+import re
+from datetime import date
+from pathlib import Path
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from .db.shards import ShardRouter
+
+_logger = logging.getLogger(__name__)
+
+_PARTITION_NAME = re.compile(r"^transaction_p(\d{4})_(\d{2})$")
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"transaction_p{month:%Y_%m}"
+
+
+async def create_partitions(engine: AsyncEngine, months_ahead: int) -> list[str]:
+    """Creates the missing partitions from the current month to ``months_ahead`` months after it"""
+    current = date.today().replace(day=1)
+    created = []
+    async with engine.begin() as connection:
+        existing = {name for name, _ in await list_partitions(connection)}
+        for offset in range(months_ahead + 1):
+            month = add_months(current, offset)
+            name = partition_name(month)
+            if name in existing:
+                continue
+            await _create_partition(connection, name, month)
+            created.append(name)
+    return created
+
+
+async def _create_partition(connection: AsyncConnection, name: str, month: date) -> None:
+    """Creates the month's partition, moving its rows out of the default partition, which would otherwise fail it"""
+    bounds = f"created_at >= '{month}' AND created_at < '{add_months(month, 1)}'"
+    stranded = await connection.scalar(text(f"SELECT EXISTS (SELECT 1 FROM transaction_default WHERE {bounds})"))
+    if stranded:
+        await connection.execute(text('CREATE TEMPORARY TABLE moved (LIKE "transaction") ON COMMIT DROP'))
+        moved = await connection.execute(
+            text(f"WITH stranded AS (DELETE FROM transaction_default WHERE {bounds} RETURNING *) "
+                 f"INSERT INTO moved SELECT * FROM stranded")
+        )
+        _logger.warning(f"Moving {moved.rowcount} rows of {name} out of transaction_default")
+    await connection.execute(
+        text(
+            f'CREATE TABLE {name} PARTITION OF "transaction" '
+            f"FOR VALUES FROM ('{month}') TO ('{add_months(month, 1)}')"
+        )
+    )
+    if stranded:
+        await connection.execute(text('INSERT INTO "transaction" SELECT * FROM moved'))
+        await connection.execute(text("DROP TABLE moved"))
+
+
+async def archive_partitions(engine: AsyncEngine, retention_months: int, archive_dir: Path) -> list[str]:
+    """Archives and drops the partitions of months before the last ``retention_months``"""
+    oldest_kept = add_months(date.today().replace(day=1), -retention_months)
+    async with engine.connect() as connection:
+        expired = [name for name, month in await list_partitions(connection) if month < oldest_kept]
+    for name in expired:
+        rows = await archive_partition(engine, name, archive_dir / f"{name}.csv.gz")
+        _logger.info(f"Archived {rows} rows of {name}")
+    return expired
+
+
+async def archive_partition(engine: AsyncEngine, name: str, path: Path) -> int:
+    """Streams the partition to a gzipped CSV file, then detaches and drops it. Returns the number of rows"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    partial = path.with_name(path.name + ".partial")
+    async with engine.connect() as connection:
+        raw = (await connection.get_raw_connection()).driver_connection
+        with open(partial, "wb") as file:
+            with gzip.GzipFile(fileobj=file, mode="wb") as compressed:
+
+                async def write(chunk: bytes):
+                    await asyncio.to_thread(compressed.write, chunk)
+
+                status = await raw.copy_from_table(name, output=write, format="csv", header=True)
+            file.flush()
+            os.fsync(file.fileno())
+    # The partition is only dropped once its file is complete
+    partial.rename(path)
+    async with engine.begin() as connection:
+        await connection.execute(text(f'ALTER TABLE "transaction" DETACH PARTITION {name}'))
+        await connection.execute(text(f"DROP TABLE {name}"))
+    return int(status.split()[-1])
+
+
+async def list_partitions(connection: AsyncConnection) -> list[tuple[str, date]]:
+    """Monthly partitions of ``transaction`` with their month, oldest first"""
+    names = await connection.scalars(
+        text(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE pg_inherits.inhparent = '\"transaction\"'::regclass"
+        )
+    )
+    partitions = []
+    for name in names:
+        match = _PARTITION_NAME.match(name)
+        if match:
+            partitions.append((name, date(int(match[1]), int(match[2]), 1)))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+def database_engines(engine: AsyncEngine, router: ShardRouter = None) -> list[tuple[str, AsyncEngine]]:
+    """Engines owning a ``transaction`` table: every shard, or the database, with the archive subdirectory of each"""
+    if router is None:
+        return [("", engine)]
+    return [(f"shard_{shard_id}", router.engine(shard_id)) for shard_id in router.shard_ids]
+
+
+async def _run(args: argparse.Namespace):
+    from .config import Settings
+    from .container import Container
+
+    settings = Settings()
+    container = Container()
+    container.config.from_pydantic(settings)
+    try:
+        for directory, engine in database_engines(container.engine(), container.shard_router()):
+            if args.command == "create":
+                created = await create_partitions(engine, settings.transaction_partitions_ahead)
+                print(f"Created partitions {created}")
+            else:
+                archive_dir = Path(settings.transaction_archive_dir) / directory
+                archived = await archive_partitions(engine, settings.transaction_retention_months, archive_dir)
+                print(f"Archived partitions {archived} to {archive_dir}")
+    finally:
+        if container.shard_router() is not None:
+            await container.shard_router().dispose()
+        await container.engine().dispose()
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Maintain the monthly partitions of the transaction table")
+    parser.add_argument("command", choices=["create", "archive"])
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_run(parser.parse_args(argv)))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
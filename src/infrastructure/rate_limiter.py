@@ -0,0 +1,83 @@
+import logging
+import time
+from collections import OrderedDict
+
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from src.interfaces.rate_limiter import RateLimit, RateLimiter, RateLimitResult
+from .metrics import metrics
+
+_logger = logging.getLogger(__name__)
+
+# GCRA: the key holds the theoretical arrival time (TAT) of the next request in milliseconds. A request is allowed
+# unless it comes more than ``limit - 1`` emission intervals ahead of the TAT, and then pushes the TAT by one
+# interval. Rejected requests leave the key untouched.
+_GCRA_SCRIPT = """
+local emission = tonumber(ARGV[1])
+local limit = tonumber(ARGV[2])
+local time = redis.call("TIME")
+local now = tonumber(time[1]) * 1000 + tonumber(time[2]) / 1000
+local tat = math.max(tonumber(redis.call("GET", KEYS[1]) or now), now)
+local allow_at = tat + emission - emission * limit
+if now < allow_at then
+    return {0, 0, tostring(tat - now), tostring(allow_at - now)}
+end
+tat = tat + emission
+redis.call("SET", KEYS[1], tostring(tat), "PX", math.ceil(tat - now))
+return {1, math.floor((now - allow_at) / emission), tostring(tat - now), "0"}
+"""
+
+
+class RedisRateLimiter(RateLimiter):
+    """GCRA limiter shared by all workers: one atomic script call per request.
+
+    Since a rejected request doesn't change the limiter's state, a key stays rejected until its ``retry_after``.
+    The limiter remembers that locally, so a client hammering a limit doesn't cost a Redis round-trip per request.
+    While Redis is unavailable it fails open: requests are only limited by the keys it already rejected.
+    """
+
+    def __init__(self, redis: Redis, local_max_size: int = 10000):
+        self._script = redis.register_script(_GCRA_SCRIPT)
+        self.local_max_size = local_max_size
+        self._rejected_until: OrderedDict[str, float] = OrderedDict()
+
+    async def hit(self, key: str, rate: RateLimit, options: dict = None) -> RateLimitResult:
+        rejected = self._rejected_locally(key, rate)
+        if rejected is not None:
+            return rejected
+
+        emission = rate.period * 1000 / rate.limit
+        try:
+            allowed, remaining, reset_after, retry_after = await self._script(keys=[key], args=[emission, rate.limit])
+        except RedisError as e:
+            _logger.warning(f"Failed to check the rate limit of {key}, allowing the request: {e}")
+            metrics.inc("rate_limit_failures_total")
+            return RateLimitResult(True, rate.limit, rate.limit - 1, 0.0, 0.0)
+        result = RateLimitResult(
+            allowed=bool(allowed),
+            limit=rate.limit,
+            remaining=int(remaining),
+            reset_after=float(reset_after) / 1000,
+            retry_after=float(retry_after) / 1000,
+        )
+        if not result.allowed:
+            self._reject_until(key, time.monotonic() + result.retry_after)
+        return result
+
+    def _rejected_locally(self, key: str, rate: RateLimit) -> RateLimitResult | None:
+        until = self._rejected_until.get(key)
+        if until is None:
+            return None
+        retry_after = until - time.monotonic()
+        if retry_after <= 0:
+            del self._rejected_until[key]
+            return None
+        reset_after = retry_after + rate.period * (rate.limit - 1) / rate.limit
+        return RateLimitResult(False, rate.limit, 0, reset_after, retry_after)
+
+    def _reject_until(self, key: str, until: float) -> None:
+        self._rejected_until[key] = until
+        self._rejected_until.move_to_end(key)
+        while len(self._rejected_until) > self.local_max_size:
+            self._rejected_until.popitem(last=False)
@@ -0,0 +1,173 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable
+
+from sqlalchemy.ext.asyncio import async_scoped_session
+
+from src.application.single_flight import SingleFlight
+from src.interfaces.cache import Cache
+from src.interfaces.read_through import ReadThrough
+from .db.db_adapter import session_scope
+from .metrics import Metrics, metrics as default_metrics
+
+_logger = logging.getLogger(__name__)
+
+
+class CacheReadThrough(ReadThrough):
+    """Read-through caching with stampede protection on top of any ``Cache``.
+
+    Values are stored with their soft expiry (``"{soft_expires_at}|{value}"``, or the ``marker`` field of a hash)
+    under a longer hard TTL. Misses are coalesced per worker by ``SingleFlight`` and across workers by a
+    ``lock:{key}`` reservation (SET NX), so only one loader hits the database while the others poll for its result.
+    Past the soft expiry the stale value is served while a single background task reloads it.
+    """
+
+    def __init__(
+        self,
+        cache: Cache,
+        single_flight: SingleFlight,
+        session: async_scoped_session = None,
+        metrics: Metrics = None,
+        lock_ttl: int = 10,
+        wait_timeout: float = 2.0,
+        poll_interval: float = 0.01,
+        max_poll_interval: float = 0.2,
+    ):
+        self.cache = cache
+        self.single_flight = single_flight
+        self.session = session
+        self.metrics = metrics or default_metrics
+        self.lock_ttl = lock_ttl
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self._refreshes: dict[str, asyncio.Task] = {}
+
+    async def get(self, key: str, load: Callable[[], Awaitable[str]], options: dict = None) -> str:
+        options = options or {}
+
+        async def read():
+            return _unwrap(await self.cache.get(key))
+
+        async def store():
+            value = await load()
+            await self.cache.set(key, f"{_soft_expiry(options)}|{value}", {"ttl": options.get("ttl")})
+            return value
+
+        if options.get("refresh", False):
+            return await store()
+        cached = await read()
+        if cached is not None:
+            soft_expires_at, value = cached
+            self._record(key, soft_expires_at, store)
+            return value
+        self.metrics.inc("cache_misses_total", {"cache": _name(key)})
+        return await self.single_flight.do(key, lambda: self._load(key, read, store))
+
+    async def hgetall(
+        self, key: str, load: Callable[[], Awaitable[dict[str, str]]], options: dict = None
+    ) -> dict[str, str]:
+        options = options or {}
+        marker = options["marker"]
+
+        async def read():
+            cached = await self.cache.hgetall(key)
+            if marker not in cached:
+                return None
+            return _soft_expires_at(cached[marker]), cached
+
+        async def store():
+            write_options = {"ttl": options.get("ttl"), "replace": True}
+            if (version_key := options.get("version_key")) is not None:
+                # A write patching the hash after the load read the database bumps the version, and the snapshot
+                # that would wipe its patch out isn't stored
+                (version,) = await self.cache.mget([version_key])
+                write_options["if_unchanged"] = (version_key, version)
+            mapping = await load()
+            mapping[marker] = str(_soft_expiry(options))
+            await self.cache.hset(key, mapping, write_options)
+            return mapping
+
+        if options.get("refresh", False):
+            return await store()
+        cached = await read()
+        if cached is not None:
+            soft_expires_at, mapping = cached
+            self._record(key, soft_expires_at, store)
+            return mapping
+        self.metrics.inc("cache_misses_total", {"cache": _name(key)})
+        return await self.single_flight.do(key, lambda: self._load(key, read, store))
+
+    def _record(self, key: str, soft_expires_at: float, store: Callable[[], Awaitable]) -> None:
+        if soft_expires_at > time.time():
+            self.metrics.inc("cache_hits_total", {"cache": _name(key)})
+            return
+        self.metrics.inc("cache_stale_total", {"cache": _name(key)})
+        if key not in self._refreshes:
+            task = asyncio.create_task(self._refresh(key, store))
+            self._refreshes[key] = task
+            task.add_done_callback(lambda _: self._refreshes.pop(key, None))
+
+    async def _load(self, key: str, read: Callable[[], Awaitable], store: Callable[[], Awaitable]):
+        lock = f"lock:{key}"
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.wait_timeout
+        delay = self.poll_interval
+        while not await self.cache.add(lock, "1", {"ttl": self.lock_ttl}):
+            if loop.time() >= deadline:
+                # The lock holder is too slow or gone: load without it rather than fail the read
+                return await store()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_poll_interval)
+            cached = await read()
+            if cached is not None:
+                return cached[1]
+        try:
+            # Another worker may have stored the value and released the lock between our read and reservation
+            cached = await read()
+            if cached is not None and cached[0] > time.time():
+                return cached[1]
+            return await store()
+        finally:
+            await self.cache.delete(lock)
+
+    async def _refresh(self, key: str, store: Callable[[], Awaitable]) -> None:
+        lock = f"lock:{key}"
+        if not await self.cache.add(lock, "1", {"ttl": self.lock_ttl}):
+            return
+        try:
+            if self.session is None:
+                await store()
+            else:
+                # The request that noticed the stale value may finish first, so reload on a session of our own
+                async with session_scope(self.session):
+                    await store()
+        except Exception as e:
+            _logger.warning(f"Failed to refresh {key}: {e}")
+        finally:
+            await self.cache.delete(lock)
+
+
+def _soft_expiry(options: dict) -> float:
+    return time.time() + options.get("soft_ttl", options.get("ttl") or 0)
+
+
+def _soft_expires_at(value: str) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        return 0.0
+
+
+def _unwrap(cached: str | None) -> tuple[float, str] | None:
+    if cached is None:
+        return None
+    soft_expires_at, separator, value = cached.partition("|")
+    if not separator:
+        return None
+    return _soft_expires_at(soft_expires_at), value
+
+
+def _name(key: str) -> str:
+    return key.split(":", 1)[0]
@@ -0,0 +1,156 @@
+"""Moves user buckets between shards and replicates products to every shard.
+
+A bucket is moved in two steps while its users' writes are paused:
+
+    python -m src.infrastructure.reshard move --bucket 17 --to 2
+    # add {"17": 2} to SHARD_BUCKET_MAP and restart the API and workers
+    python -m src.infrastructure.reshard cleanup --bucket 17 --from 0
+
+``move`` copies the bucket's users, inventories and transactions to the target and rebuilds the target's purchase
+rollup for their days; it refuses a target that already holds users of the bucket. ``cleanup`` deletes the copies
+left on the old shard once it no longer serves the bucket. Products are written to shard 0 and copied with
+
+    python -m src.infrastructure.reshard sync-products
+"""
+import argparse
+import asyncio
+from datetime import timedelta
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from .db.orm import inventory_table, product_table, transaction_table, user_table
+from .db.queries import get_queries
+from .db.shards import ShardingError, ShardRouter
+
+COPY_BATCH_SIZE = 1000
+
+# Parents first; ids of the child rows are assigned by the target, whose sequences the copied ids would collide with
+_USER_TABLES = (
+    (user_table, user_table.c.id, True),
+    (inventory_table, inventory_table.c.user_id, False),
+    (transaction_table, transaction_table.c.user_id, False),
+)
+
+
+async def move_bucket(router: ShardRouter, bucket: int, target: str) -> dict[str, int]:
+    """Copies the users of ``bucket`` from the shard serving it to ``target``. Returns the copied rows per table"""
+    source = router.shard_for_bucket(bucket)
+    if source == target:
+        raise ShardingError(f"Bucket {bucket} is already on shard {target}")
+    copied = {}
+    async with router.engine(source).connect() as src, router.engine(target).begin() as dst:
+        present = await dst.scalar(select(func.count()).where(_in_bucket(router, user_table.c.id, bucket)))
+        if present:
+            raise ShardingError(f"Shard {target} already has {present} users of bucket {bucket}")
+        for table, user_column, keep_id in _USER_TABLES:
+            columns = [column for column in table.c if keep_id or column.name != "id"]
+            copied[table.name] = 0
+            result = await src.stream(select(*columns).where(_in_bucket(router, user_column, bucket)))
+            async for rows in result.mappings().partitions(COPY_BATCH_SIZE):
+                await dst.execute(insert(table), [dict(row) for row in rows])
+                copied[table.name] += len(rows)
+        days = await _transaction_days(src, router, bucket)
+        if days is not None:
+            await _rebuild_rollup(dst, *days)
+    return copied
+
+
+async def cleanup_bucket(router: ShardRouter, bucket: int, source: str) -> dict[str, int]:
+    """Deletes the users of ``bucket`` from ``source`` after it was moved away. Returns the deleted rows per table"""
+    if router.shard_for_bucket(bucket) == source:
+        raise ShardingError(f"Shard {source} still serves bucket {bucket}")
+    deleted = {}
+    async with router.engine(source).begin() as connection:
+        days = await _transaction_days(connection, router, bucket)
+        for table, user_column, _ in reversed(_USER_TABLES):
+            result = await connection.execute(delete(table).where(_in_bucket(router, user_column, bucket)))
+            deleted[table.name] = result.rowcount
+        if days is not None:
+            await _rebuild_rollup(connection, *days)
+    return deleted
+
+
+async def sync_products(router: ShardRouter, source: str = "0") -> int:
+    """Upserts every product of ``source`` into the other shards. Returns the number of products"""
+    async with router.engine(source).connect() as connection:
+        products = [dict(row) for row in (await connection.execute(select(product_table))).mappings()]
+    if not products:
+        return 0
+    upsert = pg_insert(product_table)
+    upsert = upsert.on_conflict_do_update(
+        index_elements=[product_table.c.id],
+        set_={column.name: upsert.excluded[column.name] for column in product_table.c if not column.primary_key},
+    )
+    for shard_id in router.shard_ids:
+        if shard_id == source:
+            continue
+        async with router.engine(shard_id).begin() as connection:
+            for start in range(0, len(products), COPY_BATCH_SIZE):
+                await connection.execute(upsert, products[start:start + COPY_BATCH_SIZE])
+    return len(products)
+
+
+def _in_bucket(router: ShardRouter, user_column, bucket: int):
+    return user_column % router.buckets == bucket
+
+
+async def _transaction_days(connection: AsyncConnection, router: ShardRouter, bucket: int):
+    """First and last day with transactions of the bucket's users, or None"""
+    day = func.date(transaction_table.c.created_at)
+    first, last = (
+        await connection.execute(
+            select(func.min(day), func.max(day)).where(_in_bucket(router, transaction_table.c.user_id, bucket))
+        )
+    ).one()
+    return None if first is None else (first, last)
+
+
+async def _rebuild_rollup(connection: AsyncConnection, first_day, last_day) -> None:
+    queries = get_queries()
+    params = {"start_date": first_day, "end_date": last_day + timedelta(days=1)}
+    await connection.execute(queries["prune_product_purchase_daily"].value, params)
+    await connection.execute(queries["backfill_product_purchase_daily"].value, params)
+
+
+async def _run(args: argparse.Namespace) -> int:
+    from .config import Settings
+    from .container import Container
+
+    container = Container()
+    container.config.from_pydantic(Settings())
+    router = container.shard_router()
+    if router is None:
+        print("SHARD_DATABASE_URLS isn't configured")
+        return 1
+    try:
+        if args.command == "move":
+            rows = await move_bucket(router, args.bucket, args.to)
+            print(f"Copied {rows} to shard {args.to}; map bucket {args.bucket} to it, then clean up the old shard")
+        elif args.command == "cleanup":
+            rows = await cleanup_bucket(router, args.bucket, args.source)
+            print(f"Deleted {rows} from shard {args.source}")
+        else:
+            print(f"Copied {await sync_products(router)} products to every shard")
+    finally:
+        await router.dispose()
+    return 0
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Move user buckets between shards")
+    parser.add_argument("command", choices=["move", "cleanup", "sync-products"])
+    parser.add_argument("--bucket", type=int)
+    parser.add_argument("--to", help="Shard id the bucket is copied to")
+    parser.add_argument("--from", dest="source", help="Shard id the bucket was moved away from")
+    args = parser.parse_args(argv)
+    if args.command == "move" and (args.bucket is None or args.to is None):
+        parser.error("move requires --bucket and --to")
+    if args.command == "cleanup" and (args.bucket is None or args.source is None):
+        parser.error("cleanup requires --bucket and --from")
+    return asyncio.run(_run(args))
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,73 @@
+"""Backfill and consistency check for the ``product_purchase_daily`` rollup.
+
+    python -m src.infrastructure.rollups backfill --start-date 2025-01-01
+    python -m src.infrastructure.rollups check --start-date 2025-01-01
+"""
+import argparse
+import asyncio
+import logging
+from datetime import date, timedelta
+
+from .config import Settings
+from .container import Container
+from .db.db_adapter import session_scope
+
+_logger = logging.getLogger(__name__)
+
+BACKFILL_WINDOW = timedelta(days=31)
+
+
+async def backfill_purchase_rollup(container: Container, start_date: date, end_date: date) -> int:
+    """Rebuilds the rollup from ``transaction`` one window at a time, committing after each window"""
+    uow = await container.uow()
+    repository = container.product_repository()
+    rebuilt = 0
+    async with session_scope(container.session_factory()):
+        window_start = start_date
+        while window_start < end_date:
+            window_end = min(window_start + BACKFILL_WINDOW, end_date)
+            async with uow:
+                rebuilt += await repository.rebuild_purchase_rollup(window_start, window_end)
+            window_start = window_end
+    return rebuilt
+
+
+async def check_purchase_rollup(container: Container, start_date: date, end_date: date) -> list[dict]:
+    async with session_scope(container.session_factory()):
+        return await container.product_repository().find_purchase_rollup_mismatches(start_date, end_date)
+
+
+async def _run(args: argparse.Namespace):
+    container = Container()
+    container.config.from_pydantic(Settings())
+    await container.init_resources()
+    try:
+        if args.command == "backfill":
+            rebuilt = await backfill_purchase_rollup(container, args.start_date, args.end_date)
+            print(f"Rebuilt {rebuilt} rollup rows")
+        else:
+            mismatches = await check_purchase_rollup(container, args.start_date, args.end_date)
+            for row in mismatches:
+                print(f"{row['day']} product {row['product_id']}: expected {row['expected']}, got {row['actual']}")
+            print(f"Found {len(mismatches)} mismatching rollup rows")
+            return 1 if mismatches else 0
+    finally:
+        if container.shard_router() is not None:
+            await container.shard_router().dispose()
+        await container.engine().dispose()
+        await container.shutdown_resources()
+    return 0
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Maintain the product_purchase_daily rollup")
+    parser.add_argument("command", choices=["backfill", "check"])
+    parser.add_argument("--start-date", type=date.fromisoformat, required=True)
+    parser.add_argument(
+        "--end-date", type=date.fromisoformat, default=date.today() + timedelta(days=1), help="Exclusive"
+    )
+    return asyncio.run(_run(parser.parse_args(argv)))
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
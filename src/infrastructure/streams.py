@@ -0,0 +1,117 @@
+"""Consumer-group reader for Redis streams such as the transaction events feed.
+
+    python -m src.infrastructure.streams --group analytics --consumer analytics-1
+"""
+import argparse
+import asyncio
+import logging
+import socket
+from typing import Awaitable, Callable
+
+from redis.asyncio import Redis
+from redis.exceptions import ResponseError
+
+from src.application.events import EVENTS_STREAM
+
+_logger = logging.getLogger(__name__)
+
+Entries = list[tuple[str, dict[str, str]]]
+
+
+class StreamConsumer:
+    """Hands batches of ``stream`` entries to ``handler`` as ``consumer`` of ``group``.
+
+    Entries are acknowledged once the handler returns, so a failed batch stays pending and is delivered again.
+    Entries left pending by a consumer that died for longer than ``claim_idle_ms`` are claimed before reading new
+    ones. Delivery is at least once: handlers should deduplicate by the event ``id``.
+    """
+
+    def __init__(
+        self,
+        redis: Redis,
+        group: str,
+        consumer: str,
+        handler: Callable[[Entries], Awaitable[None]],
+        stream: str = EVENTS_STREAM,
+        batch_size: int = 100,
+        block_ms: int = 5000,
+        claim_idle_ms: int = 60000,
+    ):
+        self.redis = redis
+        self.group = group
+        self.consumer = consumer
+        self.handler = handler
+        self.stream = stream
+        self.batch_size = batch_size
+        self.block_ms = block_ms
+        self.claim_idle_ms = claim_idle_ms
+
+    async def ensure_group(self) -> None:
+        """Creates the group at the start of the stream unless it exists"""
+        try:
+            await self.redis.xgroup_create(self.stream, self.group, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def consume(self) -> int:
+        """Processes one batch. Returns the number of entries acknowledged"""
+        _, entries, *_ = await self.redis.xautoclaim(
+            self.stream, self.group, self.consumer, self.claim_idle_ms, "0-0", count=self.batch_size
+        )
+        if not entries:
+            response = await self.redis.xreadgroup(
+                self.group, self.consumer, {self.stream: ">"}, count=self.batch_size, block=self.block_ms
+            )
+            entries = response[0][1] if response else []
+        if not entries:
+            return 0
+        # Entries trimmed away while pending come back without fields
+        await self.handler([(entry_id, fields) for entry_id, fields in entries if fields])
+        await self.redis.xack(self.stream, self.group, *[entry_id for entry_id, _ in entries])
+        return len(entries)
+
+    async def run(self) -> None:
+        """Consumes until cancelled"""
+        await self.ensure_group()
+        while True:
+            try:
+                await self.consume()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                _logger.warning(f"Failed to consume {self.stream} as {self.group}/{self.consumer}: {e}")
+                await asyncio.sleep(1)
+
+
+async def _log_entries(entries: Entries) -> None:
+    for entry_id, fields in entries:
+        _logger.info(f"{entry_id} {fields}")
+
+
+async def _run(args: argparse.Namespace):
+    from .config import Settings
+    from .container import Container
+
+    container = Container()
+    container.config.from_pydantic(Settings())
+    await container.init_resources()
+    try:
+        redis = await container.redis_pool()
+        await StreamConsumer(redis, args.group, args.consumer, _log_entries, stream=args.stream).run()
+    finally:
+        await container.shutdown_resources()
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Tail a Redis stream as a consumer group member")
+    parser.add_argument("--stream", default=EVENTS_STREAM)
+    parser.add_argument("--group", required=True)
+    parser.add_argument("--consumer", default=socket.gethostname())
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_run(parser.parse_args(argv)))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
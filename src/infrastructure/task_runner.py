@@ -0,0 +1,92 @@
+"""Runs the coroutines of Celery tasks on one event loop per worker process.
+
+The loop runs in a daemon thread and holds the container's resources (Redis pool, engine), which are bound to
+the loop that created them. Pool threads submit their task's coroutine to it and block until it finishes, so a task
+reports the coroutine's real outcome. With ``--pool=threads`` tasks run concurrently on the loop, at most
+``concurrency`` at a time.
+"""
+import asyncio
+import inspect
+import os
+import threading
+from concurrent.futures import Future
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Coroutine, TypeVar
+
+from celery import Task
+
+T = TypeVar("T")
+
+
+class AsyncioRunner:
+    def __init__(self, concurrency: int = 8, on_shutdown: Callable[[], Awaitable[Any]] = None):
+        self.concurrency = concurrency
+        self.on_shutdown = on_shutdown
+        self._lock = threading.Lock()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._thread: threading.Thread | None = None
+        self._semaphore: asyncio.Semaphore | None = None
+        self._pid: int | None = None
+
+    def run(self, coro: Coroutine[Any, Any, T]) -> T:
+        """Runs ``coro`` on the worker's loop and returns its result, or raises its exception"""
+        return self.submit(coro).result()
+
+    def submit(self, coro: Coroutine[Any, Any, T]) -> Future:
+        return asyncio.run_coroutine_threadsafe(self._bounded(coro), self._ensure_loop())
+
+    def shutdown(self) -> None:
+        """Runs ``on_shutdown`` on the loop, e.g. to release the container's resources, and stops it"""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            if loop is None or self._pid != os.getpid():
+                return
+            self._loop = self._thread = self._semaphore = None
+        if self.on_shutdown is not None:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+    async def _shutdown(self) -> None:
+        result = self.on_shutdown()
+        if inspect.isawaitable(result):
+            await result
+
+    async def _bounded(self, coro: Coroutine[Any, Any, T]) -> T:
+        async with self._semaphore:
+            return await coro
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            # A forked (prefork) child inherits the parent's loop object, but not its thread
+            if self._loop is None or self._pid != os.getpid():
+                self._loop = asyncio.new_event_loop()
+                self._semaphore = asyncio.Semaphore(self.concurrency)
+                self._thread = threading.Thread(target=self._loop.run_forever, name="asyncio-runner", daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+            return self._loop
+
+
+class AsyncioTask(Task):
+    """Task base whose ``run`` may return a coroutine, which is awaited on the app's ``runner`` before the task
+    completes"""
+
+    def __call__(self, *args, **kwargs):
+        result = super().__call__(*args, **kwargs)
+        if asyncio.iscoroutine(result):
+            return self.app.runner.run(self._in_request(self.request.id, result))
+        return result
+
+    def update_state(self, task_id: str = None, state: str = None, meta: dict = None, **kwargs):
+        # The task's request is thread-local, so on the loop's thread its id comes from the coroutine's context
+        super().update_state(task_id or self.request.id or _task_id.get(), state, meta, **kwargs)
+
+    @staticmethod
+    async def _in_request(task_id: str, coro: Coroutine[Any, Any, T]) -> T:
+        _task_id.set(task_id)
+        return await coro
+
+
+_task_id: ContextVar[str | None] = ContextVar("task_id", default=None)
@@ -1,42 +1,266 @@
-import asyncio
 import logging
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from pathlib import Path
 
 from aiostream import stream
 from celery import shared_task, states, Task
 from celery.exceptions import Ignore
 from dependency_injector.wiring import inject, Provide
 
+from sqlalchemy.ext.asyncio import AsyncEngine, async_scoped_session
+
 from .container import Container
-from ..interfaces.cache import Cache
+from .db.db_adapter import session_scope
+from .db.shards import ShardRouter
+from .outbox import OutboxRelay
+from .partitions import archive_partitions, create_partitions, database_engines
+from .task_runner import AsyncioTask
+from ..application.inventory_cache import INVENTORY_GENERATION_KEY, invalidate_inventories, inventory_key
+from ..application.repositories.idempotency import IdempotencyRepository
+from ..application.popularity import (
+    POPULAR_COUNTERS_RETENTION_DAYS,
+    POPULAR_PRODUCTS_WINDOW_DAYS,
+    popular_counters_ttl,
+    popular_key,
+)
+from ..application.repositories.product import ProductRepository
+from ..application.use_cases.show_popular_products import ShowPopularProducts
+from ..interfaces.cache import Cache, CacheOperation
+from ..interfaces.context import ReadContext
+from ..interfaces.uow import UnitOfWork
 
 
 _logger = logging.getLogger(__name__)
 
 
-@shared_task(bind=True)
+@shared_task(bind=True, base=AsyncioTask)
 def clear_inventory_cache_task(self):
-    from .celery import app
-
-    coro = clear_inventory_cache(self)
-    asyncio.run_coroutine_threadsafe(
-        coro=coro,
-        loop=app.loop,
-    )
+    return clear_inventory_cache(self)
 
 
 @inject
 async def clear_inventory_cache(task: Task, cache: Cache = Provide[Container.cache]):
     try:
-        pattern = "inventory:*"
+        generation = await invalidate_inventories(cache)
+        msg = f"Moved user inventories to cache generation {generation}"
+        _logger.info(msg)
+        task.update_state(state=states.SUCCESS, meta=msg)
+    except Exception as e:
+        task.update_state(state=states.FAILURE, meta="Failed to clear inventory cache")
+        _logger.warning(str(e))
+        raise Ignore()
+
+
+@shared_task(bind=True, base=AsyncioTask)
+def purge_inventory_cache_task(self):
+    return purge_inventory_cache(self)
+
+
+@inject
+async def purge_inventory_cache(task: Task, cache: Cache = Provide[Container.redis_cache]):
+    """Unlinks the hashes of previous generations, which otherwise expire on their own"""
+    try:
+        generation = await cache.get(INVENTORY_GENERATION_KEY) or "0"
+        items = 0
+        async for chunk in stream.chunks(cache.iter(inventory_key("*", "*"), {"count": 1000}), 1000):
+            # inventory:v{generation}[.{user generation}]:{user_id}
+            stale = [key for key in chunk if key.split(":")[1][1:].split(".")[0] != generation]
+            await cache.apply([CacheOperation(CacheOperation.Kind.DELETE, key) for key in stale])
+            items += len(stale)
+        msg = f"Unlinked {items} cached user inventories of previous generations"
+        _logger.info(msg)
+        task.update_state(state=states.SUCCESS, meta=msg)
+    except Exception as e:
+        task.update_state(state=states.FAILURE, meta="Failed to purge inventory cache")
+        _logger.warning(str(e))
+        raise Ignore()
+
+
+@shared_task(bind=True, base=AsyncioTask)
+def expire_idempotency_records_task(self):
+    return expire_idempotency_records(self)
+
+
+@inject
+async def expire_idempotency_records(
+    task: Task,
+    session: async_scoped_session = Provide[Container.session_factory],
+    uow: UnitOfWork = Provide[Container.uow],
+    repository: IdempotencyRepository = Provide[Container.idempotency_repository],
+    retention_hours: int = Provide[Container.config.idempotency_retention_hours],
+    batch_size: int = Provide[Container.config.idempotency_expiry_batch_size],
+):
+    try:
+        created_before = datetime.now() - timedelta(hours=retention_hours)
         items = 0
-        async for chunk in stream.chunks(cache.iter(pattern), 1000):
-            coros = [cache.delete(key) for key in chunk]
-            await asyncio.gather(*coros)
-            items += len(chunk)
-        msg = f"Deleted {items} cached user inventories"
+        async with session_scope(session):
+            while True:
+                # Small committed batches keep locks short and the table's indexes compact
+                async with uow:
+                    deleted = await repository.delete_expired(created_before, batch_size)
+                items += deleted
+                if deleted < batch_size:
+                    break
+        msg = f"Deleted {items} expired idempotency records"
+        _logger.info(msg)
+        task.update_state(state=states.SUCCESS, meta=msg)
+    except Exception as e:
+        task.update_state(state=states.FAILURE, meta="Failed to delete expired idempotency records")
+        _logger.warning(str(e))
+        raise Ignore()
+
+
+@shared_task(bind=True, base=AsyncioTask)
+def create_transaction_partitions_task(self):
+    return create_transaction_partitions(self)
+
+
+@inject
+async def create_transaction_partitions(
+    task: Task,
+    engine: AsyncEngine = Provide[Container.engine],
+    router: ShardRouter = Provide[Container.shard_router],
+    months_ahead: int = Provide[Container.config.transaction_partitions_ahead],
+):
+    try:
+        created = []
+        for _, database in database_engines(engine, router):
+            created += await create_partitions(database, months_ahead)
+        msg = f"Created {len(created)} transaction partitions"
+        _logger.info(msg)
+        task.update_state(state=states.SUCCESS, meta=msg)
+    except Exception as e:
+        task.update_state(state=states.FAILURE, meta="Failed to create transaction partitions")
+        _logger.warning(str(e))
+        raise Ignore()
+
+
+@shared_task(bind=True, base=AsyncioTask)
+def archive_transaction_partitions_task(self):
+    return archive_transaction_partitions(self)
+
+
+@inject
+async def archive_transaction_partitions(
+    task: Task,
+    engine: AsyncEngine = Provide[Container.engine],
+    router: ShardRouter = Provide[Container.shard_router],
+    retention_months: int = Provide[Container.config.transaction_retention_months],
+    archive_dir: str = Provide[Container.config.transaction_archive_dir],
+):
+    try:
+        archived = []
+        for directory, database in database_engines(engine, router):
+            archived += await archive_partitions(database, retention_months, Path(archive_dir) / directory)
+        msg = f"Archived {len(archived)} transaction partitions"
+        _logger.info(msg)
+        task.update_state(state=states.SUCCESS, meta=msg)
+    except Exception as e:
+        task.update_state(state=states.FAILURE, meta="Failed to archive transaction partitions")
+        _logger.warning(str(e))
+        raise Ignore()
+
+
+@shared_task(bind=True, base=AsyncioTask)
+def check_purchase_rollup_task(self):
+    return check_purchase_rollup(self)
+
+
+@inject
+async def check_purchase_rollup(
+    task: Task,
+    session: async_scoped_session = Provide[Container.session_factory],
+    repository: ProductRepository = Provide[Container.product_repository],
+):
+    try:
+        start_date = date.today() - timedelta(days=2)
+        async with session_scope(session):
+            mismatches = await repository.find_purchase_rollup_mismatches(start_date, date.today() + timedelta(days=1))
+        for row in mismatches:
+            _logger.warning(
+                f"Purchase rollup mismatch on {row['day']} for product {row['product_id']}: "
+                f"expected {row['expected']}, got {row['actual']}"
+            )
+        msg = f"Found {len(mismatches)} mismatching purchase rollup rows since {start_date}"
+        _logger.info(msg)
+        task.update_state(state=states.SUCCESS, meta=msg)
+    except Exception as e:
+        task.update_state(state=states.FAILURE, meta="Failed to check purchase rollup")
+        _logger.warning(str(e))
+        raise Ignore()
+
+
+@shared_task(bind=True, base=AsyncioTask)
+def rebuild_popular_counters_task(self):
+    return rebuild_popular_counters(self)
+
+
+@inject
+async def rebuild_popular_counters(
+    task: Task,
+    session: async_scoped_session = Provide[Container.session_factory],
+    repository: ProductRepository = Provide[Container.product_repository],
+    cache: Cache = Provide[Container.cache],
+):
+    try:
+        today = date.today()
+        start_date = today - timedelta(days=POPULAR_COUNTERS_RETENTION_DAYS - 1)
+        # Only closed days: replacing today's set would lose the purchases counted while the rollup was read
+        async with session_scope(session):
+            purchases = await repository.find_daily_purchases(start_date, today)
+        counters = defaultdict(dict)
+        for row in purchases:
+            counters[row["day"]][str(row["product_id"])] = row["purchase_count"]
+        for n in range(POPULAR_COUNTERS_RETENTION_DAYS - 1):
+            day = start_date + timedelta(days=n)
+            await cache.zadd(popular_key(day), counters[day], {"replace": True, "ttl": popular_counters_ttl(day)})
+        msg = f"Rebuilt popularity counters for {POPULAR_COUNTERS_RETENTION_DAYS - 1} days since {start_date}"
+        _logger.info(msg)
+        task.update_state(state=states.SUCCESS, meta=msg)
+    except Exception as e:
+        task.update_state(state=states.FAILURE, meta="Failed to rebuild popularity counters")
+        _logger.warning(str(e))
+        raise Ignore()
+
+
+@shared_task(bind=True, base=AsyncioTask)
+def warm_popular_products_task(self):
+    return warm_popular_products(self)
+
+
+@inject
+async def warm_popular_products(
+    task: Task,
+    session: async_scoped_session = Provide[Container.session_factory],
+    ctx: ReadContext = Provide[Container.read_context],
+):
+    try:
+        start_date = date.today() - timedelta(days=POPULAR_PRODUCTS_WINDOW_DAYS)
+        async with session_scope(session):
+            products = await ShowPopularProducts(ctx).refresh(start_date)
+        msg = f"Cached {len(products)} popular products since {start_date}"
+        _logger.info(msg)
+        task.update_state(state=states.SUCCESS, meta=msg)
+    except Exception as e:
+        task.update_state(state=states.FAILURE, meta="Failed to warm popular products")
+        _logger.warning(str(e))
+        raise Ignore()
+
+
+@shared_task(bind=True, base=AsyncioTask)
+def relay_outbox_task(self):
+    return relay_outbox(self)
+
+
+@inject
+async def relay_outbox(task: Task, relay: OutboxRelay = Provide[Container.outbox_relay]):
+    try:
+        relayed = await relay.drain()
+        msg = f"Relayed {relayed} outbox messages"
         _logger.info(msg)
         task.update_state(state=states.SUCCESS, meta=msg)
     except Exception as e:
-        task.update_state(state=states.FAILURE, meta="Failed to delete inventory cache")
+        task.update_state(state=states.FAILURE, meta="Failed to relay outbox messages")
         _logger.warning(str(e))
         raise Ignore()
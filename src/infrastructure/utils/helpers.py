@@ -7,8 +7,10 @@ def generate_jwt(data: dict, secret_key: str) -> str:
     return encode(data, secret_key, algorithm="HS256")
 
 
-def generate_hash(string: str) -> str:
-    return hashlib.sha256(string.encode("utf-8")).hexdigest()
+def generate_hash(data: str | bytes) -> str:
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
 
 
 def cast_dict_types(data: dict | list[dict]) -> dict | list[dict]:
@@ -1,4 +1,26 @@
 from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from enum import Enum
+
+
+@dataclass(frozen=True)
+class CacheOperation:
+    """A deferred write, applied as ``getattr(cache, kind)(key, *args, options)``"""
+
+    class Kind(Enum):
+        SET = "set"
+        DELETE = "delete"
+        HSET = "hset"
+        HDEL = "hdel"
+        ZINCRBY = "zincrby"
+        INCR = "incr"
+        PUBLISH = "publish"
+        XADD = "xadd"
+
+    kind: Kind
+    key: str
+    args: tuple = ()
+    options: dict | None = None
 
 
 class Cache(ABC):
@@ -8,8 +30,61 @@ class Cache(ABC):
     @abstractmethod
     async def set(self, key: str, value: str, options: dict = None) -> None: ...
 
+    @abstractmethod
+    async def mget(self, keys: list[str], options: dict = None) -> list[str | None]: ...
+
+    @abstractmethod
+    async def add(self, key: str, value: str, options: dict = None) -> bool:
+        """Sets ``key`` only if it doesn't exist yet. Returns whether the value was stored"""
+
     @abstractmethod
     async def delete(self, key: str, options: dict = None) -> None: ...
 
     @abstractmethod
     async def iter(self, pattern: str, options: dict = None): ...
+
+    @abstractmethod
+    async def hgetall(self, key: str, options: dict = None) -> dict[str, str]: ...
+
+    @abstractmethod
+    async def hset(self, key: str, mapping: dict[str, str], options: dict = None) -> None:
+        """Merges ``mapping`` into the hash, or replaces the hash with the ``replace`` option. With ``if_unchanged``,
+        a ``(key, value)`` pair, the write only happens while that key still holds the value"""
+
+    @abstractmethod
+    async def hdel(self, key: str, fields: list[str], options: dict = None) -> None: ...
+
+    @abstractmethod
+    async def zincrby(self, key: str, member: str, amount: float, options: dict = None) -> None: ...
+
+    @abstractmethod
+    async def zadd(self, key: str, mapping: dict[str, float], options: dict = None) -> None: ...
+
+    @abstractmethod
+    async def zunionstore(self, destination: str, keys: list[str], options: dict = None) -> None: ...
+
+    @abstractmethod
+    async def zrange(self, key: str, start: int, end: int, options: dict = None) -> list[tuple[str, float]]: ...
+
+    @abstractmethod
+    async def incr(self, key: str, amount: int = 1, options: dict = None) -> int: ...
+
+    @abstractmethod
+    async def publish(self, channel: str, message: str, options: dict = None) -> None: ...
+
+    @abstractmethod
+    async def xadd(self, stream: str, fields: dict[str, str], options: dict = None) -> str:
+        """Appends an entry to ``stream``, approximately trimmed to ``maxlen`` entries. Returns the entry id"""
+
+    @abstractmethod
+    async def xrange(
+        self, stream: str, start: str = "-", end: str = "+", options: dict = None
+    ) -> list[tuple[str, dict[str, str]]]:
+        """Entries with ids between ``start`` and ``end``, a ``(`` prefix making a bound exclusive. Options are
+        ``count`` and ``reverse``, which returns the newest entries first"""
+
+    async def apply(self, operations: list[CacheOperation], options: dict = None) -> None:
+        """Applies the operations in order. Backends override it to send them in a single round-trip, as one atomic
+        transaction with the ``transaction`` option"""
+        for operation in operations:
+            await getattr(self, operation.kind.value)(operation.key, *operation.args, operation.options)
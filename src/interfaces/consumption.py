@@ -0,0 +1,8 @@
+from abc import ABC, abstractmethod
+
+
+class ConsumptionCounter(ABC):
+    @abstractmethod
+    async def consume(self, user_id: int, product_id: int, quantity: int, event: dict[str, str]) -> int | None:
+        """Takes ``quantity`` off the user's item unless that would make it negative, and appends ``event`` with the
+        ``remaining`` quantity if it did. Returns the quantity before, or None if the user doesn't own the item"""
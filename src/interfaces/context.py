@@ -1,10 +1,15 @@
 from dataclasses import dataclass
 
+from src.application.catalog import ProductCatalog
 from src.application.repositories.inventory import InventoryRepository
 from src.application.repositories.product import ProductRepository
 from src.application.repositories.user import UserRepository
+from src.interfaces.read_through import ReadThrough
 from src.interfaces.cache import Cache
+from src.interfaces.consumption import ConsumptionCounter
 from src.interfaces.db_adapter import DbAdapter
+from src.interfaces.idempotency import Idempotency
+from src.interfaces.keyed_lock import KeyedLock
 from src.interfaces.uow import UnitOfWork
 
 
@@ -13,9 +18,14 @@ class WriteContext:
     db: DbAdapter
     uow: UnitOfWork
     cache: Cache
+    idempotency: Idempotency
     inventory_repo: InventoryRepository
     user_repo: UserRepository
     maximum_allowed: int
+    # Orders the writes of one user, None leaves them to the database's row locks
+    user_lock: KeyedLock = None
+    # Counts consumes in Redis and leaves the database to a flusher, None consumes in a transaction
+    consumption: ConsumptionCounter = None
 
 
 @dataclass
@@ -24,3 +34,8 @@ class ReadContext:
     cache: Cache
     product_repo: ProductRepository
     inventory_repo: InventoryRepository
+    # On the primary: snapshots cached for every reader mustn't lag behind the writes patching them
+    snapshot_inventory_repo: InventoryRepository
+    read_through: ReadThrough
+    catalog: ProductCatalog
+    popular_products_backend: str
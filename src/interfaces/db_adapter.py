@@ -18,3 +18,7 @@ class DbAdapter(ABC):
 
     @abstractmethod
     async def execute(self, query: Query, *args, **kwargs): ...
+
+    @abstractmethod
+    async def fetch_rows(self, query: Query, *args, **kwargs) -> list[tuple]:
+        """Rows of a column query as named tuples, without loading entities"""
@@ -1,31 +1,86 @@
-from datetime import datetime
 import enum
-from dataclasses import dataclass, asdict
+import types
+import typing
+from dataclasses import dataclass, fields
+from datetime import datetime
+from typing import Any, Callable
 
 
 @dataclass(kw_only=True)
 class DomainModel:
     id: int = None
 
-    def asdict(self):
-        def convert_value(obj):
-            if isinstance(obj, datetime):
-                return obj.isoformat()
-            elif isinstance(obj, enum.Enum):
-                return obj.value.lower()
-            elif isinstance(obj, DomainModel):
-                return obj.asdict()
-            elif isinstance(obj, dict):
-                return {k: convert_value(v) for k, v in obj.items()}
-            elif isinstance(obj, list):
-                return [convert_value(item) for item in obj]
-            elif isinstance(obj, type):
-                return str(obj)
-            elif hasattr(obj, "__dict__"):
-                return {k: convert_value(v) for k, v in obj.__dict__.items()}
-            return obj
-
-        result = {}
-        for key, value in asdict(self).items():
-            result[key] = convert_value(value)
-        return result
+    def asdict(self) -> dict:
+        """JSON-compatible dict of the model, using converters compiled once per class from its field types"""
+        converters = _converters.get(type(self))
+        if converters is None:
+            converters = _converters[type(self)] = _compile(type(self))
+        return {name: convert(getattr(self, name)) for name, convert in converters}
+
+
+_converters: dict[type, list[tuple[str, Callable[[Any], Any]]]] = {}
+_PRIMITIVES = (int, str, bool, float, type(None))
+
+
+def _compile(cls: type) -> list[tuple[str, Callable[[Any], Any]]]:
+    try:
+        hints = typing.get_type_hints(cls)
+    except (NameError, TypeError):
+        hints = {}
+    return [(field.name, _converter(hints.get(field.name))) for field in fields(cls)]
+
+
+def _converter(annotation) -> Callable[[Any], Any]:
+    if typing.get_origin(annotation) in (typing.Union, types.UnionType):
+        args = [arg for arg in typing.get_args(annotation) if arg is not type(None)]
+        annotation = args[0] if len(args) == 1 else None
+    if not isinstance(annotation, type):
+        return convert_value
+    if issubclass(annotation, _PRIMITIVES):
+        return _primitive
+    if issubclass(annotation, datetime):
+        return _datetime
+    if issubclass(annotation, enum.Enum):
+        return _enum
+    if issubclass(annotation, DomainModel):
+        return _model
+    return convert_value
+
+
+def _primitive(value):
+    return value if isinstance(value, _PRIMITIVES) else convert_value(value)
+
+
+def _datetime(value):
+    return value.isoformat() if isinstance(value, datetime) else convert_value(value)
+
+
+def _enum(value):
+    return _enum_value(value) if isinstance(value, enum.Enum) else convert_value(value)
+
+
+def _model(value):
+    return value.asdict() if isinstance(value, DomainModel) else convert_value(value)
+
+
+def _enum_value(value: enum.Enum):
+    return value.value.lower() if isinstance(value.value, str) else value.value
+
+
+def convert_value(obj):
+    """Generic conversion for values whose type isn't known from the field annotation"""
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    elif isinstance(obj, enum.Enum):
+        return _enum_value(obj)
+    elif isinstance(obj, DomainModel):
+        return obj.asdict()
+    elif isinstance(obj, dict):
+        return {k: convert_value(v) for k, v in obj.items()}
+    elif isinstance(obj, (list, tuple)):
+        return [convert_value(item) for item in obj]
+    elif isinstance(obj, type):
+        return str(obj)
+    elif hasattr(obj, "__dict__"):
+        return {k: convert_value(v) for k, v in obj.__dict__.items()}
+    return obj
@@ -0,0 +1,22 @@
+import inspect
+from abc import ABC, abstractmethod
+from functools import wraps
+from typing import Awaitable, Callable
+
+
+class Idempotency(ABC):
+    @abstractmethod
+    async def execute(self, key: str, operation: Callable[[], Awaitable[dict]]) -> dict:
+        """Runs ``operation`` once per ``key``; duplicates get the stored result of the first run"""
+
+
+def idempotent(func):
+    """Routes a use case call through ``ctx.idempotency``, keyed by its ``idempotency_hash`` argument"""
+    signature = inspect.signature(func)
+
+    @wraps(func)
+    async def wrapper(self, *args, **kwargs):
+        key = signature.bind(self, *args, **kwargs).arguments["idempotency_hash"]
+        return await self.ctx.idempotency.execute(key, lambda: func(self, *args, **kwargs))
+
+    return wrapper
@@ -0,0 +1,31 @@
+import inspect
+from abc import ABC, abstractmethod
+from functools import wraps
+from typing import AsyncContextManager
+
+
+class KeyedLock(ABC):
+    @abstractmethod
+    def hold(self, key: str) -> AsyncContextManager[None]:
+        """Runs the enclosed block after every earlier holder of ``key`` left theirs"""
+
+
+def serialized(argument: str):
+    """Runs a use case call under ``ctx.user_lock``, keyed by its ``argument`` argument. Without a lock in the
+    context the calls run unordered"""
+
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @wraps(func)
+        async def wrapper(self, *args, **kwargs):
+            lock = getattr(self.ctx, "user_lock", None)
+            if lock is None:
+                return await func(self, *args, **kwargs)
+            key = signature.bind(self, *args, **kwargs).arguments[argument]
+            async with lock.hold(str(key)):
+                return await func(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
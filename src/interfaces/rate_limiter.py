@@ -0,0 +1,32 @@
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+
+_PERIODS = {"second": 1, "minute": 60, "hour": 60 * 60, "day": 60 * 60 * 24}
+
+
+@dataclass(frozen=True)
+class RateLimit:
+    limit: int
+    period: float
+
+    @classmethod
+    def parse(cls, rate: str) -> "RateLimit":
+        """Parses ``"{limit}/{period}"`` limits such as ``"5/minute"``"""
+        limit, period = rate.split("/")
+        return cls(int(limit), _PERIODS[period.strip().rstrip("s")])
+
+
+@dataclass(frozen=True)
+class RateLimitResult:
+    allowed: bool
+    limit: int
+    remaining: int
+    # Seconds until the limit is fully replenished, and until the next request is allowed if this one wasn't
+    reset_after: float
+    retry_after: float
+
+
+class RateLimiter(ABC):
+    @abstractmethod
+    async def hit(self, key: str, rate: RateLimit, options: dict = None) -> RateLimitResult:
+        """Counts one request against ``key``, unless it is over ``rate``"""
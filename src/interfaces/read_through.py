@@ -0,0 +1,19 @@
+from abc import ABC, abstractmethod
+from typing import Awaitable, Callable
+
+
+class ReadThrough(ABC):
+    @abstractmethod
+    async def get(self, key: str, load: Callable[[], Awaitable[str]], options: dict = None) -> str:
+        """Returns the cached value of ``key``, loading and caching it with ``load`` on a miss.
+
+        Options: ``ttl`` (hard expiry), ``soft_ttl`` (age after which the value is reloaded in the background) and
+        ``refresh`` to reload unconditionally.
+        """
+
+    @abstractmethod
+    async def hgetall(
+        self, key: str, load: Callable[[], Awaitable[dict[str, str]]], options: dict = None
+    ) -> dict[str, str]:
+        """Same as ``get`` for a hash, which counts as cached only while it carries the ``marker`` field. Writers
+        patching the hash may bump a ``version_key``: a snapshot loaded meanwhile is returned but not stored"""
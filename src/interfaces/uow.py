@@ -1,14 +1,13 @@
 from abc import ABC, abstractmethod
-from typing import Callable
 
-from .cache import Cache
+from .cache import Cache, CacheOperation
 from .domain_model import DomainModel
 
 
 class UnitOfWork(ABC):
     def __init__(self, cache: Cache):
         self.cache = cache
-        self._cache_operations: list[Callable] = []
+        self._cache_operations: list[CacheOperation] = []
         self._depth = 0
 
     async def __aenter__(self):
@@ -39,10 +38,32 @@ class UnitOfWork(ABC):
     async def delete(self, objs: list[DomainModel]): ...
 
     def cache_set(self, key: str, value: str, options: dict = None):
-        self._cache_operations.append(lambda: self.cache.set(key, value, options))
+        self._queue(CacheOperation.Kind.SET, key, (value,), options)
 
     def cache_delete(self, key: str, options: dict = None):
-        self._cache_operations.append(lambda: self.cache.delete(key, options))
+        self._queue(CacheOperation.Kind.DELETE, key, (), options)
+
+    def cache_hset(self, key: str, mapping: dict[str, str], options: dict = None):
+        self._queue(CacheOperation.Kind.HSET, key, (mapping,), options)
+
+    def cache_hdel(self, key: str, fields: list[str], options: dict = None):
+        self._queue(CacheOperation.Kind.HDEL, key, (fields,), options)
+
+    def cache_zincrby(self, key: str, member: str, amount: float, options: dict = None):
+        self._queue(CacheOperation.Kind.ZINCRBY, key, (member, amount), options)
+
+    def cache_incr(self, key: str, amount: int = 1, options: dict = None):
+        self._queue(CacheOperation.Kind.INCR, key, (amount,), options)
+
+    def cache_publish(self, channel: str, message: str, options: dict = None):
+        self._queue(CacheOperation.Kind.PUBLISH, channel, (message,), options)
+
+    def cache_xadd(self, stream: str, fields: dict[str, str], options: dict = None):
+        self._queue(CacheOperation.Kind.XADD, stream, (fields,), options)
+
+    def _queue(self, kind: CacheOperation.Kind, key: str, args: tuple, options: dict | None):
+        """Cache writes are deferred until the transaction commits and dropped if it rolls back"""
+        self._cache_operations.append(CacheOperation(kind, key, args, options))
 
     @abstractmethod
     async def _create_savepoint(self): ...
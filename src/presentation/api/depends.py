@@ -1,11 +1,10 @@
+import secrets
 from typing import Annotated
 
 from dependency_injector.wiring import Provide
 from fastapi import Depends, status, Header, HTTPException
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import jwt
-from slowapi import Limiter
-from slowapi.util import get_remote_address
 from starlette.requests import Request
 from starlette.responses import JSONResponse
 
@@ -13,16 +12,19 @@ from src.infrastructure.config import Settings
 from src.infrastructure.container import Container
 from src.infrastructure.utils.helpers import generate_hash
 from src.interfaces.context import WriteContext, ReadContext
+from .rate_limit import Limiter
+from .token_cache import VerifiedTokenCache
 
 security = HTTPBearer(scheme_name="Bearer Token", description="JWT token for user authentication")
+metrics_security = HTTPBearer(scheme_name="Metrics Token", description="METRICS_TOKEN of the metrics scraper")
 settings = Settings()
+# Shared by authentication and the rate limit key, so a request verifies and hashes its token at most once
+token_cache = VerifiedTokenCache(settings.secret_key, max_size=settings.token_cache_max_size)
 
 
 def get_authenticated_user_id(credentials: HTTPAuthorizationCredentials = Depends(security)) -> int | JSONResponse:
     try:
-        payload = jwt.decode(credentials.credentials, settings.secret_key, algorithms=["HS256"])
-
-        return payload["id"]
+        return token_cache.verify(credentials.credentials).payload["id"]
     except jwt.InvalidTokenError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -30,6 +32,16 @@ def get_authenticated_user_id(credentials: HTTPAuthorizationCredentials = Depend
         )
 
 
+def verify_metrics_token(credentials: HTTPAuthorizationCredentials = Depends(metrics_security)) -> None:
+    if settings.metrics_token is None or not secrets.compare_digest(
+        credentials.credentials.encode(), settings.metrics_token.encode()
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Unauthorized",
+        )
+
+
 async def get_idempotency_deps(
     request: Request,
     idempotency_key: str = Header(
@@ -38,11 +50,7 @@ async def get_idempotency_deps(
     user_id: int = Depends(get_authenticated_user_id),
 ) -> dict:
     if idempotency_key:
-        try:
-            body = await request.json()
-        except Exception:
-            body = {}
-        key = f"{user_id}:{idempotency_key}:{str(body)}"
+        key = f"{user_id}:{idempotency_key}:".encode("utf-8") + await request.body()
         return {
             "user_id": user_id,
             "idempotency_hash": generate_hash(key),
@@ -55,9 +63,8 @@ async def get_idempotency_deps(
 def get_user_id_for_rate_limit(request: Request) -> str:
     auth_header = request.headers.get("authorization", False)
     if auth_header and auth_header.startswith("Bearer "):
-        token = auth_header.split(" ")[1]
-        return f"token:{generate_hash(token)}"
-    return get_remote_address(request)
+        return token_cache.rate_limit_key(auth_header.split(" ")[1])
+    return request.client.host if request.client else "127.0.0.1"
 
 
 AuthenticatedUserDep = Annotated[int, Depends(get_authenticated_user_id)]
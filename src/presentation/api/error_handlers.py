@@ -1,12 +1,12 @@
 from fastapi import HTTPException, FastAPI
 from pydantic import ValidationError as PydanticValidationError
-from slowapi.errors import RateLimitExceeded
 from starlette import status
 from starlette.requests import Request
 from starlette.responses import JSONResponse
 from fastapi.exceptions import RequestValidationError
 
-from src.application.errors import ValidationError, NotFound, AccessError
+from src.application.errors import ValidationError, NotFound, AccessError, Conflict
+from .rate_limit import RateLimitExceeded
 
 def unhandled_exception(details: list = None):
     content = {"error": "Internal server error"}
@@ -17,7 +17,8 @@ def unhandled_exception(details: list = None):
         content=content,
     )
 
-async def rate_limit_error_handler(request: Request, exc: ValidationError):
+async def rate_limit_error_handler(request: Request, exc: RateLimitExceeded):
+    # The X-RateLimit-* headers, Retry-After included, are added by RateLimitHeadersMiddleware
     return JSONResponse(
         status_code=status.HTTP_429_TOO_MANY_REQUESTS,
         content={"error": "Rate limit exceeded"},
@@ -45,6 +46,13 @@ async def access_error_error_handler(request: Request, exc: AccessError):
     )
 
 
+async def conflict_error_handler(request: Request, exc: Conflict):
+    return JSONResponse(
+        status_code=status.HTTP_409_CONFLICT,
+        content={"error": "Conflict", "details": [{"description": str(exc)}]},
+    )
+
+
 async def http_error_handler(request: Request, exc: HTTPException):
     content = {"error": "Uncaught error"}
     if exc.status_code == status.HTTP_401_UNAUTHORIZED:
@@ -92,6 +100,7 @@ def init_error_handlers(app: FastAPI):
     app.add_exception_handler(ValidationError, validation_error_handler)
     app.add_exception_handler(NotFound, not_found_error_handler)
     app.add_exception_handler(AccessError, access_error_error_handler)
+    app.add_exception_handler(Conflict, conflict_error_handler)
     app.add_exception_handler(HTTPException, http_error_handler)
     app.add_exception_handler(RequestValidationError, pydantic_req_validation_error_handler)
     app.add_exception_handler(PydanticValidationError, unhandled_exception_handler)
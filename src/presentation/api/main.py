@@ -1,17 +1,19 @@
-from contextlib import asynccontextmanager
+from contextlib import AsyncExitStack, asynccontextmanager
 
-from slowapi.middleware import SlowAPIMiddleware
 from starlette.responses import RedirectResponse
 
 from src.infrastructure.config import Settings
+from src.infrastructure.consumption import flushing
 from src.infrastructure.container import Container
 from src.infrastructure.db import orm
+from src.infrastructure.db.db_adapter import session_scope
 from src.presentation.api.app import Application
 
 from . import depends
-from .depends import limiter
 from .error_handlers import init_error_handlers
-from .routes import products, users, analytics
+from .middleware import ConsistencyTokenMiddleware, SessionScopeMiddleware
+from .rate_limit import RateLimitHeadersMiddleware
+from .routes import products, users, analytics, metrics
 from .schema.responses import COMMON_RESPONSES
 
 
@@ -21,7 +23,14 @@ async def lifespan(app: Application):
     engine = app.container.engine()
     if app.container.config.debug():
         await orm.create_tables(engine)
-    yield
+    catalog = await app.container.product_catalog()
+    async with session_scope(app.container.session_factory()):
+        await catalog.load()
+    async with AsyncExitStack() as stack:
+        if app.container.config.consumption_mode() == "write_behind":
+            flusher = await app.container.consumption_flusher()
+            await stack.enter_async_context(flushing(flusher, app.container.config.consumption_flush_interval_ms()))
+        yield
     await app.container.shutdown_resources()
 
 
@@ -29,6 +38,7 @@ def init_routers(app: Application):
     app.include_router(products.router)
     app.include_router(users.router)
     app.include_router(analytics.router)
+    app.include_router(metrics.router)
 
 
 def create_app() -> Application:
@@ -45,8 +55,9 @@ def create_app() -> Application:
     )
     init_error_handlers(app)
     init_routers(app)
-    app.add_middleware(SlowAPIMiddleware)
-    app.state.limiter = limiter
+    app.add_middleware(RateLimitHeadersMiddleware)
+    app.add_middleware(SessionScopeMiddleware, container=container)
+    app.add_middleware(ConsistencyTokenMiddleware)
 
     container.wire(modules=[products, users, analytics, depends])
 
@@ -0,0 +1,67 @@
+from starlette.requests import HTTPConnection
+from starlette.types import ASGIApp, Message, Scope, Receive, Send
+
+from src.infrastructure.container import Container
+from src.infrastructure.db.db_adapter import session_scope
+from src.infrastructure.db.replicas import ConsistencyToken, consistency_scope, format_lsn, parse_lsn
+
+CONSISTENCY_TOKEN_HEADER = "X-Consistency-Token"
+CONSISTENCY_TOKEN_COOKIE = "consistency_token"
+# Replicas lagging for longer are taken out of rotation anyway
+CONSISTENCY_TOKEN_MAX_AGE = 60
+
+
+class SessionScopeMiddleware:
+    """Gives every HTTP request its own database session, so concurrent requests use separate pool connections"""
+
+    def __init__(self, app: ASGIApp, container: Container):
+        self.app = app
+        self.container = container
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        async with session_scope(self.container.session_factory()):
+            await self.app(scope, receive, send)
+
+
+class ConsistencyTokenMiddleware:
+    """Read-your-writes across replicas: returns the position of a request's commits as a header and a cookie, and
+    makes the reads of requests presenting either wait for it"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        connection = HTTPConnection(scope)
+        presented = connection.headers.get(CONSISTENCY_TOKEN_HEADER) or connection.cookies.get(CONSISTENCY_TOKEN_COOKIE)
+        token = ConsistencyToken(min_lsn=_parse_token(presented))
+
+        async def send_with_token(message: Message):
+            if message["type"] == "http.response.start" and token.written_lsn is not None:
+                value = format_lsn(token.written_lsn)
+                cookie = (
+                    f"{CONSISTENCY_TOKEN_COOKIE}={value}; Max-Age={CONSISTENCY_TOKEN_MAX_AGE}; Path=/; HttpOnly; "
+                    "SameSite=Lax"
+                )
+                message["headers"] = list(message.get("headers", [])) + [
+                    (CONSISTENCY_TOKEN_HEADER.lower().encode(), value.encode()),
+                    (b"set-cookie", cookie.encode()),
+                ]
+            await send(message)
+
+        with consistency_scope(token):
+            await self.app(scope, receive, send_with_token)
+
+
+def _parse_token(value: str | None) -> int | None:
+    if not value:
+        return None
+    try:
+        return parse_lsn(value)
+    except ValueError:
+        return None
@@ -0,0 +1,79 @@
+import math
+from functools import wraps
+from typing import Callable
+
+from starlette.requests import Request
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from src.interfaces.rate_limiter import RateLimit, RateLimitResult
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, result: RateLimitResult):
+        super().__init__(f"Rate limit of {result.limit} exceeded")
+        self.result = result
+
+
+class Limiter:
+    """Per-route limits checked against the container's ``rate_limiter``, keyed by ``key_func`` of the request"""
+
+    def __init__(self, key_func: Callable[[Request], str], enabled: bool = True):
+        self.key_func = key_func
+        self.enabled = enabled
+
+    def limit(self, rate: str):
+        """Limits the decorated endpoint, which has to take a ``request: Request`` argument"""
+        parsed = RateLimit.parse(rate)
+
+        def decorator(func):
+            scope = func.__name__
+
+            @wraps(func)
+            async def wrapper(*args, request: Request, **kwargs):
+                if self.enabled:
+                    await self._check(request, scope, parsed)
+                return await func(*args, request=request, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    async def _check(self, request: Request, scope: str, rate: RateLimit) -> None:
+        rate_limiter = await request.app.container.rate_limiter()
+        result = await rate_limiter.hit(f"ratelimit:{scope}:{self.key_func(request)}", rate)
+        request.state.rate_limit = result
+        if not result.allowed:
+            raise RateLimitExceeded(result)
+
+
+def rate_limit_headers(result: RateLimitResult) -> dict[str, str]:
+    headers = {
+        "X-RateLimit-Limit": str(result.limit),
+        "X-RateLimit-Remaining": str(result.remaining),
+        "X-RateLimit-Reset": str(math.ceil(result.reset_after)),
+    }
+    if not result.allowed:
+        headers["Retry-After"] = str(math.ceil(result.retry_after))
+    return headers
+
+
+class RateLimitHeadersMiddleware:
+    """Adds the ``X-RateLimit-*`` headers of the request's rate limit check to its response"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_headers(message: Message):
+            result = scope.get("state", {}).get("rate_limit")
+            if message["type"] == "http.response.start" and result is not None:
+                message["headers"] = list(message.get("headers", [])) + [
+                    (name.lower().encode(), value.encode()) for name, value in rate_limit_headers(result).items()
+                ]
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
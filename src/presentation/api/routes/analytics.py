@@ -5,7 +5,8 @@ from fastapi import APIRouter, Query, Request
 
 from src.application.use_cases.show_popular_products import ShowPopularProducts
 from ..depends import ReadContextDep, limiter
-from ..schema.responses import PopularProductsResponse, PopularProduct
+from ..schema.responses import PopularProductsResponse
+from ..serialization import json_response
 
 router = APIRouter(prefix="/analytics", tags=["analytics"])
 
@@ -15,6 +16,7 @@ router = APIRouter(prefix="/analytics", tags=["analytics"])
     summary="Show most frequently bought products",
     description="Show most frequently bought products. Optionally filter by start date",
     response_description="List of popular products, ordered by purchase count",
+    response_model=PopularProductsResponse,
 )
 @limiter.limit("100/second")
 @inject
@@ -23,18 +25,8 @@ async def get_popular_products(
     ctx: ReadContextDep,
     limit: int = Query(default=5, description="Maximum number of products to return", ge=1, le=100),
     start_date: date = Query(default=None, description="Filter products purchased after this date"),
-) -> PopularProductsResponse:
+):
     usecase = ShowPopularProducts(ctx)
+    # Items already have the PopularProduct layout
     result = await usecase(limit, start_date)
-    return PopularProductsResponse(
-        products=[
-            PopularProduct(
-                product_id=item["product_id"],
-                name=item["name"],
-                price=item["price"],
-                type=item["type"],
-                purchase_count=item["purchase_count"],
-            )
-            for item in result
-        ]
-    )
+    return json_response({"products": result})
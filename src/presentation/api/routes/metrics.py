@@ -0,0 +1,17 @@
+from fastapi import APIRouter, Depends
+from starlette.responses import PlainTextResponse
+
+from src.infrastructure.metrics import metrics
+from ..depends import verify_metrics_token
+
+router = APIRouter(tags=["metrics"])
+
+
+@router.get(
+    "/metrics",
+    include_in_schema=False,
+    response_class=PlainTextResponse,
+    dependencies=[Depends(verify_metrics_token)],
+)
+async def get_metrics() -> str:
+    return metrics.render()
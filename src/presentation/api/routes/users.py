@@ -1,12 +1,13 @@
 from dependency_injector.wiring import inject
-from fastapi import APIRouter, Request
+from fastapi import APIRouter, Query, Request
 
 from src.application.errors import AccessError
 from src.application.use_cases.add_funds import AddFunds
 from src.application.use_cases.show_inventory import ShowInventory
 from ..depends import AuthenticatedUserDep, limiter, IdempotentRequestDep, WriteContextDep, ReadContextDep
 from ..schema.requests import AddFundsRequest
-from ..schema.responses import InventoryResponse, FundsAddedResponse, InventoryItem
+from ..schema.responses import InventoryResponse, FundsAddedResponse
+from ..serialization import json_response
 
 router = APIRouter(prefix="/users", tags=["users"])
 
@@ -32,8 +33,12 @@ async def add_funds(
 @router.get(
     "/{user_id}/inventory",
     summary="Show inventory",
-    description="Show user's product inventory",
+    description=(
+        "Show user's product inventory ordered by quantity. Pass `limit` (and then `cursor`) to page through it "
+        "ordered by product id instead"
+    ),
     response_description="List of products in user's inventory",
+    response_model=InventoryResponse,
 )
 @limiter.limit("100/second")
 @inject
@@ -42,20 +47,13 @@ async def get_inventory(
     user_id: int,
     user_dep: AuthenticatedUserDep,
     ctx: ReadContextDep,
-) -> InventoryResponse:
+    cursor: int = Query(default=None, description="`next_cursor` of the previous page"),
+    limit: int = Query(default=None, description="Page size", ge=1, le=1000),
+):
     if user_id != user_dep:
         raise AccessError
     usecase = ShowInventory(ctx)
-    result = await usecase(user_dep)
-    inventory_items = [
-        InventoryItem(
-            name=item["product"]["name"],
-            type=item["product"]["type"],
-            price=item["product"]["price"],
-            quantity=item["quantity"],
-            purchased_at=item["purchased_at"],
-        )
-        for item in result
-    ]
-
-    return InventoryResponse(products=inventory_items)
+    if limit is not None or cursor is not None:
+        items, next_cursor = await usecase.page(user_dep, cursor, limit or 100)
+        return json_response({"products": items, "next_cursor": next_cursor})
+    return json_response({"products": await usecase(user_dep), "next_cursor": None})
@@ -4,6 +4,7 @@ from pydantic import BaseModel, Field
 
 
 class InventoryItem(BaseModel):
+    product_id: int = Field(description="ID of the product")
     name: str = Field(description="Name of the inventory item")
     type: str = Field(description="Product type (consumable | permanent)")
     price: int = Field(description="Product price")
@@ -13,6 +14,7 @@ class InventoryItem(BaseModel):
 
 class InventoryResponse(BaseModel):
     products: list[InventoryItem] = Field(description="Products list")
+    next_cursor: int | None = Field(default=None, description="Cursor of the next page, if there is one")
 
 
 class PopularProduct(BaseModel):
@@ -68,6 +70,14 @@ COMMON_RESPONSES = {
             }
         },
     },
+    409: {
+        "description": "Conflict",
+        "content": {
+            "application/json": {
+                "example": {"error": "Conflict", "details (optional)": [{"description": "error description"}]}
+            }
+        },
+    },
     429: {
         "description": "Too many requests",
         "content": {"application/json": {"example": {"error": "Rate limit exceeded"}}},
@@ -0,0 +1,15 @@
+from typing import Any
+
+import orjson
+from starlette.responses import Response
+
+
+class JSONBytesResponse(Response):
+    """JSON response from ready-made bytes, skipping response-model validation and re-encoding"""
+
+    media_type = "application/json"
+
+
+def json_response(content: Any) -> JSONBytesResponse:
+    return JSONBytesResponse(orjson.dumps(content))
+
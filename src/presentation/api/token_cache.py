@@ -0,0 +1,63 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+import jwt
+
+from src.infrastructure.utils.helpers import generate_hash
+
+
+class VerifiedToken(NamedTuple):
+    payload: dict
+    # ``exp`` claim as a UNIX timestamp, None if the token doesn't expire
+    expires_at: float | None
+    rate_limit_key: str
+
+
+class VerifiedTokenCache:
+    """Bounded LRU of verified tokens, so a client's repeated requests skip the HS256 check and the SHA-256 of its
+    rate limit key. Entries are dropped once the token expires, after which it fails verification as usual."""
+
+    def __init__(self, secret_key: str, max_size: int = 10000, algorithms: list[str] = None):
+        self.secret_key = secret_key
+        self.max_size = max_size
+        self.algorithms = algorithms or ["HS256"]
+        self._tokens: OrderedDict[str, VerifiedToken] = OrderedDict()
+        # Sync dependencies run in FastAPI's threadpool, so concurrent requests share the LRU across threads
+        self._lock = threading.Lock()
+
+    def verify(self, token: str) -> VerifiedToken:
+        """Returns the verified token, raising ``jwt.InvalidTokenError`` if it isn't valid"""
+        verified = self._lookup(token)
+        if verified is not None:
+            return verified
+        payload = jwt.decode(token, self.secret_key, algorithms=self.algorithms)
+        expires_at = payload.get("exp")
+        verified = VerifiedToken(payload, None if expires_at is None else float(expires_at), rate_limit_key(token))
+        with self._lock:
+            self._tokens[token] = verified
+            if len(self._tokens) > self.max_size:
+                self._tokens.popitem(last=False)
+        return verified
+
+    def rate_limit_key(self, token: str) -> str:
+        verified = self._lookup(token)
+        if verified is None:
+            return rate_limit_key(token)
+        return verified.rate_limit_key
+
+    def _lookup(self, token: str) -> VerifiedToken | None:
+        with self._lock:
+            verified = self._tokens.get(token)
+            if verified is None:
+                return None
+            if verified.expires_at is not None and verified.expires_at <= time.time():
+                self._tokens.pop(token, None)
+                return None
+            self._tokens.move_to_end(token)
+            return verified
+
+
+def rate_limit_key(token: str) -> str:
+    return f"token:{generate_hash(token)}"
@@ -1,15 +1,23 @@
+import asyncio
+from collections import namedtuple
 from typing import Dict, List
+from src.infrastructure.idempotency import CacheIdempotency
+from src.infrastructure.read_through import CacheReadThrough
 from src.interfaces.cache import Cache
+from src.interfaces.consumption import ConsumptionCounter
 from src.interfaces.uow import UnitOfWork
 from src.interfaces.domain_model import DomainModel
 from src.application.models.user import User
 from src.application.models.product import Product
 from src.application.models.inventory import Inventory
+from src.application.catalog import ProductCatalog
+from src.application.single_flight import SingleFlight
 
 
 class MockCache(Cache):
     def __init__(self):
         self.data: Dict[str, str] = {}
+        self.published: list[tuple[str, str]] = []
 
     async def get(self, key: str, options: dict = None) -> str | None:
         return self.data.get(key)
@@ -17,6 +25,15 @@ class MockCache(Cache):
     async def set(self, key: str, value: str, options: dict = None) -> None:
         self.data[key] = value
 
+    async def mget(self, keys: list[str], options: dict = None) -> list[str | None]:
+        return [self.data.get(key) for key in keys]
+
+    async def add(self, key: str, value: str, options: dict = None) -> bool:
+        if key in self.data:
+            return False
+        self.data[key] = value
+        return True
+
     async def delete(self, key: str, options: dict = None) -> None:
         self.data.pop(key, None)
 
@@ -25,6 +42,60 @@ class MockCache(Cache):
             if pattern in key:
                 yield key
 
+    async def hgetall(self, key: str, options: dict = None) -> dict[str, str]:
+        return dict(self.data.get(key, {}))
+
+    async def hset(self, key: str, mapping: dict[str, str], options: dict = None) -> None:
+        if (options or {}).get("replace") or key not in self.data:
+            self.data[key] = {}
+        self.data[key].update(mapping)
+
+    async def hdel(self, key: str, fields: list[str], options: dict = None) -> None:
+        for field in fields:
+            self.data.get(key, {}).pop(field, None)
+
+    async def zincrby(self, key: str, member: str, amount: float, options: dict = None) -> None:
+        zset = self.data.setdefault(key, {})
+        zset[member] = zset.get(member, 0) + amount
+
+    async def zadd(self, key: str, mapping: dict[str, float], options: dict = None) -> None:
+        if (options or {}).get("replace") or key not in self.data:
+            self.data[key] = {}
+        self.data[key].update(mapping)
+
+    async def zunionstore(self, destination: str, keys: list[str], options: dict = None) -> None:
+        union = {}
+        for key in keys:
+            for member, score in self.data.get(key, {}).items():
+                union[member] = union.get(member, 0) + score
+        self.data[destination] = union
+
+    async def zrange(self, key: str, start: int, end: int, options: dict = None) -> list[tuple[str, float]]:
+        ranked = sorted(self.data.get(key, {}).items(), key=lambda item: item[1], reverse=True)
+        return ranked[start : end + 1]
+
+    async def incr(self, key: str, amount: int = 1, options: dict = None) -> int:
+        self.data[key] = str(int(self.data.get(key, 0)) + amount)
+        return int(self.data[key])
+
+    async def publish(self, channel: str, message: str, options: dict = None) -> None:
+        self.published.append((channel, message))
+
+    async def xadd(self, stream: str, fields: dict[str, str], options: dict = None) -> str:
+        entries = self.data.setdefault(stream, [])
+        entries.append(fields)
+        return f"0-{len(entries)}"
+
+    async def xrange(
+        self, stream: str, start: str = "-", end: str = "+", options: dict = None
+    ) -> list[tuple[str, dict[str, str]]]:
+        entries = [(f"0-{n}", fields) for n, fields in enumerate(self.data.get(stream, []), 1)]
+        if start.startswith("("):
+            entries = [entry for entry in entries if int(entry[0][2:]) > int(start.rsplit("-", 1)[1])]
+        if (options or {}).get("reverse"):
+            entries.reverse()
+        return entries[: (options or {}).get("count")]
+
 
 class MockUnitOfWork(UnitOfWork):
     def __init__(self, cache: Cache):
@@ -44,9 +115,12 @@ class MockUnitOfWork(UnitOfWork):
 
     async def commit(self):
         self.committed = True
+        await self.cache.apply(self._cache_operations)
+        self._cache_operations.clear()
 
     async def rollback(self):
         self.rolled_back = True
+        self._cache_operations.clear()
 
     async def persist(self, objs: list[DomainModel]):
         self.persisted_objects.extend(objs)
@@ -60,6 +134,9 @@ class MockUnitOfWork(UnitOfWork):
     async def _rollback_to_savepoint(self): pass
 
 
+InventoryItemRow = namedtuple("InventoryItemRow", "product_id name type price quantity purchased_at")
+
+
 class MockUserRepository:
     def __init__(self):
         self.users = {}
@@ -72,7 +149,8 @@ class MockUserRepository:
 
 
 class MockInventoryRepository:
-    def __init__(self):
+    def __init__(self, user_repo: MockUserRepository):
+        self.user_repo = user_repo
         self.inventories = {}
         self.products = {}
 
@@ -82,8 +160,32 @@ class MockInventoryRepository:
     async def find_product(self, product_id: int) -> Product:
         return self.products.get(product_id)
 
-    async def list(self, user_id: int) -> list[Inventory]:
-        return [inv for (uid, _), inv in self.inventories.items() if uid == user_id]
+    async def list_items(self, user_id: int, cursor: int = None, limit: int = None) -> list[tuple]:
+        inventories = sorted(
+            (inv for (uid, pid), inv in self.inventories.items() if uid == user_id and pid > (cursor or 0)),
+            key=lambda inv: inv.product.id,
+        )
+        rows = [
+            InventoryItemRow(
+                inv.product.id, inv.product.name, inv.product.type, inv.product.price, inv.quantity, inv.purchased_at
+            )
+            for inv in inventories
+        ]
+        return rows if limit is None else rows[:limit]
+
+    async def add_purchase(self, user_id: int, product: Product, quantity: int) -> dict | None:
+        user = self.user_repo.users.get(user_id)
+        if user is None or user.balance < product.price:
+            return None
+        inventory = self.inventories.get((user_id, product.id))
+        if inventory is None:
+            inventory = Inventory(user=user, product=product, quantity=0)
+            self.add_inventory(inventory)
+        elif product.type == Product.Type.PERMANENT and inventory.quantity >= 1:
+            return {"balance": user.balance - product.price, "quantity": None, "purchased_at": None}
+        user.balance -= product.price
+        inventory.quantity += quantity
+        return {"balance": user.balance, "quantity": inventory.quantity, "purchased_at": inventory.purchased_at}
 
     def add_inventory(self, inventory: Inventory):
         self.inventories[(inventory.user.id, inventory.product.id)] = inventory
@@ -92,10 +194,55 @@ class MockInventoryRepository:
         self.products[product.id] = product
 
 
+class MockConsumptionCounter(ConsumptionCounter):
+    def __init__(self, inventory_repo: MockInventoryRepository):
+        self.inventory_repo = inventory_repo
+        self.counts: Dict[tuple[int, int], int] = {}
+        self.events: list[dict[str, str]] = []
+
+    async def consume(self, user_id: int, product_id: int, quantity: int, event: dict[str, str]) -> int | None:
+        if (user_id, product_id) not in self.counts:
+            inventory = await self.inventory_repo.find_inventory(product_id, user_id)
+            if inventory is None:
+                return None
+            self.counts[user_id, product_id] = inventory.quantity
+        previous = self.counts[user_id, product_id]
+        if previous >= quantity:
+            self.counts[user_id, product_id] -= quantity
+            self.events.append({**event, "remaining": str(previous - quantity)})
+        return previous
+
+
+class MockProductRepository:
+    def __init__(self, inventory_repo: MockInventoryRepository):
+        self.inventory_repo = inventory_repo
+        self.popular_products = []
+
+    async def find_popular_products(self, start_date, limit=5) -> list[dict]:
+        await asyncio.sleep(0.01)
+        return self.popular_products[:limit]
+
+    async def list_products(self) -> list[Product]:
+        return [product for product in self.inventory_repo.products.values() if product.is_active]
+
+    async def find_products(self, product_ids: list[int]) -> list[Product]:
+        products = {inv.product.id: inv.product for inv in self.inventory_repo.inventories.values()}
+        products.update(self.inventory_repo.products)
+        return [products[product_id] for product_id in product_ids if product_id in products]
+
+
 class MockContext:
     def __init__(self):
         self.cache = MockCache()
         self.uow = MockUnitOfWork(self.cache)
+        self.idempotency = CacheIdempotency(self.cache)
         self.user_repo = MockUserRepository()
-        self.inventory_repo = MockInventoryRepository()
-        self.maximum_allowed = 10000
\ No newline at end of file
+        self.inventory_repo = MockInventoryRepository(self.user_repo)
+        self.snapshot_inventory_repo = self.inventory_repo
+        self.product_repo = MockProductRepository(self.inventory_repo)
+        self.read_through = CacheReadThrough(self.cache, SingleFlight())
+        self.catalog = ProductCatalog(self.product_repo, self.cache)
+        self.popular_products_backend = "counters"
+        self.maximum_allowed = 10000
+        self.user_lock = None
+        self.consumption = None
\ No newline at end of file
@@ -1,9 +1,15 @@
+import asyncio
 from uuid import uuid4
 
 import pytest
 from httpx import AsyncClient
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import create_async_engine
 
+from src.infrastructure.db import orm
 from src.infrastructure.utils.helpers import generate_jwt
+from src.presentation.api import depends
+from src.presentation.api.depends import limiter
 from src.presentation.api.main import app
 
 
@@ -78,4 +84,130 @@ class TestAPIIntegration:
             f"/users/{current_user_data['user_id']}/inventory", headers=current_user_data["headers"],
         )
         assert response.status_code == 200
-        assert response.json()["products"]
\ No newline at end of file
+        assert response.json()["products"]
+
+    @pytest.mark.asyncio
+    async def test_show_inventory_page(self, api_client: AsyncClient, current_user_data):
+        response = await api_client.get(
+            f"/users/{current_user_data['user_id']}/inventory",
+            params={"limit": 1},
+            headers=current_user_data["headers"],
+        )
+        assert response.status_code == 200
+        data = response.json()
+        assert [item["product_id"] for item in data["products"]] == [current_user_data["product_id"]]
+
+        response = await api_client.get(
+            f"/users/{current_user_data['user_id']}/inventory",
+            params={"limit": 1, "cursor": data["products"][-1]["product_id"]},
+            headers=current_user_data["headers"],
+        )
+        assert response.status_code == 200
+        assert response.json() == {"products": [], "next_cursor": None}
+
+    @pytest.mark.asyncio
+    async def test_metrics_require_the_scrape_token(self, api_client: AsyncClient, current_user_data, monkeypatch):
+        monkeypatch.setattr(depends.settings, "metrics_token", "scrape-token")
+        assert (await api_client.get("/metrics")).status_code in (401, 403)
+        # A user's JWT isn't enough
+        assert (await api_client.get("/metrics", headers=current_user_data["headers"])).status_code == 401
+
+        response = await api_client.get("/metrics", headers={"Authorization": "Bearer scrape-token"})
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+
+    @pytest.mark.asyncio
+    async def test_rate_limit(self, api_client: AsyncClient, current_user_data):
+        # A token of its own, so that the limit isn't shared with other tests or earlier runs
+        jwt = generate_jwt({"id": current_user_data["user_id"], "nonce": str(uuid4())}, app.container.config.secret_key())
+        responses = [
+            await api_client.post(
+                f"/products/{current_user_data['product_id']}/purchase",
+                headers={"Authorization": f"Bearer {jwt}", "Idempotency-Key": str(uuid4())},
+                json={"amount": 1},
+            )
+            for _ in range(3)
+        ]
+
+        assert [response.headers["X-RateLimit-Remaining"] for response in responses] == ["1", "0", "0"]
+        assert responses[0].headers["X-RateLimit-Limit"] == "2"
+        assert responses[2].status_code == 429
+        assert int(responses[2].headers["Retry-After"]) > 0
+
+class TestConcurrency:
+    @pytest.fixture
+    def no_rate_limit(self):
+        limiter.enabled = False
+        yield
+        limiter.enabled = True
+
+    @staticmethod
+    async def balance_and_quantity(user_id: int, product_id: int) -> tuple[int, int]:
+        engine = create_async_engine(app.container.config.database_url())
+        async with engine.connect() as connection:
+            balance = await connection.scalar(select(orm.user_table.c.balance).where(orm.user_table.c.id == user_id))
+            quantity = await connection.scalar(
+                select(orm.inventory_table.c.quantity).where(
+                    orm.inventory_table.c.user_id == user_id, orm.inventory_table.c.product_id == product_id
+                )
+            )
+        await engine.dispose()
+        return balance, quantity
+
+    @staticmethod
+    async def restore(user_id: int, product_id: int, balance: int, quantity: int):
+        engine = create_async_engine(app.container.config.database_url())
+        async with engine.begin() as connection:
+            await connection.execute(update(orm.user_table).where(orm.user_table.c.id == user_id).values(balance=balance))
+            await connection.execute(
+                update(orm.inventory_table)
+                .where(orm.inventory_table.c.user_id == user_id, orm.inventory_table.c.product_id == product_id)
+                .values(quantity=quantity)
+            )
+        await engine.dispose()
+
+    @pytest.fixture
+    async def funded(self, api_client: AsyncClient, current_user_data):
+        """Commits the requests' writes on a balance worth ``purchases`` of the product, and restores the user's
+        balance and inventory afterwards"""
+        user_id, product_id = current_user_data["user_id"], current_user_data["product_id"]
+        balance, quantity = await self.balance_and_quantity(user_id, product_id)
+        engine = create_async_engine(app.container.config.database_url())
+        async with engine.connect() as connection:
+            price = await connection.scalar(select(orm.product_table.c.price).where(orm.product_table.c.id == product_id))
+        await engine.dispose()
+        purchases = 150
+        await self.restore(user_id, product_id, balance=price * purchases, quantity=quantity)
+        app.container.config.set("active_test", False)
+        yield price, purchases
+        app.container.config.set("active_test", True)
+        await self.restore(user_id, product_id, balance=balance, quantity=quantity)
+
+    @pytest.mark.asyncio
+    async def test_parallel_purchases_and_reads(
+        self, api_client: AsyncClient, current_user_data, no_rate_limit, funded
+    ):
+        auth = {"Authorization": current_user_data["headers"]["Authorization"]}
+        user_id, product_id = current_user_data["user_id"], current_user_data["product_id"]
+        price, affordable = funded
+        balance, quantity = await self.balance_and_quantity(user_id, product_id)
+        purchases = [
+            api_client.post(
+                f"/products/{current_user_data['product_id']}/purchase",
+                headers={**auth, "Idempotency-Key": str(uuid4())},
+                json={"amount": 1},
+            )
+            for _ in range(200)
+        ]
+        reads = [
+            api_client.get(f"/users/{current_user_data['user_id']}/inventory", headers=auth) for _ in range(200)
+        ]
+
+        responses = await asyncio.gather(*purchases, *reads)
+
+        purchase_responses, read_responses = responses[:200], responses[200:]
+        assert all(response.status_code in (200, 400) for response in purchase_responses)
+        assert all(response.status_code == 200 for response in read_responses)
+        purchased = sum(response.status_code == 200 for response in purchase_responses)
+        assert purchased == affordable
+        assert await self.balance_and_quantity(user_id, product_id) == (balance - price * purchased, quantity + purchased)
@@ -1,9 +1,17 @@
+import asyncio
+import time
 from uuid import uuid4
 import json
 
 import pytest
 
 from src.application.errors import ValidationError, NotFound
+from src.application.inventory_cache import (
+    current_inventory_key,
+    invalidate_inventories,
+    invalidate_inventory,
+    inventory_key,
+)
 from src.application.models.inventory import Inventory
 from src.application.models.product import Product
 from src.application.models.user import User
@@ -11,7 +19,9 @@ from src.application.use_cases.add_funds import AddFunds
 from src.application.use_cases.add_purchase import AddPurchase
 from src.application.use_cases.consume_product import ConsumeProduct
 from src.application.use_cases.show_inventory import ShowInventory
-from .mocks import MockContext
+from src.application.use_cases.show_popular_products import ShowPopularProducts
+from src.infrastructure.keyed_lock import LocalKeyedLock
+from .mocks import MockConsumptionCounter, MockContext, MockInventoryRepository
 
 
 @pytest.fixture
@@ -72,6 +82,44 @@ class TestAddPurchase:
         with pytest.raises(ValidationError, match="Insufficient balance"):
             await use_case(sample_product.id, sample_user.id, str(uuid4()), 1)
 
+    @pytest.mark.asyncio
+    async def test_purchase_patches_cached_inventory(self, mock_ctx, sample_user, sample_product):
+        mock_ctx.user_repo.add_user(sample_user)
+        mock_ctx.inventory_repo.add_product(sample_product)
+        await mock_ctx.cache.hset(inventory_key("0", sample_user.id), {"_complete": "1"})
+
+        use_case = AddPurchase(mock_ctx)
+        await use_case(sample_product.id, sample_user.id, str(uuid4()), 2)
+
+        inventory = await ShowInventory(mock_ctx)(sample_user.id)
+        assert [(item["product_id"], item["quantity"]) for item in inventory] == [(sample_product.id, 2)]
+
+    @pytest.mark.asyncio
+    async def test_purchase_owned_permanent_product(self, mock_ctx, sample_user, sample_product):
+        sample_product.type = Product.Type.PERMANENT
+        mock_ctx.user_repo.add_user(sample_user)
+        mock_ctx.inventory_repo.add_product(sample_product)
+        mock_ctx.inventory_repo.add_inventory(Inventory(user=sample_user, product=sample_product, quantity=1))
+
+        use_case = AddPurchase(mock_ctx)
+
+        with pytest.raises(ValidationError, match="Permanent product already purchased"):
+            await use_case(sample_product.id, sample_user.id, str(uuid4()), 1)
+        assert sample_user.balance == 1000
+
+
+    @pytest.mark.asyncio
+    async def test_purchase_emits_transaction_event(self, mock_ctx, sample_user, sample_product):
+        mock_ctx.user_repo.add_user(sample_user)
+        mock_ctx.inventory_repo.add_product(sample_product)
+
+        await AddPurchase(mock_ctx)(sample_product.id, sample_user.id, "key", 1)
+
+        [event] = mock_ctx.cache.data["events:transactions"]
+        assert event["type"] == "product_purchased"
+        assert (event["id"], event["user_id"], event["product_id"]) == ("key", "1", "1")
+        assert (event["amount"], event["balance"]) == ("100", "900")
+
 
 class TestAddFunds:
     @pytest.mark.asyncio
@@ -85,6 +133,29 @@ class TestAddFunds:
         assert result["previous_balance"] == 1000
         assert result["current_balance"] == 1500
 
+    @pytest.mark.asyncio
+    async def test_add_funds_of_one_user_run_one_at_a_time(self, mock_ctx, sample_user):
+        mock_ctx.user_repo.add_user(sample_user)
+        mock_ctx.user_lock = LocalKeyedLock()
+        find_user = mock_ctx.user_repo.find_user
+        running, overlapping = 0, 0
+
+        async def slow_find_user(user_id):
+            nonlocal running, overlapping
+            running += 1
+            overlapping = max(overlapping, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            return await find_user(user_id)
+
+        mock_ctx.user_repo.find_user = slow_find_user
+
+        results = await asyncio.gather(*[AddFunds(mock_ctx)(sample_user.id, 100, str(uuid4())) for _ in range(5)])
+
+        assert overlapping == 1
+        assert sorted(result["current_balance"] for result in results) == [1100, 1200, 1300, 1400, 1500]
+        assert len(mock_ctx.user_lock) == 0
+
     @pytest.mark.asyncio
     async def test_add_funds_idempotency(self, mock_ctx, sample_user):
         mock_ctx.user_repo.add_user(sample_user)
@@ -97,6 +168,49 @@ class TestAddFunds:
         assert result["previous_balance"] == 1000
         assert result["current_balance"] == 1500
 
+    @pytest.mark.asyncio
+    async def test_add_funds_replays_stored_result(self, mock_ctx, sample_user):
+        mock_ctx.user_repo.add_user(sample_user)
+        idempotency_hash = str(uuid4())
+
+        use_case = AddFunds(mock_ctx)
+        first = await use_case(sample_user.id, 500, idempotency_hash)
+        second = await use_case(sample_user.id, 500, idempotency_hash)
+
+        assert first == second
+        assert sample_user.balance == 1500
+
+    @pytest.mark.asyncio
+    async def test_concurrent_duplicates_run_once(self, mock_ctx, sample_user):
+        mock_ctx.user_repo.add_user(sample_user)
+        idempotency_hash = str(uuid4())
+        find_user = mock_ctx.user_repo.find_user
+
+        async def slow_find_user(user_id: int):
+            await asyncio.sleep(0.05)
+            return await find_user(user_id)
+
+        mock_ctx.user_repo.find_user = slow_find_user
+
+        use_case = AddFunds(mock_ctx)
+        results = await asyncio.gather(*[use_case(sample_user.id, 500, idempotency_hash) for _ in range(10)])
+
+        assert all(result == results[0] for result in results)
+        assert sample_user.balance == 1500
+        assert len([obj for obj in mock_ctx.uow.persisted_objects if isinstance(obj, User)]) == 1
+
+    @pytest.mark.asyncio
+    async def test_failed_request_releases_key(self, mock_ctx, sample_user):
+        mock_ctx.user_repo.add_user(sample_user)
+        idempotency_hash = str(uuid4())
+
+        use_case = AddFunds(mock_ctx)
+        with pytest.raises(ValidationError):
+            await use_case(sample_user.id, 20000, idempotency_hash)
+        result = await use_case(sample_user.id, 500, idempotency_hash)
+
+        assert result["current_balance"] == 1500
+
     @pytest.mark.asyncio
     async def test_add_funds_exceeds_maximum(self, mock_ctx, sample_user):
         mock_ctx.user_repo.add_user(sample_user)
@@ -138,17 +252,81 @@ class TestConsumeProduct:
             await use_case(sample_product.id, sample_user.id, str(uuid4()), 1)
 
 
+    @pytest.mark.asyncio
+    async def test_consume_behind_counts_without_a_transaction(self, mock_ctx, sample_user, sample_product):
+        mock_ctx.consumption = MockConsumptionCounter(mock_ctx.inventory_repo)
+        mock_ctx.inventory_repo.add_product(sample_product)
+        mock_ctx.inventory_repo.add_inventory(Inventory(user=sample_user, product=sample_product, quantity=3))
+        use_case = ConsumeProduct(mock_ctx)
+
+        result = await use_case(sample_product.id, sample_user.id, str(uuid4()), 2)
+        with pytest.raises(ValidationError, match="Insufficient quantity"):
+            await use_case(sample_product.id, sample_user.id, str(uuid4()), 2)
+        with pytest.raises(NotFound):
+            await use_case(2, sample_user.id, str(uuid4()))
+
+        assert result["previous_quantity"] == 3
+        assert result["current_quantity"] == 1
+        assert mock_ctx.consumption.counts == {(sample_user.id, sample_product.id): 1}
+        assert [event["remaining"] for event in mock_ctx.consumption.events] == ["1"]
+        assert not mock_ctx.uow.committed
+
+    @pytest.mark.asyncio
+    async def test_purchase_drops_the_consumption_count(self, mock_ctx, sample_user, sample_product):
+        mock_ctx.consumption = MockConsumptionCounter(mock_ctx.inventory_repo)
+        mock_ctx.user_repo.add_user(sample_user)
+        mock_ctx.inventory_repo.add_product(sample_product)
+        await mock_ctx.cache.hset("consumption:counts:1", {"1": "0"})
+
+        await AddPurchase(mock_ctx)(sample_product.id, sample_user.id, str(uuid4()))
+
+        assert await mock_ctx.cache.hgetall("consumption:counts:1") == {}
+
+
 class TestShowInventory:
     @pytest.mark.asyncio
-    async def test_show_inventory_from_cache(self, mock_ctx, sample_user):
-        cached_data = json.dumps([{"product_id": 1, "quantity": 2}])
-        await mock_ctx.cache.set(f"inventory:{sample_user.id}", cached_data)
-        
+    async def test_show_inventory_from_cache(self, mock_ctx, sample_user, sample_product):
+        mock_ctx.inventory_repo.add_product(sample_product)
+        entry = {"quantity": 2, "purchased_at": "2025-01-01T00:00:00"}
+        cached_data = {"_complete": str(time.time() + 60), "1": json.dumps(entry)}
+        await mock_ctx.cache.hset(inventory_key("0", sample_user.id), cached_data)
+
         use_case = ShowInventory(mock_ctx)
-        await use_case(sample_user.id)
-        
-        cache_hit = await mock_ctx.cache.get(f"inventory:{sample_user.id}")
-        assert cache_hit is not None
+        result = await use_case(sample_user.id)
+
+        assert result == [
+            {"product_id": 1, "name": "Test Product", "type": "consumable", "price": 100, **entry}
+        ]
+
+    @pytest.mark.asyncio
+    async def test_show_inventory_ignores_partial_cache(self, mock_ctx, sample_user, sample_product):
+        inventory = Inventory(user=sample_user, product=sample_product, quantity=3)
+        mock_ctx.inventory_repo.add_inventory(inventory)
+        await mock_ctx.cache.hset(inventory_key("0", sample_user.id), {"2": json.dumps({"product_id": 2, "quantity": 1})})
+
+        use_case = ShowInventory(mock_ctx)
+        result = await use_case(sample_user.id)
+
+        assert [item["product_id"] for item in result] == [sample_product.id]
+
+    @pytest.mark.asyncio
+    async def test_show_inventory_pages(self, mock_ctx, sample_user):
+        for product_id in range(1, 6):
+            product = Product(
+                id=product_id, name=f"Product {product_id}", description="Test", price=10,
+                type=Product.Type.CONSUMABLE, is_active=True
+            )
+            mock_ctx.inventory_repo.add_inventory(Inventory(user=sample_user, product=product, quantity=1))
+
+        use_case = ShowInventory(mock_ctx)
+        pages, cursor = [], None
+        while True:
+            items, cursor = await use_case.page(sample_user.id, cursor, limit=2)
+            pages.append([item["product_id"] for item in items])
+            if cursor is None:
+                break
+
+        assert pages == [[1, 2], [3, 4], [5]]
 
     @pytest.mark.asyncio
     async def test_show_inventory_from_db(self, mock_ctx, sample_user, sample_product):
@@ -159,5 +337,101 @@ class TestShowInventory:
         result = await use_case(sample_user.id)
         
         assert len(result) == 1
-        cache_value = await mock_ctx.cache.get(f"inventory:{sample_user.id}")
-        assert cache_value is not None
\ No newline at end of file
+        cache_value = await mock_ctx.cache.hgetall(inventory_key("0", sample_user.id))
+        assert str(sample_product.id) in cache_value
+
+    @pytest.mark.asyncio
+    async def test_cached_snapshot_is_built_from_the_primary(self, mock_ctx, sample_user, sample_product):
+        # The replica hasn't replayed the purchase yet
+        mock_ctx.inventory_repo.add_product(sample_product)
+        mock_ctx.snapshot_inventory_repo = MockInventoryRepository(mock_ctx.user_repo)
+        mock_ctx.snapshot_inventory_repo.add_inventory(Inventory(user=sample_user, product=sample_product, quantity=1))
+
+        result = await ShowInventory(mock_ctx)(sample_user.id)
+        page, _ = await ShowInventory(mock_ctx).page(sample_user.id)
+
+        assert [item["product_id"] for item in result] == [sample_product.id]
+        assert page == []
+
+    @pytest.mark.asyncio
+    async def test_cached_items_are_hydrated_from_catalog(self, mock_ctx, sample_user, sample_product):
+        mock_ctx.inventory_repo.add_product(sample_product)
+        mock_ctx.inventory_repo.add_inventory(Inventory(user=sample_user, product=sample_product, quantity=2))
+        await ShowInventory(mock_ctx)(sample_user.id)
+
+        sample_product.name = "Renamed"
+        await mock_ctx.catalog.publish_changes([sample_product.id])
+        mock_ctx.catalog.check_interval = 0
+        result = await ShowInventory(mock_ctx)(sample_user.id)
+
+        assert result[0]["name"] == "Renamed"
+        assert result[0]["quantity"] == 2
+        cached = await mock_ctx.cache.hgetall(inventory_key("0", sample_user.id))
+        assert "name" not in json.loads(cached[str(sample_product.id)])
+
+
+    @pytest.mark.asyncio
+    async def test_invalidation_moves_to_new_hash(self, mock_ctx, sample_user, sample_product):
+        other = User(id=2, username="other", email="other@test.com", balance=0)
+        mock_ctx.inventory_repo.add_inventory(Inventory(user=sample_user, product=sample_product, quantity=1))
+        await ShowInventory(mock_ctx)(sample_user.id)
+        await ShowInventory(mock_ctx)(other.id)
+
+        await invalidate_inventory(mock_ctx.cache, sample_user.id)
+        user_key = await current_inventory_key(mock_ctx.cache, sample_user.id)
+        assert user_key == "inventory:v0.1:1"
+        assert not await mock_ctx.cache.hgetall(user_key)
+        assert await current_inventory_key(mock_ctx.cache, other.id) == inventory_key("0", other.id)
+
+        await invalidate_inventories(mock_ctx.cache)
+        assert await current_inventory_key(mock_ctx.cache, other.id) == "inventory:v1:2"
+        assert await ShowInventory(mock_ctx)(sample_user.id)
+        assert await mock_ctx.cache.hgetall("inventory:v1.1:1")
+
+
+class TestShowPopularProducts:
+    @pytest.mark.asyncio
+    async def test_purchases_feed_popularity_counters(self, mock_ctx, sample_user, sample_product):
+        other = Product(id=2, name="Other", description="Test", price=10, type=Product.Type.CONSUMABLE, is_active=True)
+        mock_ctx.user_repo.add_user(sample_user)
+        mock_ctx.inventory_repo.add_product(sample_product)
+        mock_ctx.inventory_repo.add_product(other)
+
+        await AddPurchase(mock_ctx)(sample_product.id, sample_user.id, str(uuid4()), 1)
+        await AddPurchase(mock_ctx)(other.id, sample_user.id, str(uuid4()), 2)
+
+        result = await ShowPopularProducts(mock_ctx)(limit=5)
+
+        assert [(item["product_id"], item["purchase_count"]) for item in result] == [(2, 2), (1, 1)]
+        assert result[0]["name"] == "Other"
+        assert len(mock_ctx.catalog) == 2
+
+    @pytest.mark.asyncio
+    async def test_failed_purchase_does_not_count(self, mock_ctx, sample_user, sample_product):
+        sample_user.balance = 0
+        mock_ctx.user_repo.add_user(sample_user)
+        mock_ctx.inventory_repo.add_product(sample_product)
+
+        with pytest.raises(ValidationError):
+            await AddPurchase(mock_ctx)(sample_product.id, sample_user.id, str(uuid4()), 1)
+
+        assert await ShowPopularProducts(mock_ctx)(limit=5) == []
+
+    @pytest.mark.asyncio
+    async def test_top_products_computed_once_and_sliced(self, mock_ctx):
+        mock_ctx.popular_products_backend = "sql"
+        mock_ctx.product_repo.popular_products = [{"product_id": n, "purchase_count": 100 - n} for n in range(20)]
+        calls = []
+        find_popular_products = mock_ctx.product_repo.find_popular_products
+
+        async def counting_find_popular_products(start_date, limit=5):
+            calls.append(limit)
+            return await find_popular_products(start_date, limit)
+
+        mock_ctx.product_repo.find_popular_products = counting_find_popular_products
+        use_case = ShowPopularProducts(mock_ctx)
+
+        results = await asyncio.gather(*[use_case(limit=limit) for limit in (1, 5, 10, 5, 1)])
+        assert [len(result) for result in results] == [1, 5, 10, 5, 1]
+        assert await use_case(limit=3) == mock_ctx.product_repo.popular_products[:3]
+        assert calls == [100]